@@ -19,26 +19,72 @@
 # LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import json
+import time
 from os.path import dirname, join
-from typing import Optional
+from threading import Event, Thread
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from ovos_plugin_common_play import MediaType
 from ovos_utils import classproperty
 from ovos_utils.messagebus import Message
 from ovos_utils.process_utils import RuntimeRequirements
-from ovos_workshop.backwards_compat import Playlist
-from ovos_workshop.skills.common_play import OVOSCommonPlaybackSkill, ocp_search
+from ovos_workshop.backwards_compat import MediaEntry, PlaybackType, Playlist
+from ovos_workshop.skills.common_play import (
+    OVOSCommonPlaybackSkill,
+    ocp_play,
+    ocp_search,
+)
 
-from .plex_api import PlexAPI
+from .library_sync import LibrarySync
+from .phrase_parser import PhraseParser
+from .plex_api import PlexAPI, parse_lazy_uri
+from .search_cache import SearchCache
+from .server_health import ServerHealth
+from .session_pool import SessionPool
+from .smart_queues import QUEUE_KIND, SmartQueues
+from .stream_resolver import StreamResolver
+from .tracing import LatencyHistograms, SearchTrace, record, span
+
+RESULT_TYPES = {
+    "music": MediaType.MUSIC,
+    "movies": MediaType.MOVIE,
+    "shows": MediaType.TV,
+}
+
+# Vocabularies removed from search phrases and reported as media hints
+PHRASE_VOCABS = ("plex", "movie", "tv")
+
+# Vocabularies of radio, shuffle and continue watching requests
+SMART_VOCABS = ("radio", "shuffle", "continue", "library")
+
+# Where in a phrase the smart queue vocabularies are recognized, so titles such
+# as "Radio Ga Ga" or "Harlem Shuffle" are still searched as titles
+VOCAB_ANCHORS = {"radio": "end", "shuffle": "start", "continue": "start", "library": "end"}
+
+MUSIC_TYPES = (MediaType.MUSIC, MediaType.AUDIO, MediaType.GENERIC)
+
+# Seconds before retrying a failed connection to Plex, doubled after each failure
+CONNECT_RETRY_DELAY = 5
+CONNECT_RETRY_MAX_DELAY = 300
 
 
 class PlexSkill(OVOSCommonPlaybackSkill):
     """Plex OCP Skill"""
 
     def __init__(self, *args, bus=None, skill_id='', **kwargs):
+        # initialize() runs inside the base class constructor, set its state first
+        self._plex_api: Optional[PlexAPI] = None
+        self._plex_ready = Event()
+        self._stopping = Event()
+        self._library_sync: Optional[LibrarySync] = None
+        self._lazy_queue: List[MediaEntry] = []
+        self._smart_queues: Optional[SmartQueues] = None
+        self.search_metrics = LatencyHistograms()
+        self._phrase_parsers: Dict[Tuple[str, Tuple[str, ...]], PhraseParser] = {}
+        self.time_to_ready: Optional[float] = None
         super().__init__(*args, bus=bus, skill_id=skill_id, **kwargs)
         self.skill_icon = join(dirname(__file__), "ui", "plex.png")
-        self._plex_api = None
         self.supported_media = [
             MediaType.GENERIC,
             MediaType.MUSIC,
@@ -53,7 +99,10 @@ class PlexSkill(OVOSCommonPlaybackSkill):
         ]
 
     def initialize(self):
-        self._plex_api: Optional[PlexAPI] = self.plex_api
+        self.add_event(f"{self.skill_id}.metrics", self.handle_metrics)
+        self.phrase_parser()
+        self.phrase_parser(vocabs=SMART_VOCABS)
+        Thread(target=self._connect_plex, daemon=True, name="PlexConnect").start()
 
     @classproperty
     def runtime_requirements(self):
@@ -75,21 +124,163 @@ class PlexSkill(OVOSCommonPlaybackSkill):
         return self.settings.get("base_confidence_score") or 95
 
     @property
-    def plex_api(self) -> PlexAPI:
+    def index_path(self) -> Optional[str]:
+        """Path of the local library index, or None if it is disabled in settings"""
+        if self.settings.get("local_index"):
+            return join(self.file_system.path, "library_index.sqlite")
+        return None
+
+    @property
+    def server_cache_path(self) -> Optional[str]:
+        """Path of the server discovery cache, or None if it is disabled in settings"""
+        if self.settings.get("server_cache", True):
+            return join(self.file_system.path, "servers.json")
+        return None
+
+    @property
+    def search_cache_path(self) -> Optional[str]:
+        """Path to persist search results to, or None to keep them in memory only"""
+        if self.settings.get("search_cache_persist"):
+            return join(self.file_system.path, "search_cache.json")
+        return None
+
+    @property
+    def profile_threshold(self) -> float:
+        """Searches slower than this many seconds log a profile, 0 disables profiling"""
+        return float(self.settings.get("profile_slow_searches") or 0)
+
+    def phrase_parser(
+        self, lang: Optional[str] = None, vocabs: Tuple[str, ...] = PHRASE_VOCABS
+    ) -> PhraseParser:
+        """Compiled parser for vocabularies of a language, built on first use"""
+        key = (lang or self.lang, vocabs)
+        if key not in self._phrase_parsers:
+            vocabularies = {}
+            for name in vocabs:
+                try:
+                    vocabularies[name] = self.voc_list(name, key[0])
+                except FileNotFoundError:
+                    self.log.warning("No %s vocabulary for %s", name, key[0])
+            self._phrase_parsers[key] = PhraseParser(vocabularies, VOCAB_ANCHORS)
+        return self._phrase_parsers[key]
+
+    @property
+    def smart_queues(self) -> Optional[SmartQueues]:
+        """Radio, shuffle and continue watching queues, None if disabled in settings"""
+        return self._smart_queues
+
+    @property
+    def plex_ready(self) -> bool:
+        """True once PlexAPI has connected to the servers and can be searched"""
+        return self._plex_ready.is_set()
+
+    @property
+    def plex_api(self) -> Optional[PlexAPI]:
         """
-        Instantiate PlexAPI class using the token from settings.json
-        :returns: PlexAPI class
+        PlexAPI instance created by the background connection
+        :returns: PlexAPI class, or None while still connecting
         """
-        if not self._plex_api:
-            self.log.info("Initializing PlexAPI")
-            if not self.settings.get("token"):
-                self.log.info("No Plex token found, initializing PlexAPI login")
-                self._init_plex_api_key()
-            api_key = self.settings.get("token")
-            self.log.info("Plex token found, getting available servers")
-            self._plex_api = PlexAPI(api_key)
         return self._plex_api
 
+    def _connect_plex(self):
+        """
+        Log in if needed and connect to Plex without blocking the skill loader,
+        retrying with a growing delay until it succeeds or the skill shuts down
+        """
+        start = time.monotonic()
+        delay = CONNECT_RETRY_DELAY
+        while True:
+            try:
+                api = self._create_plex_api()
+                break
+            except Exception as e:  # pylint: disable=broad-except
+                self.log.exception("Unable to connect to Plex, retrying in %ss: %s", delay, e)
+            if self._stopping.wait(delay):
+                return
+            delay = min(delay * 2, CONNECT_RETRY_MAX_DELAY)
+        if self._stopping.is_set():
+            api.close()
+            return
+        self._plex_api = api
+        try:
+            if self._plex_api.index is not None:
+                self._library_sync = LibrarySync(
+                    self._plex_api,
+                    interval=self.settings.get("index_sync_interval") or 900,
+                    listen=self.settings.get("index_listen", False),
+                )
+                self._library_sync.on_change.append(self._plex_api.search_cache.clear)
+                self._library_sync.on_change.append(self._plex_api.refresh_matcher)
+                self._library_sync.start()
+            if self.settings.get("smart_queues", True):
+                self._smart_queues = SmartQueues(self._plex_api)
+                Thread(target=self._smart_queues.warm, daemon=True, name="PlexGenres").start()
+                if self._library_sync:
+                    self._library_sync.on_change.append(self._smart_queues.warm)
+        except Exception as e:  # pylint: disable=broad-except
+            self.log.exception("Unable to start Plex background tasks: %s", e)
+        self.time_to_ready = time.monotonic() - start
+        self._plex_ready.set()
+        self.log.info("PlexAPI ready in %.2fs", self.time_to_ready)
+        self.bus.emit(
+            Message(f"{self.skill_id}.ready", {"time_to_ready": self.time_to_ready})
+        )
+
+    def _create_plex_api(self) -> PlexAPI:
+        """Log in with a PIN if there is no token yet, then discover the servers"""
+        self.log.info("Initializing PlexAPI")
+        if not self.settings.get("token"):
+            self.log.info("No Plex token found, initializing PlexAPI login")
+            self._init_plex_api_key()
+        api_key = self.settings.get("token")
+        self.log.info("Plex token found, getting available servers")
+        return PlexAPI(
+            api_key,
+            index_path=self.index_path,
+            search_timeout=self.settings.get("search_timeout") or 4.0,
+            lazy=self.settings.get("lazy_results", False),
+            page_size=self.settings.get("lazy_page_size") or 50,
+            max_results={
+                "music": self.settings.get("max_music_results") or 100,
+                "movies": self.settings.get("max_movie_results") or 20,
+                "shows": self.settings.get("max_show_results") or 100,
+            },
+            max_hits=self.settings.get("max_search_hits") or 10,
+            fuzzy=self.settings.get("fuzzy_matching", True),
+            latency_interval=self.settings.get("latency_interval", 60),
+            cache_path=self.server_cache_path,
+            cache_ttl=self.settings.get("server_cache_ttl") or 86400,
+            search_cache=SearchCache(
+                max_entries=self.settings.get("search_cache_size", 128),
+                ttl=self.settings.get("search_cache_ttl") or 600,
+                path=self.search_cache_path,
+            ),
+            health=ServerHealth(
+                failure_threshold=self.settings.get("server_failure_threshold") or 2,
+                probe_interval=self.settings.get("server_probe_interval") or 15,
+            ),
+            streams=StreamResolver(
+                max_bitrate=self.settings.get("max_stream_bitrate") or 0,
+                direct_play=self.settings.get("direct_play", True),
+                profile=self.settings.get("direct_play_profile"),
+            ),
+            session_pool=SessionPool(
+                pool_size=self.settings.get("http_pool_size") or 10,
+                connect_timeout=self.settings.get("http_connect_timeout") or 3.05,
+                read_timeout=self.settings.get("http_read_timeout") or 10,
+                retries=self.settings.get("http_retries", 1),
+                backoff=self.settings.get("http_backoff", 0.3),
+            ),
+        )
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._library_sync:
+            self._library_sync.stop()
+        if self._plex_api:
+            self._plex_api.close()
+        super().shutdown()
+
     def _init_plex_api_key(self):
         """Login to Plex API with an account pin, if token is missing."""
         # pylint: disable=import-outside-toplevel
@@ -120,52 +311,55 @@ class PlexSkill(OVOSCommonPlaybackSkill):
         :param media_type: user requested media type
         :returns: list of dict search results
         """
-        # TODO: improved confidence calculation
+        if not self.plex_ready:
+            self.log.info("PlexAPI is still connecting, skipping search for %s", phrase)
+            return
+        self._lazy_queue = []
+        trace = SearchTrace(phrase, self.search_metrics, profile=self.profile_threshold > 0)
+        playlists = self._search_playlists(phrase, media_type)
+        try:
+            while True:
+                # Only the search itself is traced, not what OCP does with each playlist
+                with trace.running():
+                    playlist = next(playlists, None)
+                if playlist is None:
+                    break
+                if self.plex_api.lazy or any(
+                    entry.playback == PlaybackType.SKILL for entry in playlist.entries
+                ):
+                    self._lazy_queue += playlist.entries
+                yield playlist
+        finally:
+            # Also runs when OCP stops consuming results early
+            with trace.running():
+                playlists.close()
+            trace.finish()
+            self._report_trace(trace)
+
+    def _search_playlists(self, phrase: str, media_type: MediaType) -> Iterator[Playlist]:
+        """
+        Parse the phrase and search Plex
+        :returns: one Playlist of every result, or with `progressive_results` enabled
+            a Playlist per library as soon as it answers
+        """
         confidence = self.base_confidence_score
-        if self.voc_match(phrase, "plex"):
+        with span("normalize"):
+            phrase, hints = self.phrase_parser().parse(phrase)
+        if "plex" in hints:
             confidence += 5
-            phrase = self.remove_voc(phrase, "plex")
 
         # Determine what kind of media to play
-        movie_search = self.voc_match(phrase, "movie")
-        tv_search = self.voc_match(phrase, "tv")
-        phrase = self.remove_voc(phrase, "movie")
-        phrase = self.remove_voc(phrase, "tv")
+        movie_search = "movie" in hints
+        tv_search = "tv" in hints
         self.log.info("Media type for search: %s", media_type)
         self.log.info("Perform a movie search? %s", movie_search)
         self.log.info("Perform a tv search? %s", tv_search)
-        phrase = (
-            phrase.replace("plex", "")
-            .replace("plexx", "")
-            .replace(" on ", "")
-            .replace("in ", "")
-            .strip()
-        )
-        playlist = Playlist(
-            skill_id=self.skill_id,
-            skill_icon=self.skill_icon,
-            media_type=media_type,
-            confidence=confidence,
-            title=phrase,
-            artist=phrase,
-        )
-
-        # Music search
-        if media_type in (MediaType.MUSIC, MediaType.AUDIO, MediaType.GENERIC) and (
-            "soundtrack" not in phrase and not movie_search
-        ):
-            self.log.info("Searching Plex Music for %s", phrase)
-            pl = self.plex_api.search_music(phrase)
-            for res in pl:
-                res.match_confidence = (
-                    confidence if media_type == MediaType.GENERIC else confidence + 10
-                )
-                res.skill_id = self.skill_id
-                res.media_type = MediaType.MUSIC
-                playlist.add_entry(res)
-
-        # Movie search
-        if (
+        music_search = media_type in (
+            MediaType.MUSIC,
+            MediaType.AUDIO,
+            MediaType.GENERIC,
+        ) and ("soundtrack" not in phrase and not movie_search)
+        movie_search = (
             media_type
             in (
                 MediaType.MOVIE,
@@ -176,29 +370,170 @@ class PlexSkill(OVOSCommonPlaybackSkill):
                 MediaType.GENERIC,
             )
             and movie_search
-        ):
-            self.log.info("Searching Plex Movies for %s", phrase)
-            pl = self.plex_api.search_movies(phrase)
-            for res in pl:
-                res.match_confidence = (
-                    confidence if media_type == MediaType.GENERIC else confidence + 10
-                )
-                res.skill_id = self.skill_id
-                res.media_type = MediaType.MOVIE
-                playlist.add_entry(res)
-
-        # TV search
-        if (
+        )
+        tv_search = (
             media_type in (MediaType.TV, MediaType.CARTOON, MediaType.GENERIC)
             and tv_search
-        ):
-            self.log.info("Searching Plex TV for %s", phrase)
-            pl = self.plex_api.search_shows(phrase)
-            for res in pl:
+        )
+        kinds = [
+            kind
+            for kind, wanted in (
+                ("music", music_search),
+                ("movies", movie_search),
+                ("shows", tv_search),
+            )
+            if wanted
+        ]
+        # An explicit movie or TV request is a title search, e.g. "berlin station tv series"
+        if self.smart_queues is not None and not (movie_search or tv_search):
+            try:
+                with span("smart_queue"):
+                    smart = self._smart_results(phrase, media_type)
+            except Exception as e:  # pylint: disable=broad-except
+                self.log.warning("Unable to build a Plex play queue for %s: %s", phrase, e)
+                smart = None
+            if smart is not None:
+                kind, entries, requested = smart
+                yield self._playlist(phrase, media_type, confidence, [(kind, entries)])
+                if requested:
+                    return
+        match = self.plex_api.match_score(phrase, kinds)
+        if match is not None:
+            # Scale confidence by how closely the phrase sounds like a title in the library
+            confidence = round(confidence * (0.5 + 0.5 * match))
+            self.log.info("Best Plex title match for %s: %.2f", phrase, match)
+        self.log.info("Searching Plex for %s", phrase)
+        if self.settings.get("progressive_results"):
+            started = time.perf_counter()
+            for kind, entries in self.plex_api.iter_search(
+                phrase, music=music_search, movies=movie_search, shows=tv_search
+            ):
+                if started is not None:
+                    record("first_result", time.perf_counter() - started)
+                    started = None
+                yield self._playlist(phrase, media_type, confidence, [(kind, entries)])
+            return
+        with span("plex_search"):
+            results = self.plex_api.search(
+                phrase, music=music_search, movies=movie_search, shows=tv_search
+            )
+        yield self._playlist(phrase, media_type, confidence, results.items())
+
+    def _smart_results(
+        self, phrase: str, media_type: MediaType
+    ) -> Optional[Tuple[str, List[MediaEntry], bool]]:
+        """
+        Answer radio, shuffle and continue watching requests, and phrases naming a
+        music genre, with a play queue built by the Plex server
+        :returns: (kind, first page of entries, True if the phrase asked for a queue),
+            or None to search as usual
+        """
+        topic, hints = self.phrase_parser(vocabs=SMART_VOCABS).parse(phrase)
+        queues = self.smart_queues
+        if "continue" in hints:
+            if media_type in (MediaType.MUSIC, MediaType.AUDIO):
+                return None
+            entries = queues.continue_show(topic) if topic else queues.continue_watching()
+            return ("shows", entries, True) if entries else None
+        if media_type not in MUSIC_TYPES:
+            return None
+        if not topic and hints & {"shuffle", "library"}:
+            entries = queues.shuffle_library()
+            return ("music", entries, True) if entries else None
+        if not topic:
+            return None
+        if hints & {"radio", "shuffle"}:
+            entries = queues.genre(topic) or queues.artist(topic, radio="radio" in hints)
+            return ("music", entries, True) if entries else None
+        if not hints:
+            entries = queues.genre(topic)
+            return ("music", entries, False) if entries else None
+        return None
+
+    def _playlist(
+        self,
+        phrase: str,
+        media_type: MediaType,
+        confidence: int,
+        results: Iterable[Tuple[str, List[MediaEntry]]],
+    ) -> Playlist:
+        """Collect (kind, entries) search results in a Playlist for OCP"""
+        playlist = Playlist(
+            skill_id=self.skill_id,
+            skill_icon=self.skill_icon,
+            media_type=media_type,
+            confidence=confidence,
+            title=phrase,
+            artist=phrase,
+        )
+        for kind, entries in results:
+            for res in entries:
                 res.match_confidence = (
                     confidence if media_type == MediaType.GENERIC else confidence + 10
                 )
                 res.skill_id = self.skill_id
-                res.media_type = MediaType.TV
+                res.media_type = RESULT_TYPES[kind]
                 playlist.add_entry(res)
-        yield playlist
+        return playlist
+
+    @property
+    def metrics(self) -> str:
+        """Search latency histograms and HTTP session stats in Prometheus text format"""
+        metrics = self.search_metrics.render()
+        if self.plex_api is not None:
+            metrics += self.plex_api.session_pool.render()
+        return metrics
+
+    def _report_trace(self, trace: SearchTrace):
+        """Log and emit the stage timings of a search, with a profile if it was slow"""
+        summary = trace.as_dict
+        self.log.info("Plex search timings: %s", json.dumps(summary["stages"]))
+        self.log.debug("Plex search spans: %s", json.dumps(summary["spans"]))
+        if self.plex_api is not None:
+            self.log.debug(
+                "Plex HTTP sessions: %s", json.dumps(self.plex_api.session_pool.stats)
+            )
+        self.bus.emit(Message(f"{self.skill_id}.search.trace", summary))
+        if trace.profile and trace.total >= self.profile_threshold:
+            self.log.info(
+                "Plex search for %s took %.2fs:\n%s",
+                trace.phrase,
+                trace.total,
+                trace.profile_report(),
+            )
+        metrics_file = self.settings.get("metrics_file")
+        if metrics_file:
+            try:
+                with open(metrics_file, "w", encoding="utf-8") as f:
+                    f.write(self.metrics)
+            except OSError as e:
+                self.log.warning("Unable to write Plex metrics to %s: %s", metrics_file, e)
+
+    def handle_metrics(self, message: Message):
+        """Reply with the search and HTTP session metrics in Prometheus text format"""
+        self.bus.emit(message.response({"metrics": self.metrics}))
+
+    @ocp_play()
+    def play_lazy_result(self, message: Message):
+        """Resolve a lazy Plex result into playable streams once OCP selects it"""
+        uri = message.data.get("uri", "")
+        if self.plex_api is None:
+            self.log.error("PlexAPI is still connecting, unable to play %s", uri)
+            return
+        uris = [entry.uri for entry in self._lazy_queue]
+        remaining = self._lazy_queue[uris.index(uri) + 1 :] if uri in uris else []
+        parsed = parse_lazy_uri(uri)
+        if parsed is not None and parsed[1] == QUEUE_KIND and self.smart_queues is not None:
+            entries = self.smart_queues.next_page(message.data)
+        else:
+            entries = self.plex_api.resolve(message.data)
+        if not entries:
+            self.log.error("Plex result %s could not be resolved", uri)
+            return
+        for entry in entries:
+            entry.skill_id = self.skill_id
+            entry.match_confidence = message.data.get("match_confidence", 0)
+        self._lazy_queue = entries + remaining
+        self.play_media(
+            entries[0].as_dict, playlist=[entry.as_dict for entry in self._lazy_queue]
+        )
@@ -0,0 +1,366 @@
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from xml.etree.ElementTree import Element
+
+# Plex metadata types that can be played back directly
+INDEXED_KINDS = ("track", "movie", "episode")
+
+_ITEM_COLUMNS = (
+    "server_id",
+    "section_key",
+    "rating_key",
+    "kind",
+    "title",
+    "parent_title",
+    "grandparent_title",
+    "artist",
+    "parent_index",
+    "item_index",
+    "thumb",
+    "duration",
+    "guid",
+    "added_at",
+    "updated_at",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    server_id TEXT NOT NULL,
+    section_key TEXT NOT NULL,
+    rating_key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    parent_title TEXT NOT NULL DEFAULT '',
+    grandparent_title TEXT NOT NULL DEFAULT '',
+    artist TEXT NOT NULL DEFAULT '',
+    parent_index INTEGER,
+    item_index INTEGER,
+    thumb TEXT,
+    duration INTEGER,
+    guid TEXT,
+    added_at INTEGER,
+    updated_at INTEGER,
+    PRIMARY KEY (server_id, rating_key)
+);
+CREATE INDEX IF NOT EXISTS items_section ON items (server_id, section_key);
+CREATE TABLE IF NOT EXISTS sync_state (
+    server_id TEXT NOT NULL,
+    section_key TEXT NOT NULL,
+    updated_at INTEGER NOT NULL,
+    PRIMARY KEY (server_id, section_key)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, parent_title, grandparent_title, artist,
+    content='items', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, title, parent_title, grandparent_title, artist)
+    VALUES (new.rowid, new.title, new.parent_title, new.grandparent_title, new.artist);
+END;
+CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, parent_title, grandparent_title, artist)
+    VALUES ('delete', old.rowid, old.title, old.parent_title, old.grandparent_title, old.artist);
+END;
+CREATE TRIGGER IF NOT EXISTS items_au AFTER UPDATE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, parent_title, grandparent_title, artist)
+    VALUES ('delete', old.rowid, old.title, old.parent_title, old.grandparent_title, old.artist);
+    INSERT INTO items_fts (rowid, title, parent_title, grandparent_title, artist)
+    VALUES (new.rowid, new.title, new.parent_title, new.grandparent_title, new.artist);
+END;
+"""
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value not in (None, "") else None
+
+
+def _artist(elem: Element) -> str:
+    """Artist of a track or album, directors of a movie or episode"""
+    kind = elem.attrib.get("type", "")
+    if kind == "track":
+        return elem.attrib.get("grandparentTitle", "")
+    if kind == "album":
+        return elem.attrib.get("parentTitle", "")
+    return ", ".join(d.attrib.get("tag", "") for d in elem.iter("Director"))
+
+
+def _thumb(attrs: Dict[str, str]) -> Optional[str]:
+    return attrs.get("thumb") or attrs.get("parentThumb") or attrs.get("grandparentThumb")
+
+
+class MediaInfo(NamedTuple):
+    """Format of the first media version of a playable item and the key of its file"""
+
+    container: Optional[str]
+    audio_codec: Optional[str]
+    video_codec: Optional[str]
+    resolution: Optional[str]
+    bitrate: Optional[int]
+    part_key: Optional[str]
+
+
+def media_info(elem: Element) -> Optional[MediaInfo]:
+    """Parse the first Media element of a track, movie or episode, None if it has none"""
+    media = elem.find("Media")
+    if media is None:
+        return None
+    part = media.find("Part")
+    attrs = media.attrib
+    return MediaInfo(
+        container=attrs.get("container"),
+        audio_codec=attrs.get("audioCodec"),
+        video_codec=attrs.get("videoCodec"),
+        resolution=attrs.get("videoResolution"),
+        bitrate=_int(attrs.get("bitrate")),
+        part_key=part.attrib.get("key") if part is not None else None,
+    )
+
+
+def item_from_element(elem: Element) -> Dict:
+    """Convert a Plex XML metadata element into an index row"""
+    attrs = elem.attrib
+    return {
+        "rating_key": attrs.get("ratingKey"),
+        "kind": attrs.get("type", ""),
+        "title": attrs.get("title", ""),
+        "parent_title": attrs.get("parentTitle", ""),
+        "grandparent_title": attrs.get("grandparentTitle", ""),
+        "artist": _artist(elem),
+        "parent_index": _int(attrs.get("parentIndex")),
+        "item_index": _int(attrs.get("index")),
+        "thumb": _thumb(attrs),
+        "duration": _int(attrs.get("duration")),
+        "guid": attrs.get("guid"),
+        "added_at": _int(attrs.get("addedAt")),
+        "updated_at": _int(attrs.get("updatedAt")),
+    }
+
+
+class ResultItem:
+    """
+    Search result parsed straight from Plex XML or an index row, keeping only
+    what results are ranked, deduplicated and built from, so the XML can be freed
+    """
+
+    __slots__ = (
+        "rating_key",
+        "parent_rating_key",
+        "grandparent_rating_key",
+        "kind",
+        "title",
+        "parent_title",
+        "grandparent_title",
+        "artist",
+        "parent_index",
+        "item_index",
+        "thumb",
+        "duration",
+        "guid",
+        "has_directors",
+        "media",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_element(cls, elem: Element) -> "ResultItem":
+        """Parse a Plex XML metadata element"""
+        attrs = elem.attrib
+        return cls(
+            rating_key=attrs.get("ratingKey"),
+            parent_rating_key=attrs.get("parentRatingKey"),
+            grandparent_rating_key=attrs.get("grandparentRatingKey"),
+            kind=attrs.get("type", ""),
+            title=attrs.get("title", ""),
+            parent_title=attrs.get("parentTitle", ""),
+            grandparent_title=attrs.get("grandparentTitle", ""),
+            artist=_artist(elem),
+            parent_index=_int(attrs.get("parentIndex")),
+            item_index=_int(attrs.get("index")),
+            thumb=_thumb(attrs),
+            duration=_int(attrs.get("duration")),
+            guid=attrs.get("guid"),
+            has_directors=elem.find("Director") is not None,
+            media=media_info(elem),
+        )
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "ResultItem":
+        """Wrap a row returned by LibraryIndex.search"""
+        return cls(**row, has_directors=True)
+
+
+def _fts_query(phrase: str) -> str:
+    """Build an FTS5 prefix query matching every word in the phrase"""
+    words = "".join(c if c.isalnum() else " " for c in phrase.lower()).split()
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class LibraryIndex:
+    """Local SQLite full-text index of playable Plex library items"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        """Close the underlying database connection"""
+        with self._lock:
+            self._conn.close()
+
+    @property
+    def populated(self) -> bool:
+        """True once at least one item has been indexed"""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM items LIMIT 1").fetchone()
+        return row is not None
+
+    def count(
+        self, server_id: Optional[str] = None, section_key: Optional[str] = None
+    ) -> int:
+        """Number of indexed items, optionally limited to one server or section"""
+        sql, params = "SELECT COUNT(*) FROM items", []
+        if server_id is not None:
+            sql += " WHERE server_id = ?"
+            params.append(server_id)
+            if section_key is not None:
+                sql += " AND section_key = ?"
+                params.append(str(section_key))
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return row[0]
+
+    def get_watermark(self, server_id: str, section_key: str) -> Optional[int]:
+        """Latest updatedAt timestamp synced for a section, None if never synced"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at FROM sync_state WHERE server_id = ? AND section_key = ?",
+                (server_id, str(section_key)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set_watermark(self, server_id: str, section_key: str, items: List[Dict]):
+        stamps = [
+            max(item.get("updated_at") or 0, item.get("added_at") or 0) for item in items
+        ]
+        self._conn.execute(
+            "INSERT INTO sync_state (server_id, section_key, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (server_id, section_key) "
+            "DO UPDATE SET updated_at = MAX(updated_at, excluded.updated_at)",
+            (server_id, str(section_key), max(stamps, default=0)),
+        )
+
+    def replace_section(self, server_id: str, section_key: str, items: Iterable[Dict]):
+        """Atomically replace every indexed item of a library section"""
+        items = list(items)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM items WHERE server_id = ? AND section_key = ?",
+                (server_id, str(section_key)),
+            )
+            self._conn.execute(
+                "DELETE FROM sync_state WHERE server_id = ? AND section_key = ?",
+                (server_id, str(section_key)),
+            )
+            self._insert(server_id, section_key, items)
+            self._set_watermark(server_id, section_key, items)
+
+    def upsert_items(self, server_id: str, section_key: str, items: Iterable[Dict]):
+        """Insert or update items of a library section and advance its watermark"""
+        items = list(items)
+        with self._lock, self._conn:
+            self._insert(server_id, section_key, items)
+            self._set_watermark(server_id, section_key, items)
+
+    def delete_items(self, server_id: str, rating_keys: Sequence[str]):
+        """Remove items that were deleted from a server"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM items WHERE server_id = ? AND rating_key = ?",
+                [(server_id, str(key)) for key in rating_keys],
+            )
+
+    def _insert(self, server_id: str, section_key: str, items: Iterable[Dict]):
+        placeholders = ", ".join("?" for _ in _ITEM_COLUMNS)
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO items ({', '.join(_ITEM_COLUMNS)}) "
+            f"VALUES ({placeholders})",
+            (
+                tuple(
+                    [server_id, str(section_key)]
+                    + [item.get(column) for column in _ITEM_COLUMNS[2:]]
+                )
+                for item in items
+                if item.get("kind") in INDEXED_KINDS
+            ),
+        )
+
+    def remove_sections(self, server_id: str, keep: Sequence[str]):
+        """Drop indexed sections of a server that no longer exist"""
+        keep = [str(key) for key in keep]
+        with self._lock, self._conn:
+            for table in ("items", "sync_state"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE server_id = ? "
+                    f"AND section_key NOT IN ({', '.join('?' for _ in keep)})",
+                    [server_id] + keep,
+                )
+
+    def titles(self) -> List[Tuple[str, str]]:
+        """Distinct (kind, title) pairs of indexed items and their albums, artists and shows"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT kind, title FROM items "
+                "UNION SELECT DISTINCT 'album', parent_title FROM items WHERE kind = 'track' "
+                "UNION SELECT DISTINCT 'artist', grandparent_title FROM items "
+                "WHERE kind = 'track' "
+                "UNION SELECT DISTINCT 'show', grandparent_title FROM items "
+                "WHERE kind = 'episode'"
+            ).fetchall()
+        return [(row[0], row[1]) for row in rows if row[1]]
+
+    def search(
+        self,
+        phrase: str,
+        kinds: Sequence[str] = INDEXED_KINDS,
+        server_ids: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        Search indexed titles, albums, artists and shows for every word in phrase
+        :param phrase: user search phrase
+        :param kinds: item types to return (track, movie, episode)
+        :param server_ids: restrict results to these server machine identifiers
+        :param limit: maximum number of results, unlimited by default
+        :returns: list of item dicts ordered by relevance
+        """
+        match = _fts_query(phrase)
+        if not match or not kinds:
+            return []
+        sql = (
+            "SELECT items.* FROM items_fts JOIN items ON items.rowid = items_fts.rowid "
+            f"WHERE items_fts MATCH ? AND items.kind IN ({', '.join('?' for _ in kinds)})"
+        )
+        params: list = [match, *kinds]
+        if server_ids is not None:
+            if not server_ids:
+                return []
+            sql += f" AND items.server_id IN ({', '.join('?' for _ in server_ids)})"
+            params += list(server_ids)
+        sql += (
+            " ORDER BY bm25(items_fts, 10.0, 5.0, 5.0, 2.0), items.grandparent_title,"
+            " items.parent_title, items.parent_index, items.item_index"
+        )
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,186 @@
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from ovos_utils.log import LOG
+from plexapi.library import LibrarySection
+
+from .library_index import item_from_element
+
+# Timeline entry states reported by the Plex alert websocket
+STATE_PROCESSED = 5
+STATE_DELETED = 9
+LIBRARY_IDENTIFIER = "com.plexapp.plugins.library"
+
+
+class LibrarySync:
+    """Keep the local library index fresh with incremental, per-section syncs"""
+
+    def __init__(self, plex_api, interval: float = 900, listen: bool = False):
+        """
+        :param plex_api: PlexAPI instance owning the servers, sections and index
+        :param interval: seconds between periodic delta syncs of every section
+        :param listen: subscribe to each server's alert websocket for library changes
+        """
+        self.plex_api = plex_api
+        self.interval = interval
+        self.listen = listen
+        self._pending: Set[Tuple[str, str]] = set()
+        self._sync_all = True
+        self._lock = Lock()
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+        self._listeners: List = []
+        self.on_change: List[Callable[[], None]] = []
+
+    @property
+    def index(self):
+        """The LibraryIndex being kept in sync"""
+        return self.plex_api.index
+
+    def start(self):
+        """Start the background sync loop and optional alert listeners"""
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, daemon=True, name="PlexLibrarySync")
+        self._thread.start()
+        if self.listen:
+            self._start_listeners()
+
+    def stop(self):
+        """Stop syncing and close any alert listeners"""
+        self._stopped.set()
+        self._wake.set()
+        for listener in self._listeners:
+            listener.stop()
+        self._listeners = []
+
+    def request_sync(self, server_id: Optional[str] = None, section_key: Optional[str] = None):
+        """Schedule a delta sync of one section, or of every section if none given"""
+        with self._lock:
+            if server_id is None or section_key is None:
+                self._sync_all = True
+            else:
+                self._pending.add((server_id, str(section_key)))
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sync_pending()
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.exception("Plex library sync failed: %s", e)
+            if not self._wake.wait(self.interval):
+                self.request_sync()
+            self._wake.clear()
+
+    def sync_pending(self):
+        """Sync every section that was requested since the last run"""
+        with self._lock:
+            sync_all, pending = self._sync_all, self._pending
+            self._sync_all, self._pending = False, set()
+        if sync_all:
+            self.sync_all()
+            return
+        sections = self._sections_by_key()
+        for key in pending:
+            if key in sections:
+                self._try_sync(sections[key])
+
+    def sync_all(self):
+        """Delta sync every known section and drop sections that disappeared"""
+        by_server: Dict[str, List[str]] = {}
+        for (server_id, section_key), section in self._sections_by_key().items():
+            by_server.setdefault(server_id, []).append(section_key)
+            self._try_sync(section)
+        for server_id, section_keys in by_server.items():
+            self.index.remove_sections(server_id, section_keys)
+
+    def _try_sync(self, section: LibrarySection):
+        """Sync a section unless its server is down, so one server can't stop the pass"""
+        server_id = section._server.machineIdentifier
+        if self.plex_api.health.is_open(server_id):
+            LOG.debug("Skipping sync of Plex section %s, server is down", section.title)
+            return
+        try:
+            self.sync_section(section)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.warning("Unable to sync Plex section %s: %s", section.title, e)
+            self.plex_api.health.failure(server_id)
+
+    def sync_section(self, section: LibrarySection) -> int:
+        """
+        Fetch only the items of a section updated since its last sync
+        :param section: library section to sync
+        :returns: number of items fetched from the server
+        """
+        server_id = section._server.machineIdentifier
+        watermark = self.index.get_watermark(server_id, section.key)
+        if watermark is None:
+            self.plex_api.index_section(section)
+            self._changed()
+            return self.index.count(server_id, section.key)
+        # Plex only offers a strict "greater than"; re-fetch the boundary second
+        items = [
+            item_from_element(elem)
+            for elem in self.plex_api.iter_section(
+                section, **{"updatedAt>>": max(watermark - 1, 0)}
+            )
+        ]
+        self.index.upsert_items(server_id, section.key, items)
+        if self.index.count(server_id, section.key) != self.plex_api.section_size(section):
+            # Deletions don't show up in a delta fetch, fall back to a full crawl
+            LOG.info("Plex section %s changed size, re-indexing", section.title)
+            self.plex_api.index_section(section)
+            self._changed()
+        elif any((item.get("updated_at") or 0) > watermark for item in items):
+            self._changed()
+        LOG.debug("Synced %s changed items from Plex section %s", len(items), section.title)
+        return len(items)
+
+    def handle_alert(self, server_id: str, data: dict):
+        """Apply a Plex alert websocket notification to the index"""
+        if data.get("type") != "timeline":
+            return
+        for entry in data.get("TimelineEntry", []):
+            if entry.get("identifier") != LIBRARY_IDENTIFIER:
+                continue
+            section_key = str(entry.get("sectionID", "-1"))
+            state = int(entry.get("state", 0))
+            if state == STATE_DELETED:
+                self.index.delete_items(server_id, [entry.get("itemID")])
+                self._changed()
+            elif state == STATE_PROCESSED and section_key != "-1":
+                self.request_sync(server_id, section_key)
+
+    def _changed(self):
+        """Notify on_change callbacks that indexed library content changed"""
+        for callback in self.on_change:
+            try:
+                callback()
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Plex library change callback failed: %s", e)
+
+    def _sections_by_key(self) -> Dict[Tuple[str, str], LibrarySection]:
+        return {
+            (section._server.machineIdentifier, str(section.key)): section
+            for section in self.plex_api.sections
+        }
+
+    def _start_listeners(self):
+        for server in self.plex_api.servers:
+            server_id = server.machineIdentifier
+            try:
+                self._listeners.append(
+                    server.startAlertListener(
+                        callback=lambda data, sid=server_id: self.handle_alert(sid, data),
+                        callbackError=lambda e, name=server.friendlyName: LOG.warning(
+                            "Plex alert listener for %s failed: %s", name, e
+                        ),
+                    )
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning(
+                    "Unable to listen for library changes on %s: %s",
+                    server.friendlyName,
+                    e,
+                )
@@ -0,0 +1,67 @@
+import re
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional
+
+
+class ParsedPhrase(NamedTuple):
+    """Search phrase with the vocabulary removed and the vocabularies that matched"""
+
+    phrase: str
+    hints: FrozenSet[str]
+
+
+def _normalize(term: str) -> str:
+    return " ".join(term.lower().split())
+
+
+def _alternation(terms: Iterable[str]) -> str:
+    # Longest terms first, so "tv show" is removed as a whole before "tv"
+    return "|".join(
+        r"\s+".join(re.escape(word) for word in term.split())
+        for term in sorted(terms, key=len, reverse=True)
+    )
+
+
+class PhraseParser:
+    """Strip vocabulary from a search phrase and detect media hints in a single pass"""
+
+    def __init__(
+        self,
+        vocabularies: Dict[str, Iterable[str]],
+        anchors: Optional[Dict[str, str]] = None,
+    ):
+        """
+        :param vocabularies: phrases of each vocabulary, e.g. {"tv": ["tv show", "series"]}
+        :param anchors: vocabularies only matched at the "start" or "end" of a phrase,
+            e.g. {"radio": "end"} finds "jamie cullum radio" but not "radio gaga"
+        """
+        anchors = anchors or {}
+        self._vocab_of: Dict[str, str] = {}
+        terms: Dict[Optional[str], list] = {None: [], "start": [], "end": []}
+        for name, vocabulary in vocabularies.items():
+            for term in vocabulary:
+                term = _normalize(term)
+                if term and term not in self._vocab_of:
+                    self._vocab_of[term] = name
+                    terms[anchors.get(name)].append(term)
+        templates = {None: r"\b(?:{})\b", "start": r"^\s*(?:{})\b", "end": r"\b(?:{})\s*$"}
+        self._patterns = [
+            re.compile(templates[anchor].format(_alternation(terms[anchor])), re.IGNORECASE)
+            for anchor in ("start", "end", None)
+            if terms[anchor]
+        ]
+
+    def parse(self, phrase: str) -> ParsedPhrase:
+        """
+        Remove every whole-word vocabulary match from the phrase
+        :param phrase: user search phrase
+        :returns: cleaned phrase and the names of the vocabularies found in it
+        """
+        hints = set()
+
+        def strip(match: re.Match) -> str:
+            hints.add(self._vocab_of[_normalize(match.group(0))])
+            return " "
+
+        for pattern in self._patterns:
+            phrase = pattern.sub(strip, phrase)
+        return ParsedPhrase(" ".join(phrase.split()), frozenset(hints))
@@ -1,141 +1,992 @@
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from functools import partial
+from threading import Lock, Thread
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode
+from xml.etree.ElementTree import Element, fromstring, tostring
 
 from ovos_utils.log import LOG
 from ovos_workshop.backwards_compat import MediaEntry, MediaType, PlaybackType
-from plexapi.audio import Album, Artist, Track
-from plexapi.library import MovieSection, MusicSection, ShowSection
-from plexapi.myplex import MyPlexAccount
+from plexapi import utils
+from plexapi.library import LibrarySection, MovieSection, MusicSection, ShowSection
+from plexapi.myplex import MyPlexAccount, MyPlexResource
 from plexapi.server import PlexServer
-from plexapi.video import Episode, Movie, Show
+
+from .library_index import INDEXED_KINDS, LibraryIndex, ResultItem, item_from_element
+from .ranking import DEFAULT_MAX_HITS, DEFAULT_MAX_RESULTS, rank_hits
+from .search_cache import SearchCache
+from .server_cache import ServerCache
+from .server_health import ServerHealth
+from .server_latency import LatencyTracker
+from .session_pool import SessionPool
+from .stream_resolver import StreamResolver
+from .title_matcher import MATCH_KINDS, TitleMatcher
+from .tracing import profiled, span
+
+# Number of items requested per page while crawling a library section
+INDEX_PAGE_SIZE = 500
+
+SECTIONS_KEY = "/library/sections"
+SECTION_CLASSES = {"artist": MusicSection, "movie": MovieSection, "show": ShowSection}
+
+# Metadata types expanded into their tracks or episodes
+CONTAINER_KINDS = ("artist", "album", "show")
+
+# Prefix of result URIs that are resolved by the skill once OCP plays them
+LAZY_URI_PREFIX = "plex//"
+
+# Minimum seconds between plex.tv discoveries triggered by an unreachable server
+REDISCOVERY_INTERVAL = 300
+
+# Prefix of GUIDs assigned by the legacy Plex metadata agents
+LEGACY_AGENT_PREFIX = "com.plexapp.agents."
+
+ITEM_TYPES = {
+    "artist": (MediaType.MUSIC, PlaybackType.AUDIO),
+    "album": (MediaType.MUSIC, PlaybackType.AUDIO),
+    "track": (MediaType.MUSIC, PlaybackType.AUDIO),
+    "movie": (MediaType.MOVIE, PlaybackType.VIDEO),
+    "show": (MediaType.TV, PlaybackType.VIDEO),
+    "episode": (MediaType.TV, PlaybackType.VIDEO),
+}
+
+
+def lazy_uri(server_id: str, kind: str, rating_key: str, start: int = 0) -> str:
+    """Build the URI of a result whose stream is resolved at playback time"""
+    uri = f"{LAZY_URI_PREFIX}{server_id}/{kind}/{rating_key}"
+    return f"{uri}?start={start}" if start else uri
+
+
+def parse_lazy_uri(uri: str) -> Optional[Tuple[str, str, str, int]]:
+    """Split a lazy result URI into server id, kind, rating key and page offset"""
+    if not uri.startswith(LAZY_URI_PREFIX):
+        return None
+    path, _, query = uri[len(LAZY_URI_PREFIX):].partition("?")
+    server_id, kind, rating_key = path.split("/")
+    return server_id, kind, rating_key, int(dict(parse_qsl(query)).get("start", 0))
+
+
+def guid_key(guid: Optional[str]) -> Optional[str]:
+    """
+    Server independent identity of a Plex item, e.g. "imdb://tt0111161" for
+    "com.plexapp.agents.imdb://tt0111161?lang=en", None for server local items
+    """
+    if not guid or guid.startswith(("local://", "library://")):
+        return None
+    guid = guid.partition("?")[0]
+    if guid.startswith(LEGACY_AGENT_PREFIX):
+        guid = guid[len(LEGACY_AGENT_PREFIX):]
+    return guid
+
+
+class SectionResults(list):
+    """Entries found on one server, along with the GUID of the item behind each"""
+
+    def __init__(self, server_id: Optional[str] = None):
+        super().__init__()
+        self.server_id = server_id
+        self.guids: List[Optional[str]] = []
+
+    def add(self, entry: MediaEntry, guid: Optional[str]):
+        """Append an entry and the GUID it was constructed from"""
+        self.append(entry)
+        self.guids.append(guid_key(guid))
+
+
+def unique(entries: List[MediaEntry], seen: Set[str]) -> List[MediaEntry]:
+    """
+    Drop the entries of items already in seen, e.g. replicas on another server
+    :param entries: SectionResults, plain lists are returned unchanged
+    :param seen: GUIDs of the entries kept so far, updated with the new ones
+    """
+    guids = getattr(entries, "guids", None)
+    if guids is None:
+        return entries
+    kept = []
+    for entry, guid in zip(entries, guids):
+        if guid is not None:
+            if guid in seen:
+                continue
+            seen.add(guid)
+        kept.append(entry)
+    return kept
+
+
+def _uncovered(hits: List[ResultItem]) -> List[ResultItem]:
+    """Drop repeated hits and those inside an artist, album or show ranked before them"""
+    expanded: Set[str] = set()
+    seen: Set[str] = set()
+    kept = []
+    for hit in hits:
+        if hit.rating_key in seen or {hit.parent_rating_key, hit.grandparent_rating_key} & expanded:
+            continue
+        seen.add(hit.rating_key)
+        if hit.kind in CONTAINER_KINDS:
+            expanded.add(hit.rating_key)
+        kept.append(hit)
+    return kept
+
+
+def _missing_details(hit: ResultItem) -> bool:
+    """True for movies and episodes whose search result lacks their directors"""
+    return hit.kind in ("movie", "episode") and not hit.has_directors
+
+
+def playable_type(section: LibrarySection) -> str:
+    """The playable libtype contained in a library section"""
+    return {"artist": "track", "show": "episode"}.get(section.TYPE, section.TYPE)
+
+
+def _timed(func: Callable, *args) -> Tuple[object, float]:
+    """Call func and return its result along with the elapsed wall time"""
+    start = time.monotonic()
+    result = profiled(func, *args)
+    return result, time.monotonic() - start
 
 
 class PlexAPI:
     """Thinly wrapped plexapi library for OVOS Common Play results"""
 
-    def __init__(self, token: str):
+    def __init__(
+        self,
+        token: Optional[str],
+        index_path: Optional[str] = None,
+        servers: Optional[List[PlexServer]] = None,
+        search_timeout: float = 4.0,
+        max_workers: int = 8,
+        lazy: bool = False,
+        page_size: int = 50,
+        cache_path: Optional[str] = None,
+        cache_ttl: float = 86400,
+        search_cache: Optional[SearchCache] = None,
+        session_pool: Optional[SessionPool] = None,
+        health: Optional[ServerHealth] = None,
+        max_results: Optional[Dict[str, int]] = None,
+        max_hits: int = DEFAULT_MAX_HITS,
+        fuzzy: bool = True,
+        latency_interval: float = 60,
+        streams: Optional[StreamResolver] = None,
+    ):
+        self.token = token
         self.servers: List[PlexServer] = []
         self.movies: List[MovieSection] = []
         self.shows: List[ShowSection] = []
         self.music: List[MusicSection] = []
-        self.connect_to_servers(token)
-        self.init_libraries()
+        self.index: Optional[LibraryIndex] = (
+            LibraryIndex(index_path) if index_path else None
+        )
+        self.cache: Optional[ServerCache] = (
+            ServerCache(cache_path, cache_ttl) if cache_path else None
+        )
+        self.search_cache = search_cache
+        self.session_pool = session_pool or SessionPool()
+        self.health = health or ServerHealth()
+        self.streams = streams or StreamResolver()
+        self._resources: Dict[str, MyPlexResource] = {}
+        self._discovered_at = 0.0
+        self.search_timeout = search_timeout
+        self.lazy = lazy
+        self.page_size = page_size
+        self.max_results = {**DEFAULT_MAX_RESULTS, **(max_results or {})}
+        self.max_hits = max_hits
+        self.fuzzy = fuzzy
+        self.matcher: Optional[TitleMatcher] = None
+        self._matcher_lock = Lock()
+        self._matcher_stale = False
+        self._matcher_building = False
+        self.last_timings: Dict[str, float] = {}
+        self.latency = LatencyTracker(latency_interval)
+        self._sections_xml: Dict[str, Element] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="PlexSearch"
+        )
+        if servers is not None:
+            self.servers = servers
+            self.init_libraries()
+        elif self.load_from_cache():
+            Thread(target=self.refresh_servers, daemon=True, name="PlexDiscovery").start()
+        else:
+            try:
+                self.refresh_servers()
+            except Exception:
+                # The caller retries with a new instance, don't leak this one's threads
+                self.close()
+                raise
+        if latency_interval > 0:
+            self.latency.start(lambda: self.servers)
+        self.health.start(self.probe_server)
+        if self.use_index:
+            self.refresh_matcher()
 
     def connect_to_servers(self, token: str):
         """Provide connections to all servers accessible from the provided token."""
-        account = MyPlexAccount(token=token)
-        servers = [
+        self._discovered_at = time.monotonic()
+        account = MyPlexAccount(
+            token=token,
+            session=self.session_pool.session("plex.tv"),
+            timeout=self.session_pool.timeout,
+        )
+        resources = [
             r
             for r in account.resources()
             if "server" in r.provides and r.presence is True
         ]
         LOG.info(
             "Found %s active servers: %s",
-            len(servers),
-            ",".join([s.name for s in servers]),
+            len(resources),
+            ",".join([r.name for r in resources]),
         )
-        self.servers = [account.resource(server.name).connect() for server in servers]
+        futures = [
+            (
+                r,
+                self._executor.submit(
+                    self.latency.timed, partial(r.connect, timeout=self.session_pool.timeout[0])
+                ),
+            )
+            for r in resources
+        ]
+        servers = []
+        for resource, future in futures:
+            try:
+                server = self.session_pool.adopt(future.result())
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Unable to connect to Plex server %s: %s", resource.name, e)
+                continue
+            self._adopt_resource(resource, server)
+            servers.append(server)
+        if resources and not servers:
+            raise ConnectionError(f"Unable to connect to any of {len(resources)} Plex servers")
+        self.servers = servers
 
-    def init_libraries(self):
-        """Initialize server libraries, specifically Movies, Shows, and Music."""
+    def _adopt_resource(self, resource: MyPlexResource, server: PlexServer):
+        """Remember the resource a server was connected through, and if it is relayed"""
+        self._resources[server.machineIdentifier] = resource
+        relay = any(
+            connection.relay
+            for connection in resource.connections
+            if server._baseurl in (connection.uri, connection.httpuri)
+        )
+        if relay:
+            LOG.info("Plex server %s is only reachable through a relay", resource.name)
+        self.latency.set_relay(server.machineIdentifier, relay)
+
+    def probe_server(self, server_id: str) -> bool:
+        """
+        Try to reach an unhealthy server on its current URL, then on any of its other
+        connections, then by discovering the account's servers again
+        :param server_id: machine identifier of the server
+        :returns: True if the server answered and searches may use it again
+        """
+        server = self.servers_by_id.get(server_id)
+        if server is not None:
+            try:
+                server.query("/identity")
+                return True
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.debug("Plex server %s did not answer at %s: %s", server_id, server._baseurl, e)
+        resource = self._resources.get(server_id)
+        if resource is not None:
+            try:
+                server = self.session_pool.adopt(
+                    resource.connect(timeout=self.session_pool.timeout[0])
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.debug("Unable to reconnect to Plex server %s: %s", resource.name, e)
+            else:
+                LOG.info("Reconnected to Plex server %s at %s", resource.name, server._baseurl)
+                self._adopt_resource(resource, server)
+                self._replace_server(server)
+                return True
+        if self.token and time.monotonic() - self._discovered_at >= REDISCOVERY_INTERVAL:
+            LOG.info("Discovering Plex servers again to find %s", server_id)
+            self.refresh_servers()
+            return server_id in self.servers_by_id
+        return False
+
+    def _replace_server(self, server: PlexServer):
+        """Swap in a reconnected server and rebuild its library sections"""
+        self.servers = [
+            server if known.machineIdentifier == server.machineIdentifier else known
+            for known in self.servers
+        ]
+        self.streams.clear(server.machineIdentifier)
+        if self.search_cache is not None:
+            # Cached results hold stream and image URLs on the old address
+            self.search_cache.clear()
+        self.init_libraries(self._sections_xml)
+        self.save_cache()
+
+    def init_libraries(self, sections_xml: Optional[Dict[str, Element]] = None):
+        """
+        Initialize server libraries, specifically Movies, Shows, and Music.
+        :param sections_xml: cached /library/sections responses by server machine id
+        """
+        libraries = {section_type: [] for section_type in SECTION_CLASSES}
         for server in self.servers:
-            lib = server.library.sections()
-            for section in lib:
-                if isinstance(section, MovieSection):
-                    self.movies.append(section)
-                elif isinstance(section, ShowSection):
-                    self.shows.append(section)
-                elif isinstance(section, MusicSection):
-                    self.music.append(section)
+            data = (sections_xml or {}).get(server.machineIdentifier)
+            if data is None:
+                data = server.query(SECTIONS_KEY)
+            self._sections_xml[server.machineIdentifier] = data
+            for elem in data:
+                section_type = elem.attrib.get("type")
+                if section_type in SECTION_CLASSES:
+                    libraries[section_type].append(
+                        SECTION_CLASSES[section_type](server, elem, initpath=SECTIONS_KEY)
+                    )
+        self.music = libraries["artist"]
+        self.movies = libraries["movie"]
+        self.shows = libraries["show"]
 
-    def search_music(self, query: str):
-        """Search music libraries"""
-        track_list = []
-        for music in self.music:
-            results = music.hubSearch(query)
-            for result in results:
-                tracks = self._get_tracks_from_result(result)
-                track_list += [self._construct_track_dict(track) for track in tracks]
-        LOG.debug("Found %s music tracks in Plex", len(track_list))
-        return track_list
-
-    def _get_tracks_from_result(self, result):
-        """Get music Tracks from search results"""
-        if isinstance(result, (Album, Artist)):
-            return result.tracks()
-        if isinstance(result, Track):
-            return [result]
-        return []
-
-    def _construct_track_dict(self, track) -> MediaEntry:
-        """Construct a dictionary of Tracks for use with OVOS Common Play"""
+    def load_from_cache(self, cached: Optional[List[Dict]] = None) -> bool:
+        """
+        Connect straight to the server URLs remembered in the discovery cache
+        :param cached: cached server dicts, read from the cache file if not given
+        :returns: True if at least one cached server is reachable
+        """
+        if cached is None:
+            cached = self.cache.load() if self.cache else None
+        if not cached:
+            return False
+        futures = [
+            (
+                entry,
+                self._executor.submit(
+                    self.latency.timed,
+                    partial(
+                        PlexServer,
+                        entry["url"],
+                        entry["token"],
+                        session=self.session_pool.session(entry["machine_id"]),
+                        timeout=self.session_pool.timeout,
+                    ),
+                ),
+            )
+            for entry in cached
+        ]
+        servers, sections_xml = [], {}
+        for entry, future in futures:
+            try:
+                server = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Cached Plex server %s is unreachable: %s", entry["name"], e)
+                continue
+            servers.append(server)
+            self.latency.set_relay(server.machineIdentifier, entry.get("relay", False))
+            sections_xml[server.machineIdentifier] = fromstring(entry["sections_xml"])
+        if not servers:
+            return False
+        LOG.info("Loaded %s Plex servers from cache", len(servers))
+        self.servers = servers
+        self.init_libraries(sections_xml)
+        return True
+
+    def refresh_servers(self):
+        """Discover servers through plex.tv, falling back to a stale cache if offline"""
+        try:
+            self.connect_to_servers(self.token)
+            self.streams.clear()
+            if self.search_cache is not None:
+                self.search_cache.clear()
+            self.init_libraries()
+        except Exception as e:  # pylint: disable=broad-except
+            if self.servers:
+                LOG.warning("Plex server discovery failed, keeping cached servers: %s", e)
+                return
+            stale = self.cache.load(allow_stale=True) if self.cache else None
+            if self.load_from_cache(stale):
+                LOG.warning("Plex server discovery failed, using stale cache: %s", e)
+                return
+            raise
+        self.save_cache()
+
+    def save_cache(self):
+        """Write the connected servers and their library sections to the cache"""
+        if self.cache is None or not self.servers:
+            return
+        try:
+            self.cache.save(
+                [
+                    {
+                        "name": server.friendlyName,
+                        "machine_id": server.machineIdentifier,
+                        "url": server._baseurl,
+                        "token": server._token,
+                        "relay": self.latency.is_relay(server.machineIdentifier),
+                        "sections_xml": tostring(
+                            self._sections_xml[server.machineIdentifier], encoding="unicode"
+                        ),
+                    }
+                    for server in self.servers
+                ]
+            )
+        except OSError as e:
+            LOG.warning("Unable to write Plex server cache: %s", e)
+
+    def close(self):
+        """Release worker threads and connections, persist the search cache, close the index"""
+        self.latency.stop()
+        self.health.stop()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.search_cache is not None:
+            self.search_cache.save()
+        self.session_pool.close()
+        if self.index is not None:
+            self.index.close()
+
+    @property
+    def sections(self) -> List[LibrarySection]:
+        """All known music, movie and TV sections"""
+        return self.music + self.movies + self.shows
+
+    @property
+    def servers_by_id(self) -> Dict[str, PlexServer]:
+        """Connected servers keyed by their machine identifier"""
+        return {server.machineIdentifier: server for server in self.servers}
+
+    @property
+    def use_index(self) -> bool:
+        """True if searches can be answered from the local library index"""
+        return self.index is not None and self.index.populated
+
+    def refresh_matcher(self):
+        """Rebuild the fuzzy title matcher from the local index in the background"""
+        if not self.fuzzy or self.index is None:
+            return
+        with self._matcher_lock:
+            self._matcher_stale = True
+            if self._matcher_building:
+                return
+            self._matcher_building = True
+        Thread(target=self._build_matcher, daemon=True, name="PlexTitleMatcher").start()
+
+    def _build_matcher(self):
+        """Build matchers until no library change arrived during the last build"""
+        while True:
+            with self._matcher_lock:
+                if not self._matcher_stale:
+                    self._matcher_building = False
+                    return
+                self._matcher_stale = False
+            try:
+                start = time.monotonic()
+                self.matcher = TitleMatcher(self.index.titles())
+                LOG.info(
+                    "Built Plex title matcher of %s titles in %.2fs",
+                    len(self.matcher),
+                    time.monotonic() - start,
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Unable to build Plex title matcher: %s", e)
+
+    def match_score(self, query: str, kinds: List[str]) -> Optional[float]:
+        """
+        How closely the query sounds like a catalog title of the given media kinds
+        :param query: search phrase
+        :param kinds: media kinds ("music", "movies" and/or "shows")
+        :returns: similarity from 0 to 1, or None without a title matcher
+        """
+        if self.matcher is None:
+            return None
+        title_kinds = [kind for media in kinds for kind in MATCH_KINDS[media]]
+        with span("fuzzy_match"):
+            best = self.matcher.best(query, title_kinds)
+        return best[0] if best else 0.0
+
+    def index_section(self, section: LibrarySection):
+        """Replace the indexed contents of a single library section"""
+        items = [item_from_element(elem) for elem in self.iter_section(section)]
+        self.index.replace_section(section._server.machineIdentifier, section.key, items)
+        LOG.debug("Indexed %s items from Plex section %s", len(items), section.title)
+
+    def section_size(self, section: LibrarySection) -> int:
+        """Number of playable items in a library section, without fetching them"""
+        params = {
+            "type": utils.searchType(playable_type(section)),
+            "X-Plex-Container-Start": 0,
+            "X-Plex-Container-Size": 0,
+        }
+        data = section._server.query(
+            f"/library/sections/{section.key}/all?{urlencode(params)}"
+        )
+        return int(data.attrib.get("totalSize", data.attrib.get("size", 0)))
+
+    def iter_section(self, section: LibrarySection, **filters) -> Iterator:
+        """
+        Page through the raw XML metadata of the playable items in a library section
+        :param section: library section to crawl
+        :param filters: additional Plex filters, e.g. {"updatedAt>>": 1700000000}
+        :returns: iterator of XML elements
+        """
+        start = 0
+        while True:
+            params = {
+                "type": utils.searchType(playable_type(section)),
+                "X-Plex-Container-Start": start,
+                "X-Plex-Container-Size": INDEX_PAGE_SIZE,
+                **filters,
+            }
+            data = section._server.query(
+                f"/library/sections/{section.key}/all?{urlencode(params)}"
+            )
+            elems = [elem for elem in data if elem.attrib.get("ratingKey")]
+            yield from elems
+            start += INDEX_PAGE_SIZE
+            total = int(data.attrib.get("totalSize", data.attrib.get("size", 0)))
+            if not elems or start >= total:
+                return
+
+    def _search_index(self, query: str, kind: str, limit: int) -> SectionResults:
+        """
+        Search the local index, only contacting Plex for what is returned
+        Items found on several servers are returned once, from the nearest server
+        """
+        servers = {
+            server_id: server
+            for server_id, server in self.servers_by_id.items()
+            if not self.health.is_open(server_id)
+        }
+        with span("index_search", kind=kind):
+            rows = self.index.search(
+                query, kinds=(kind,), server_ids=list(servers), limit=limit * len(servers)
+            )
+        nearest: Dict[object, Dict] = {}
+        for position, row in enumerate(rows):
+            key = guid_key(row["guid"]) or position
+            best = nearest.get(key)
+            if best is None or self.latency.cost(row["server_id"]) < self.latency.cost(
+                best["server_id"]
+            ):
+                # Dicts keep the insertion order, so the first replica's rank is kept
+                nearest[key] = row
+        results = SectionResults()
+        for row in list(nearest.values())[:limit]:
+            item = ResultItem.from_row(row)
+            results.add(
+                self._construct_item_entry(servers[row["server_id"]], item, lazy=self.lazy),
+                item.guid,
+            )
+        return results
+
+    def _construct_item_entry(
+        self, server: PlexServer, item: ResultItem, lazy: bool = False, resolve: bool = False
+    ) -> MediaEntry:
+        """
+        Construct a MediaEntry for OVOS Common Play from an index row or XML item.
+        Without a cached stream decision for the item, its stream URL is deferred
+        until the entry is played.
+        :param server: server the item belongs to
+        :param item: compact item parsed from XML or an index row
+        :param lazy: defer the stream URL until the entry is played
+        :param resolve: ask the server for a stream decision if none is cached
+        """
+        kind = item.kind
+        media_type, playback = ITEM_TYPES[kind]
+        title = item.title
+        if kind == "episode":
+            season_episode = (
+                f"s{str(item.parent_index).zfill(2)}e{str(item.item_index).zfill(2)}"
+            )
+            title = f"{season_episode} - {title}"
+        uri = None
+        if not lazy and kind in INDEXED_KINDS:
+            uri = self.streams.url(server, item, resolve)
+        if uri is None:
+            uri = lazy_uri(server.machineIdentifier, kind, item.rating_key)
+            playback = PlaybackType.SKILL
         return MediaEntry(
-            media_type=MediaType.MUSIC,
-            uri=track.getStreamURL(),
-            title=track.title,
-            playback=PlaybackType.AUDIO,
-            image=track.thumbUrl if track.thumbUrl else "",
-            artist=track.grandparentTitle,
-            length=track.duration,
+            media_type=media_type,
+            uri=uri,
+            title=title,
+            playback=playback,
+            image=server.url(item.thumb, includeToken=True) if item.thumb else "",
+            artist=item.artist,
+            length=item.duration or 0,
         )
 
+    def _construct_placeholders(
+        self, section: LibrarySection, hits: List[ResultItem], limit: int
+    ) -> SectionResults:
+        """Construct lazy MediaEntries for ranked hub search hits without expanding them"""
+        results = SectionResults(section._server.machineIdentifier)
+        for hit in hits[:limit]:
+            results.add(self._construct_item_entry(section._server, hit, lazy=True), hit.guid)
+        return results
+
+    def _rank_hits(self, section: LibrarySection, query: str, kinds: tuple) -> List[ResultItem]:
+        """
+        Hub search a section and keep its best hits of the given kinds. Hits are
+        parsed into compact items rather than plexapi objects and the XML is dropped.
+        """
+        params = {
+            "query": query,
+            "sectionId": section.key,
+            "includeCollections": 0,
+            "includeExternalMedia": 0,
+        }
+        with span("hub_search", server=section._server.friendlyName, section=section.title):
+            data = section._server.query(f"/hubs/search?{urlencode(params)}")
+        hits = [
+            ResultItem.from_element(elem)
+            for hub in data
+            for elem in hub
+            if elem.attrib.get("type") in kinds and elem.attrib.get("ratingKey")
+        ]
+        return rank_hits(query, hits, self.max_hits)
+
+    def _expand_hits(
+        self, section: LibrarySection, hits: List[ResultItem], limit: int
+    ) -> SectionResults:
+        """
+        Expand ranked hits into playable entries, stopping once limit is reached.
+        Albums and the details of playable hits are fetched in one request each,
+        the first time one of them is needed.
+        :param section: library section the hits were found in
+        :param hits: ranked hub search hits, best first
+        :param limit: maximum number of entries to construct
+        :returns: playable entries of the best hits
+        """
+        server = section._server
+        hits = _uncovered(hits)
+        entries = SectionResults(server.machineIdentifier)
+        seen: Set[str] = set()
+        albums: Optional[Dict[str, List[ResultItem]]] = None
+        details: Optional[Dict[str, ResultItem]] = None
+        for position, hit in enumerate(hits):
+            remaining = limit - len(entries)
+            if remaining <= 0:
+                break
+            if hit.kind == "album":
+                if albums is None:
+                    keys = [h.rating_key for h in hits[position:] if h.kind == "album"]
+                    with span("expand", server=server.friendlyName, section=section.title):
+                        albums = self._fetch_album_tracks(section, keys)
+                items = albums.get(hit.rating_key, [])
+            elif hit.kind in CONTAINER_KINDS:
+                with span("expand", server=server.friendlyName, section=section.title):
+                    items, _ = self._leaf_items(server, hit.rating_key, 0, remaining)
+            else:
+                if details is None:
+                    keys = [h.rating_key for h in hits[position:] if _missing_details(h)]
+                    with span("metadata", server=server.friendlyName, section=section.title):
+                        details = self._fetch_metadata(server, keys)
+                items = [details.get(hit.rating_key, hit)]
+            for item in items:
+                if len(entries) >= limit or item.rating_key in seen:
+                    continue
+                seen.add(item.rating_key)
+                entries.add(self._construct_item_entry(server, item), item.guid)
+        return entries
+
+    @staticmethod
+    def _fetch_metadata(server: PlexServer, rating_keys: List[str]) -> Dict[str, ResultItem]:
+        """Fetch the full metadata of several items in a single request"""
+        if not rating_keys:
+            return {}
+        data = server.query(f"/library/metadata/{','.join(rating_keys)}")
+        items = [ResultItem.from_element(elem) for elem in data if elem.attrib.get("ratingKey")]
+        return {item.rating_key: item for item in items}
+
+    def _fetch_album_tracks(
+        self, section: LibrarySection, album_keys: List[str]
+    ) -> Dict[str, List[ResultItem]]:
+        """
+        Fetch the tracks of several albums of a section in a single request
+        :returns: tracks of each album in disc and track order, keyed by album rating key
+        """
+        if len(album_keys) == 1:
+            items, _ = self._leaf_items(section._server, album_keys[0], 0, None)
+            return {album_keys[0]: items}
+        params = {"type": utils.searchType("track"), "album.id": ",".join(album_keys)}
+        data = section._server.query(
+            f"/library/sections/{section.key}/all?{urlencode(params)}"
+        )
+        tracks: Dict[str, List[ResultItem]] = {}
+        for elem in data:
+            if elem.attrib.get("ratingKey"):
+                item = ResultItem.from_element(elem)
+                tracks.setdefault(item.parent_rating_key, []).append(item)
+        for items in tracks.values():
+            items.sort(key=lambda item: (item.parent_index or 0, item.item_index or 0))
+        return tracks
+
+    @staticmethod
+    def _leaf_items(
+        server: PlexServer, rating_key: str, start: int, size: Optional[int]
+    ) -> Tuple[List[ResultItem], int]:
+        """
+        Fetch one page of the tracks or episodes below an artist, album or show
+        :param size: page size, everything from start if None
+        :returns: compact items and the total number of leaves
+        """
+        params = {"X-Plex-Container-Start": start}
+        if size is not None:
+            params["X-Plex-Container-Size"] = size
+        data = server.query(f"/library/metadata/{rating_key}/allLeaves?{urlencode(params)}")
+        items = [ResultItem.from_element(elem) for elem in data if elem.attrib.get("ratingKey")]
+        return items, int(data.attrib.get("totalSize", data.attrib.get("size", 0)))
+
+    def _fetch_leaves(
+        self, server: PlexServer, rating_key: str, start: int, size: int
+    ) -> Tuple[SectionResults, int]:
+        """
+        Fetch one page of the tracks or episodes below an artist, album or show
+        :returns: playable entries and the total number of leaves
+        """
+        items, total = self._leaf_items(server, rating_key, start, size)
+        entries = SectionResults(server.machineIdentifier)
+        for item in items:
+            entries.add(self._construct_item_entry(server, item, resolve=True), item.guid)
+        return entries, total
+
+    def resolve(self, entry: dict) -> List[MediaEntry]:
+        """
+        Turn a lazy search result into playable MediaEntries
+        :param entry: lazy result as sent back by OCP when it was selected
+        :returns: entries to queue, with a placeholder for the next page last
+        """
+        parsed = parse_lazy_uri(entry.get("uri", ""))
+        if parsed is None or parsed[0] not in self.servers_by_id:
+            LOG.warning("Unable to resolve Plex result %s", entry.get("uri"))
+            return []
+        server_id, kind, rating_key, start = parsed
+        server = self.servers_by_id[server_id]
+        if kind in INDEXED_KINDS:
+            item = self._fetch_metadata(server, [rating_key]).get(rating_key)
+            resolved = MediaEntry.from_dict(entry)
+            resolved.uri = self.streams.url(
+                server, item or ResultItem(rating_key=rating_key, kind=kind)
+            )
+            resolved.playback = ITEM_TYPES[kind][1]
+            return [resolved]
+        return self.expand(server, kind, rating_key, start, entry)
+
+    def expand(
+        self, server: PlexServer, kind: str, rating_key: str, start: int, entry: dict
+    ) -> List[MediaEntry]:
+        """
+        Fetch one page of the tracks or episodes of an artist, album or show
+        :param server: server the container belongs to
+        :param kind: container type (artist, album or show)
+        :param rating_key: container rating key
+        :param start: offset of the first item to fetch
+        :param entry: lazy result of the container, reused for the next page
+        :returns: playable entries followed by a placeholder if items remain
+        """
+        entries, total = self._fetch_leaves(server, rating_key, start, self.page_size)
+        if entries and start + len(entries) < total:
+            next_page = MediaEntry.from_dict(entry)
+            next_page.uri = lazy_uri(
+                server.machineIdentifier, kind, rating_key, start + len(entries)
+            )
+            next_page.playback = PlaybackType.SKILL
+            entries.append(next_page)
+        return entries
+
+    def search(
+        self, query: str, music: bool = False, movies: bool = False, shows: bool = False
+    ) -> Dict[str, List[MediaEntry]]:
+        """
+        Search the requested media kinds, answering repeated searches from the cache
+        :param query: search phrase
+        :param music: search music libraries
+        :param movies: search movie libraries
+        :param shows: search TV show libraries
+        :returns: dict of "music", "movies" and "shows" result lists
+        """
+        results: Dict[str, List[MediaEntry]] = {"music": [], "movies": [], "shows": []}
+        for kind, entries in self.iter_search(query, music, movies, shows, stream=False):
+            results[kind] += entries
+        return results
+
+    def iter_search(
+        self,
+        query: str,
+        music: bool = False,
+        movies: bool = False,
+        shows: bool = False,
+        fuzzy: bool = True,
+        stream: bool = True,
+    ) -> Iterator[Tuple[str, List[MediaEntry]]]:
+        """
+        Search the requested media kinds, yielding results as soon as each library answers
+        :param query: search phrase
+        :param music: search music libraries
+        :param movies: search movie libraries
+        :param shows: search TV show libraries
+        :param fuzzy: retry kinds without results with the closest sounding title
+        :param stream: yield each library as it answers, rather than waiting for all of
+            them to keep the replicas of items found on several servers on the nearest one
+        :returns: iterator of ("music", "movies" or "shows", results) batches
+        """
+        wanted = {"music": music, "movies": movies, "shows": shows}
+        answered: Set[str] = set()
+        for kind, entries in self._iter_search(query, wanted, stream):
+            answered.add(kind)
+            yield kind, entries
+        if not fuzzy or self.matcher is None:
+            return
+        for kind in [kind for kind, want in wanted.items() if want and kind not in answered]:
+            with span("fuzzy_match", kind=kind):
+                best = self.matcher.best(query, MATCH_KINDS[kind])
+            if best is None or best[2].lower() == query.lower():
+                continue
+            LOG.info("No Plex %s results for %s, trying %s", kind, query, best[2])
+            yield from self.iter_search(best[2], fuzzy=False, stream=stream, **{kind: True})
+
+    def _iter_search(
+        self, query: str, wanted: Dict[str, bool], stream: bool = True
+    ) -> Iterator[Tuple[str, List[MediaEntry]]]:
+        """Search the wanted media kinds, answering repeated searches from the cache"""
+        server_ids = list(self.servers_by_id)
+        mode = "lazy" if self.lazy else ""
+        missing = []
+        for kind in [kind for kind, want in wanted.items() if want]:
+            cached = (
+                self.search_cache.get(SearchCache.key(query, kind, server_ids, mode))
+                if self.search_cache
+                else None
+            )
+            if cached is None:
+                missing.append(kind)
+            elif cached:
+                yield kind, cached
+        if not missing:
+            LOG.debug("Plex search for %s answered from cache", query)
+            return
+
+        found: Dict[str, List[MediaEntry]] = {kind: [] for kind in missing}
+        incomplete: Set[str] = set()
+        seen: Set[str] = set()
+        for kind, entries in self._iter_uncached(query, missing, incomplete, stream):
+            entries = unique(entries, seen)[: self.max_results[kind] - len(found[kind])]
+            if entries:
+                found[kind] += entries
+                yield kind, entries
+        for kind, entries in found.items():
+            LOG.debug("Found %s %s results in Plex", len(entries), kind)
+            if self.search_cache and kind not in incomplete:
+                self.search_cache.put(SearchCache.key(query, kind, server_ids, mode), entries)
+        if self.search_cache:
+            LOG.debug("Plex search cache: %s", self.search_cache.stats)
+
+    def _iter_uncached(
+        self, query: str, kinds: List[str], incomplete: Set[str], stream: bool = True
+    ) -> Iterator[Tuple[str, List[MediaEntry]]]:
+        """
+        Search media kinds on the local index or on every library section in parallel
+        :param query: search phrase
+        :param kinds: media kinds to search ("music", "movies" and/or "shows")
+        :param incomplete: filled with the kinds missing results from a section
+        :param stream: yield in the order the sections answer instead of nearest first
+        :returns: iterator of (kind, results)
+        """
+        if not stream:
+            answers = list(self._iter_uncached(query, kinds, incomplete))
+            answers.sort(
+                key=lambda answer: self.latency.cost(getattr(answer[1], "server_id", None))
+            )
+            yield from answers
+            return
+        searches = {
+            "music": (self.music, self._search_music_section, "track"),
+            "movies": (self.movies, self._search_movie_section, "movie"),
+            "shows": (self.shows, self._search_show_section, "episode"),
+        }
+        if self.use_index:
+            for kind in kinds:
+                yield kind, self._search_index(query, searches[kind][2], self.max_results[kind])
+            return
+
+        tasks = {}
+        allowed: Dict[str, bool] = {}
+        for kind in kinds:
+            sections, search_section, _ = searches[kind]
+            for section in sections:
+                server_id = section._server.machineIdentifier
+                if server_id not in allowed:
+                    allowed[server_id] = self.health.allow(server_id)
+                if not allowed[server_id]:
+                    LOG.debug("Skipping %s on unhealthy Plex server %s", section.title, server_id)
+                    incomplete.add(kind)
+                    continue
+                future = self._executor.submit(
+                    copy_context().run, _timed, search_section, section, query
+                )
+                tasks[future] = (kind, section)
+
+        timings: Dict[str, float] = {}
+        failed: Set[str] = set()
+        pending = set(tasks)
+        try:
+            for future in as_completed(tasks, timeout=self.search_timeout):
+                pending.discard(future)
+                kind, section = tasks[future]
+                server = section._server.friendlyName
+                try:
+                    entries, elapsed = future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    LOG.warning("Plex search of %s on %s failed: %s", section.title, server, e)
+                    failed.add(section._server.machineIdentifier)
+                    incomplete.add(kind)
+                    continue
+                self.health.success(section._server.machineIdentifier)
+                timings[server] = max(timings.get(server, 0.0), elapsed)
+                yield kind, entries
+        except FutureTimeoutError:
+            for future in pending:
+                kind, section = tasks[future]
+                future.cancel()
+                server = section._server.friendlyName
+                LOG.warning(
+                    "Plex search of %s on %s missed the %ss deadline",
+                    section.title,
+                    server,
+                    self.search_timeout,
+                )
+                timings[server] = self.search_timeout
+                failed.add(section._server.machineIdentifier)
+                incomplete.add(kind)
+        # One failure per server and search, however many of its sections failed
+        for server_id in failed:
+            self.health.failure(server_id)
+        self.last_timings = timings
+        LOG.info(
+            "Plex search timings: %s",
+            ", ".join(f"{name}={elapsed:.3f}s" for name, elapsed in timings.items()),
+        )
+
+    def search_music(self, query: str):
+        """Search music libraries"""
+        return self.search(query, music=True)["music"]
+
+    def _search_music_section(self, section: MusicSection, query: str) -> List[MediaEntry]:
+        """Search a single music library"""
+        hits = self._rank_hits(section, query, MATCH_KINDS["music"])
+        if self.lazy:
+            return self._construct_placeholders(section, hits, self.max_results["music"])
+        return self._expand_hits(section, hits, self.max_results["music"])
+
     def search_movies(self, query: str):
         """Search movie libraries"""
-        movie_list = []
-        for movies in self.movies:
-            results = movies.hubSearch(query)
-            for result in results:
-                if isinstance(result, Movie):
-                    movie_list.append(self._construct_movie_dict(result))
-        LOG.debug("Found %s movies in Plex", len(movie_list))
-        return movie_list
-
-    def _construct_movie_dict(self, mov):
-        """Construct a dictionary of Movies for use with OVOS Common Play"""
-        return MediaEntry(
-            media_type=MediaType.MOVIE,
-            uri=mov.getStreamURL(),
-            title=mov.title,
-            playback=PlaybackType.VIDEO,
-            image=mov.thumbUrl if mov.thumbUrl else "",
-            artist=(
-                ", ".join([director.tag for director in mov.directors])
-                if mov.directors
-                else ""
-            ),
-            length=mov.duration,
-        )
+        return self.search(query, movies=True)["movies"]
+
+    def _search_movie_section(self, section: MovieSection, query: str) -> List[MediaEntry]:
+        """Search a single movie library"""
+        hits = self._rank_hits(section, query, MATCH_KINDS["movies"])
+        if self.lazy:
+            return self._construct_placeholders(section, hits, self.max_results["movies"])
+        return self._expand_hits(section, hits, self.max_results["movies"])
 
     def search_shows(self, query: str):
         """Search TV Show libraries"""
-        show_list = []
-        for shows in self.shows:
-            results = shows.hubSearch(query)
-            for result in results:
-                episodes = self._get_episodes_from_result(result)
-                show_list += [self._construct_show_dict(show) for show in episodes]
-        LOG.debug("Found %s TV shows in Plex", len(show_list))
-        return show_list
-
-    def _get_episodes_from_result(self, result):
-        """Get TV Episodes from search results"""
-        if isinstance(result, Show):
-            return result.episodes()
-        if isinstance(result, Episode):
-            return [result]
-        return []
-
-    def _construct_show_dict(self, show):
-        """Construct a dictionary of Shows for use with OVOS Common Play"""
-        return MediaEntry(
-            media_type=MediaType.TV,
-            uri=show.getStreamURL(),
-            title=f"{show.seasonEpisode if show.seasonEpisode else ''} - {show.title}",
-            playback=PlaybackType.VIDEO,
-            image=show.thumbUrl if show.thumbUrl else "",
-            artist=(
-                ", ".join([director.tag for director in show.directors])
-                if show.directors
-                else ""
-            ),
-            length=show.duration,
-        )
+        return self.search(query, shows=True)["shows"]
+
+    def _search_show_section(self, section: ShowSection, query: str) -> List[MediaEntry]:
+        """Search a single TV Show library"""
+        hits = self._rank_hits(section, query, MATCH_KINDS["shows"])
+        if self.lazy:
+            return self._construct_placeholders(section, hits, self.max_results["shows"])
+        return self._expand_hits(section, hits, self.max_results["shows"])
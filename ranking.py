@@ -0,0 +1,56 @@
+from difflib import SequenceMatcher
+from typing import List, Sequence, Set
+
+# Result caps per media kind applied before hub hits are expanded
+DEFAULT_MAX_RESULTS = {"music": 100, "movies": 20, "shows": 100}
+
+# Hub hits per library section that are kept and expanded
+DEFAULT_MAX_HITS = 10
+
+
+def _words(text: str) -> Set[str]:
+    return set("".join(c if c.isalnum() else " " for c in text.lower()).split())
+
+
+def score_hit(phrase: str, title: str, context: Sequence[str] = ()) -> float:
+    """
+    Score a search hit against the user phrase, from 0 (unrelated) to 1 (exact title)
+    :param phrase: user search phrase
+    :param title: title of the hit
+    :param context: parent, grandparent or artist titles of the hit
+    :returns: weighted word coverage of the phrase plus title similarity
+    """
+    query = _words(phrase)
+    if not query:
+        return 0.0
+    title_words = _words(title)
+    if title_words == query:
+        return 1.0
+    context_words = title_words.union(*(_words(text) for text in context if text))
+    title_coverage = len(query & title_words) / len(query)
+    coverage = len(query & context_words) / len(query)
+    similarity = SequenceMatcher(None, phrase.lower(), title.lower()).ratio()
+    return 0.5 * title_coverage + 0.3 * coverage + 0.2 * similarity
+
+
+def rank_hits(phrase: str, hits: list, limit: int) -> List:
+    """
+    Order hub search hits by score, keeping Plex's order for ties
+    :param phrase: user search phrase
+    :param hits: ResultItems of a hub search
+    :param limit: maximum number of hits to return
+    :returns: the best scoring hits
+    """
+    scored = [
+        (
+            score_hit(
+                phrase,
+                hit.title or "",
+                (hit.parent_title, hit.grandparent_title),
+            ),
+            hit,
+        )
+        for hit in hits
+    ]
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return [hit for _, hit in scored[:limit]]
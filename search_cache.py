@@ -0,0 +1,103 @@
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+from ovos_utils.log import LOG
+from ovos_workshop.backwards_compat import MediaEntry
+
+
+def normalize_phrase(phrase: str) -> str:
+    """Lowercase a phrase and collapse punctuation and whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", phrase.lower()).split())
+
+
+class SearchCache:
+    """Bounded LRU cache of search results with a time to live"""
+
+    def __init__(self, max_entries: int = 128, ttl: float = 600, path: Optional[str] = None):
+        """
+        :param max_entries: number of searches to keep, least recently used are evicted
+        :param ttl: seconds a cached result stays valid
+        :param path: optional JSON file to persist the cache across restarts
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+        if path:
+            self.load()
+
+    @staticmethod
+    def key(phrase: str, kind: str, server_ids: Iterable[str], mode: str = "") -> str:
+        """Cache key for a search of one media kind across a set of servers"""
+        return "|".join([kind, mode, ",".join(sorted(server_ids)), normalize_phrase(phrase)])
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counters and the current number of cached searches"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def get(self, key: str) -> Optional[List[MediaEntry]]:
+        """Return fresh copies of cached results, or None on a miss"""
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or time.time() - cached[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return [MediaEntry.from_dict(entry) for entry in cached[1]]
+
+    def put(self, key: str, entries: List[MediaEntry]):
+        """Cache the results of a search"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), [entry.as_dict for entry in entries])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached result, e.g. after a library changed"""
+        with self._lock:
+            self._entries.clear()
+        LOG.debug("Plex search cache cleared")
+
+    def load(self):
+        """Read persisted results, skipping any that already expired"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            LOG.warning("Ignoring unreadable Plex search cache %s: %s", self.path, e)
+            return
+        now = time.time()
+        with self._lock:
+            for key, (created, results) in entries.items():
+                if now - created <= self.ttl:
+                    self._entries[key] = (created, results)
+
+    def save(self):
+        """Persist the cache if a path was configured"""
+        if not self.path:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            LOG.warning("Unable to write Plex search cache: %s", e)
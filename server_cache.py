@@ -0,0 +1,47 @@
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from ovos_utils.log import LOG
+
+
+class ServerCache:
+    """On-disk cache of resolved Plex server connections and their library sections"""
+
+    def __init__(self, path: str, ttl: float = 86400):
+        """
+        :param path: JSON file to store the cache in
+        :param ttl: seconds a cached discovery is considered fresh
+        """
+        self.path = path
+        self.ttl = ttl
+
+    def load(self, allow_stale: bool = False) -> Optional[List[Dict]]:
+        """
+        Read cached servers
+        :param allow_stale: also return servers cached longer than the TTL ago
+        :returns: list of server dicts, or None if there is no usable cache
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            LOG.warning("Ignoring unreadable Plex server cache %s: %s", self.path, e)
+            return None
+        if not allow_stale and time.time() - cache.get("created", 0) > self.ttl:
+            LOG.info("Plex server cache expired")
+            return None
+        return cache.get("servers") or None
+
+    def save(self, servers: List[Dict]):
+        """
+        Replace the cached servers
+        :param servers: dicts with name, machine_id, url, token and sections_xml
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "servers": servers}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,103 @@
+import time
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional
+
+from ovos_utils.log import LOG
+
+
+class ServerHealth:
+    """
+    Circuit breaker per Plex server: searches skip a server after repeated
+    failures, and a background probe closes the circuit once it answers again
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 2,
+        reset_timeout: float = 30,
+        probe_interval: float = 15,
+    ):
+        """
+        :param failure_threshold: consecutive failures that take a server out of searches
+        :param reset_timeout: seconds before a search may try an unhealthy server again
+        :param probe_interval: seconds between background probes of unhealthy servers
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self._failures: Dict[str, int] = {}
+        self._opened: Dict[str, float] = {}
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def success(self, server_id: str):
+        """Record a successful request, closing the circuit of the server"""
+        with self._lock:
+            self._failures.pop(server_id, None)
+            recovered = self._opened.pop(server_id, None) is not None
+        if recovered:
+            LOG.info("Plex server %s is healthy again", server_id)
+
+    def failure(self, server_id: str):
+        """Record a failed or timed out request, opening the circuit at the threshold"""
+        with self._lock:
+            failures = self._failures.get(server_id, 0) + 1
+            self._failures[server_id] = failures
+            if failures < self.failure_threshold:
+                return
+            opened = server_id not in self._opened
+            self._opened[server_id] = time.monotonic()
+        if opened:
+            LOG.warning(
+                "Plex server %s failed %s times, skipping it in searches", server_id, failures
+            )
+
+    def is_open(self, server_id: str) -> bool:
+        """True if the server is considered down"""
+        return server_id in self._opened
+
+    def allow(self, server_id: str) -> bool:
+        """
+        True if a search may use the server: it is healthy, or it has been down for
+        reset_timeout and this caller is let through to try it again
+        """
+        with self._lock:
+            opened = self._opened.get(server_id)
+            if opened is None:
+                return True
+            if time.monotonic() - opened < self.reset_timeout:
+                return False
+            # Half open: let one search through, the others wait another reset_timeout
+            self._opened[server_id] = time.monotonic()
+            return True
+
+    @property
+    def unhealthy(self) -> List[str]:
+        """Ids of the servers considered down"""
+        with self._lock:
+            return list(self._opened)
+
+    def start(self, probe: Callable[[str], bool]):
+        """
+        Probe unhealthy servers in the background every probe_interval
+        :param probe: tries to reach or reconnect a server, True if it succeeded
+        """
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, args=(probe,), daemon=True, name="PlexHealth")
+        self._thread.start()
+
+    def stop(self):
+        """Stop probing"""
+        self._stopped.set()
+
+    def _run(self, probe: Callable[[str], bool]):
+        while not self._stopped.wait(self.probe_interval):
+            for server_id in self.unhealthy:
+                try:
+                    healthy = probe(server_id)
+                except Exception as e:  # pylint: disable=broad-except
+                    LOG.debug("Probe of Plex server %s failed: %s", server_id, e)
+                    healthy = False
+                if healthy:
+                    self.success(server_id)
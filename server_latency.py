@@ -0,0 +1,93 @@
+import time
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional
+
+from ovos_utils.log import LOG
+from plexapi.server import PlexServer
+
+# Round-trip time assumed for servers that were not measured yet
+DEFAULT_RTT = 0.5
+
+# Seconds added to the cost of relayed connections, which are bandwidth limited
+RELAY_PENALTY = 1.0
+
+
+class LatencyTracker:
+    """Background round-trip time measurements of the connected Plex servers"""
+
+    def __init__(self, interval: float = 60, alpha: float = 0.3):
+        """
+        :param interval: seconds between measurements of every server
+        :param alpha: weight of a new measurement in the moving average
+        """
+        self.interval = interval
+        self.alpha = alpha
+        self._rtt: Dict[str, float] = {}
+        self._relay: Dict[str, bool] = {}
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def record(self, server_id: str, rtt: float):
+        """Add a round-trip time measurement to the moving average of a server"""
+        with self._lock:
+            previous = self._rtt.get(server_id)
+            if previous is None or previous == float("inf"):
+                self._rtt[server_id] = rtt
+            else:
+                self._rtt[server_id] = self.alpha * rtt + (1 - self.alpha) * previous
+
+    def set_relay(self, server_id: str, relay: bool):
+        """Remember whether a server is reached through a Plex relay"""
+        with self._lock:
+            self._relay[server_id] = relay
+
+    def is_relay(self, server_id: str) -> bool:
+        """True if the server is reached through a Plex relay"""
+        return self._relay.get(server_id, False)
+
+    def rtt(self, server_id: str) -> Optional[float]:
+        """Average round-trip time of a server, inf if unreachable, None if unknown"""
+        return self._rtt.get(server_id)
+
+    def cost(self, server_id: Optional[str]) -> float:
+        """Relative cost of fetching media from a server, lower is better"""
+        rtt = self._rtt.get(server_id)
+        rtt = DEFAULT_RTT if rtt is None else rtt
+        return rtt + (RELAY_PENALTY if self._relay.get(server_id) else 0.0)
+
+    def measure(self, servers: List[PlexServer]):
+        """Time one /identity request to each server"""
+        for server in servers:
+            start = time.monotonic()
+            try:
+                server.query("/identity")
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Plex server %s did not answer: %s", server.friendlyName, e)
+                with self._lock:
+                    self._rtt[server.machineIdentifier] = float("inf")
+                continue
+            self.record(server.machineIdentifier, time.monotonic() - start)
+
+    def timed(self, connect: Callable[[], PlexServer]) -> PlexServer:
+        """Connect to a server, recording the time it took as its first measurement"""
+        start = time.monotonic()
+        server = connect()
+        self.record(server.machineIdentifier, time.monotonic() - start)
+        return server
+
+    def start(self, servers: Callable[[], List[PlexServer]]):
+        """Measure the servers returned by servers() every interval"""
+        self._stopped.clear()
+        self._thread = Thread(
+            target=self._run, args=(servers,), daemon=True, name="PlexLatency"
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop measuring"""
+        self._stopped.set()
+
+    def _run(self, servers: Callable[[], List[PlexServer]]):
+        while not self._stopped.wait(self.interval):
+            self.measure(servers())
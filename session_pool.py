@@ -0,0 +1,106 @@
+from threading import Lock
+from typing import Dict, Tuple
+
+import requests
+from plexapi.server import PlexServer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .tracing import _escape
+
+METRIC_PREFIX = "plex_http"
+
+
+class SessionPool:
+    """Shared keep-alive HTTP sessions, one per Plex server"""
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10,
+        retries: int = 1,
+        backoff: float = 0.3,
+    ):
+        """
+        :param pool_size: keep-alive connections kept open per server host
+        :param connect_timeout: seconds to wait for a TCP/TLS connection
+        :param read_timeout: seconds to wait for a response once connected
+        :param retries: retries of failed connections and 502/503/504 responses
+        :param backoff: exponential backoff factor between retries, in seconds
+        """
+        self.pool_size = pool_size
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False,
+        )
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = Lock()
+
+    def session(self, key: str) -> requests.Session:
+        """Get the session for a server machine identifier (or "plex.tv"), creating it once"""
+        with self._lock:
+            if key not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                    max_retries=self.retry,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[key] = session
+            return self._sessions[key]
+
+    def adopt(self, server: PlexServer) -> PlexServer:
+        """Route every request of a connected server through its pooled session"""
+        server._session = self.session(server.machineIdentifier)
+        server._timeout = self.timeout
+        return server
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Connections opened and requests sent per session, to spot connection churn"""
+        stats = {}
+        with self._lock:
+            sessions = dict(self._sessions)
+        for key, session in sessions.items():
+            connections = requests_sent = 0
+            for adapter in {id(a): a for a in session.adapters.values()}.values():
+                manager = adapter.poolmanager
+                for pool_key in manager.pools.keys():
+                    pool = manager.pools.get(pool_key)
+                    if pool is not None:
+                        connections += pool.num_connections
+                        requests_sent += pool.num_requests
+            stats[key] = {"connections": connections, "requests": requests_sent}
+        return stats
+
+    def render(self, prefix: str = METRIC_PREFIX) -> str:
+        """Prometheus text exposition of the stats of every session"""
+        stats = self.stats
+        lines = []
+        for stat, description in (
+            ("connections", "HTTP connections opened per Plex server session"),
+            ("requests", "HTTP requests sent per Plex server session"),
+        ):
+            name = f"{prefix}_{stat}_total"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            lines += [
+                f'{name}{{session="{_escape(key)}"}} {counts[stat]}'
+                for key, counts in sorted(stats.items())
+            ]
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
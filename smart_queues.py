@@ -0,0 +1,301 @@
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+from xml.etree.ElementTree import Element
+
+from ovos_utils.log import LOG
+from ovos_workshop.backwards_compat import MediaEntry, PlaybackType
+from plexapi import utils
+from plexapi.library import LibrarySection
+from plexapi.server import PlexServer
+
+from .library_index import ResultItem
+from .plex_api import lazy_uri, parse_lazy_uri
+from .ranking import score_hit
+from .tracing import span
+
+# Kind of the lazy result URIs that page through a server side play queue
+QUEUE_KIND = "playqueue"
+
+LIBRARY_IDENTIFIER = "com.plexapp.plugins.library"
+
+# Minimum score_hit of the artist or show a queue is built for, below which the
+# request is left to the regular search
+MIN_MATCH_SCORE = 0.75
+
+# Words ignored in front of a genre, as in "play some jazz"
+_GENRE_FILLERS = ("some", "a bit of", "a little")
+
+
+def _genre_name(phrase: str) -> str:
+    name = " ".join(phrase.lower().split())
+    for filler in _GENRE_FILLERS:
+        if name.startswith(f"{filler} "):
+            return name[len(filler) + 1 :]
+    return name
+
+
+class SmartQueues:
+    """
+    Radio, shuffle and continue watching requests answered by play queues that
+    the Plex server builds, sent to OCP one page at a time
+    """
+
+    def __init__(self, plex_api):
+        """
+        :param plex_api: PlexAPI whose servers the queues are created on
+        """
+        self.plex_api = plex_api
+        # (server id, section key) -> genre id by lower case genre title
+        self._genres: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self._lock = Lock()
+
+    @property
+    def page_size(self) -> int:
+        """Number of queue items sent to OCP at once"""
+        return self.plex_api.page_size
+
+    def warm(self):
+        """Fetch the genres of every music section ahead of the first request"""
+        genres = {}
+        for section in self.plex_api.music:
+            try:
+                genres[self._section_id(section)] = self._fetch_genres(section)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Unable to fetch the genres of %s: %s", section.title, e)
+        with self._lock:
+            self._genres = genres
+        LOG.debug("Cached the genres of %s Plex music sections", len(genres))
+
+    @staticmethod
+    def _section_id(section: LibrarySection) -> Tuple[str, str]:
+        return section._server.machineIdentifier, str(section.key)
+
+    @staticmethod
+    def _fetch_genres(section: LibrarySection) -> Dict[str, str]:
+        """Genre ids of a music section by lower case title"""
+        params = {"type": utils.searchType("track")}
+        data = section._server.query(
+            f"/library/sections/{section.key}/genre?{urlencode(params)}"
+        )
+        return {
+            elem.attrib["title"].lower(): elem.attrib["key"].rsplit("/", 1)[-1]
+            for elem in data
+            if elem.attrib.get("title") and elem.attrib.get("key")
+        }
+
+    def _best_hit(self, section: LibrarySection, phrase: str, kind: str) -> Optional[ResultItem]:
+        """The best hub search hit of a kind, if it matches the phrase closely enough"""
+        hits = self.plex_api._rank_hits(section, phrase, (kind,))
+        if hits and score_hit(phrase, hits[0].title or "") >= MIN_MATCH_SCORE:
+            return hits[0]
+        return None
+
+    def _nearest(self, sections: List[LibrarySection]) -> List[LibrarySection]:
+        """Sections on healthy servers, nearest server first"""
+        return sorted(
+            (
+                section
+                for section in sections
+                if not self.plex_api.health.is_open(section._server.machineIdentifier)
+            ),
+            key=lambda section: self.plex_api.latency.cost(section._server.machineIdentifier),
+        )
+
+    def genre(self, phrase: str) -> Optional[List[MediaEntry]]:
+        """
+        Shuffle the tracks of a genre, e.g. "some jazz"
+        :returns: first page of the queue, or None if no music section has the genre
+        """
+        name = _genre_name(phrase)
+        for section in self._nearest(self.plex_api.music):
+            section_id = self._section_id(section)
+            with self._lock:
+                genres = self._genres.get(section_id)
+            if genres is None:
+                genres = self._fetch_genres(section)
+                with self._lock:
+                    self._genres[section_id] = genres
+            if name in genres:
+                params = {"type": utils.searchType("track"), "genre": genres[name]}
+                return self._create(
+                    section._server,
+                    f"/library/sections/{section.key}/all?{urlencode(params)}",
+                    title=name.title(),
+                    shuffle=True,
+                )
+        return None
+
+    def shuffle_library(self) -> Optional[List[MediaEntry]]:
+        """Shuffle every track of the nearest music section"""
+        for section in self._nearest(self.plex_api.music):
+            params = {"type": utils.searchType("track")}
+            return self._create(
+                section._server,
+                f"/library/sections/{section.key}/all?{urlencode(params)}",
+                title=section.title,
+                shuffle=True,
+            )
+        return None
+
+    def artist(self, phrase: str, radio: bool = True) -> Optional[List[MediaEntry]]:
+        """
+        Play the Plex radio station of the best matching artist, or shuffle the
+        artist's tracks if a station was not asked for or the server has none
+        """
+        for section in self._nearest(self.plex_api.music):
+            artist = self._best_hit(section, phrase, "artist")
+            if artist is None:
+                continue
+            server = section._server
+            station = None
+            if radio:
+                data = server.query(f"/library/metadata/{artist.rating_key}?includeStations=1")
+                station = next(
+                    (
+                        elem
+                        for stations in data.iter("Stations")
+                        for elem in stations
+                        if elem.attrib.get("key")
+                    ),
+                    None,
+                )
+            if station is not None:
+                return self._create(server, station.attrib["key"], title=f"{artist.title} Radio")
+            return self._create(
+                server, f"/library/metadata/{artist.rating_key}", title=artist.title, shuffle=True
+            )
+        return None
+
+    def continue_show(self, phrase: str) -> Optional[List[MediaEntry]]:
+        """Queue the episodes of the best matching show, starting with the one on deck"""
+        for section in self._nearest(self.plex_api.shows):
+            show = self._best_hit(section, phrase, "show")
+            if show is None:
+                continue
+            server = section._server
+            data = server.query(f"/library/metadata/{show.rating_key}?includeOnDeck=1")
+            on_deck = next((elem for deck in data.iter("OnDeck") for elem in deck), None)
+            return self._create(
+                server,
+                f"/library/metadata/{show.rating_key}",
+                title=show.title,
+                start_key=on_deck.attrib.get("ratingKey") if on_deck is not None else None,
+                queue_type="video",
+            )
+        return None
+
+    def continue_watching(self) -> List[MediaEntry]:
+        """The partly watched movies and next episodes on deck, nearest server first"""
+        entries: List[MediaEntry] = []
+        servers = {
+            section._server.machineIdentifier: section._server
+            for section in self._nearest(self.plex_api.movies + self.plex_api.shows)
+        }
+        for server in servers.values():
+            params = {"X-Plex-Container-Start": 0, "X-Plex-Container-Size": self.page_size}
+            with span("on_deck", server=server.friendlyName):
+                data = server.query(f"/library/onDeck?{urlencode(params)}")
+            entries += [
+                self.plex_api._construct_item_entry(server, ResultItem.from_element(elem))
+                for elem in data
+                if elem.attrib.get("ratingKey")
+            ]
+        return entries[: self.page_size]
+
+    def _create(
+        self,
+        server: PlexServer,
+        key: str,
+        title: str,
+        shuffle: bool = False,
+        start_key: Optional[str] = None,
+        queue_type: str = "audio",
+    ) -> List[MediaEntry]:
+        """
+        Have the server build a play queue of a library key and fetch its first page
+        :param server: server the key belongs to
+        :param key: library path, e.g. a filtered section or an artist's metadata
+        :param title: name of the queue shown on its page placeholders
+        :param shuffle: shuffle the queue on the server
+        :param start_key: rating key of the item to start at
+        :param queue_type: "audio" or "video"
+        :returns: entries of the first page, followed by a placeholder for the next
+        """
+        params = {
+            "type": queue_type,
+            "uri": f"server://{server.machineIdentifier}/{LIBRARY_IDENTIFIER}{key}",
+            "shuffle": int(shuffle),
+            "continuous": int(start_key is not None),
+            "window": self.page_size,
+            "includeBefore": 0,
+        }
+        if start_key is not None:
+            params["key"] = f"/library/metadata/{start_key}"
+        with span("play_queue", server=server.friendlyName):
+            data = server.query(f"/playQueues?{urlencode(params)}", method=server._session.post)
+        items = [elem for elem in data if elem.attrib.get("playQueueItemID")]
+        selected = data.attrib.get("playQueueSelectedItemID")
+        position = next(
+            (i for i, elem in enumerate(items) if elem.attrib["playQueueItemID"] == selected), 0
+        )
+        first = int(data.attrib.get("playQueueSelectedItemOffset", 0)) - position
+        return self._page(server, data, items, first, title)
+
+    def next_page(self, entry: dict) -> List[MediaEntry]:
+        """
+        Fetch the queue items following a page placeholder
+        :param entry: placeholder as sent back by OCP when it was reached
+        :returns: entries of the page, followed by a placeholder if items remain
+        """
+        parsed = parse_lazy_uri(entry.get("uri", ""))
+        servers = self.plex_api.servers_by_id
+        if parsed is None or parsed[1] != QUEUE_KIND or parsed[0] not in servers:
+            LOG.warning("Unable to page Plex play queue %s", entry.get("uri"))
+            return []
+        server_id, _, queue, start = parsed
+        server = servers[server_id]
+        queue_id, _, after = queue.partition(":")
+        params = {"window": self.page_size + 1, "center": after, "includeBefore": 0}
+        with span("play_queue", server=server.friendlyName):
+            data = server.query(f"/playQueues/{queue_id}?{urlencode(params)}")
+        items = [
+            elem
+            for elem in data
+            if elem.attrib.get("playQueueItemID") not in (None, after)
+        ][: self.page_size]
+        return self._page(server, data, items, start, entry.get("title", ""))
+
+    def _page(
+        self, server: PlexServer, data: Element, items: List[Element], first: int, title: str
+    ) -> List[MediaEntry]:
+        """
+        Build the entries of a page of queue items
+        :param data: play queue response the items were taken from
+        :param items: queue items of the page
+        :param first: position of the first item of the page in the queue
+        :param title: name of the queue
+        """
+        entries = [
+            self.plex_api._construct_item_entry(
+                server, ResultItem.from_element(elem), resolve=True
+            )
+            for elem in items
+        ]
+        total = int(data.attrib.get("playQueueTotalCount", 0))
+        if items and first + len(items) < total:
+            last = items[-1].attrib["playQueueItemID"]
+            next_page = MediaEntry(
+                title=title,
+                image=entries[-1].image,
+                media_type=entries[-1].media_type,
+                uri=lazy_uri(
+                    server.machineIdentifier,
+                    QUEUE_KIND,
+                    f"{data.attrib['playQueueID']}:{last}",
+                    first + len(items),
+                ),
+                playback=PlaybackType.SKILL,
+            )
+            entries.append(next_page)
+        return entries
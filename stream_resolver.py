@@ -0,0 +1,198 @@
+from threading import Lock
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+from xml.etree.ElementTree import Element
+
+from ovos_utils.log import LOG
+from plexapi.server import PlexServer
+
+from .library_index import MediaInfo, ResultItem
+from .tracing import span
+
+DIRECT_PLAY = "directplay"
+DIRECT_STREAM = "copy"
+TRANSCODE = "transcode"
+
+# Client profile sent instead of the Chrome browser profile, so Plex direct plays
+# every format the players OCP uses (mpv, VLC, GStreamer) can decode
+DIRECT_PLAY_PROFILE = "+".join(
+    (
+        "add-direct-play-profile(type=musicProfile"
+        "&container=flac,mp3,mp4,m4a,ogg,opus,wav,aiff,wma,mka"
+        "&audioCodec=flac,mp3,aac,alac,vorbis,opus,pcm,wmav2,ac3,eac3)",
+        "add-direct-play-profile(type=videoProfile"
+        "&container=mkv,mp4,m4v,mov,avi,mpegts,webm,wmv"
+        "&videoCodec=h264,hevc,mpeg4,mpeg2video,vp8,vp9,av1,vc1,wmv3"
+        "&audioCodec=aac,ac3,eac3,dca,dts,truehd,mp3,flac,opus,vorbis,pcm)",
+    )
+)
+
+
+class StreamDecision(NamedTuple):
+    """How a server streams one media profile to this device"""
+
+    method: str
+    bitrate: Optional[int] = None
+
+
+def stream_url(server: PlexServer, rating_key: str, kind: str, **extra) -> str:
+    """
+    Build the same universal transcode URL as plexapi's getStreamURL
+    :param extra: additional transcoder parameters, e.g. directStream=1
+    """
+    params = {
+        "path": f"/library/metadata/{rating_key}",
+        "mediaIndex": 0,
+        "partIndex": 0,
+        "fastSeek": 1,
+        "copyts": 1,
+        "offset": 0,
+        "X-Plex-Platform": "Chrome",
+        **extra,
+    }
+    streamtype = "audio" if kind == "track" else "video"
+    return server.url(
+        f"/{streamtype}/:/transcode/universal/start.m3u8?{urlencode(params)}",
+        includeToken=True,
+    )
+
+
+def _parse_decision(data: Element) -> StreamDecision:
+    """Read the decision of a universal transcoder decision response"""
+    media = next(data.iter("Media"), None)
+    part = media.find("Part") if media is not None else None
+    if part is None:
+        return StreamDecision(TRANSCODE)
+    if part.attrib.get("decision") == DIRECT_PLAY:
+        return StreamDecision(DIRECT_PLAY)
+    if all(stream.attrib.get("decision") != TRANSCODE for stream in part.iter("Stream")):
+        return StreamDecision(DIRECT_STREAM)
+    bitrate = media.attrib.get("bitrate")
+    return StreamDecision(TRANSCODE, int(bitrate) if bitrate else None)
+
+
+class StreamResolver:
+    """
+    Stream URLs built from the direct play, direct stream or transcode decision of
+    each server, asked once per media profile and reused for every item sharing it
+    """
+
+    def __init__(
+        self,
+        max_bitrate: int = 0,
+        direct_play: bool = True,
+        profile: Optional[str] = None,
+    ):
+        """
+        :param max_bitrate: kbps above which the server transcodes, 0 for no limit
+        :param direct_play: allow playing files as they are, without the transcoder
+        :param profile: X-Plex-Client-Profile-Extra describing the formats the player
+            decodes, defaulting to DIRECT_PLAY_PROFILE
+        """
+        self.max_bitrate = max_bitrate
+        self.direct_play = direct_play
+        self.profile = profile or DIRECT_PLAY_PROFILE
+        self._decisions: Dict[Tuple, StreamDecision] = {}
+        self._lock = Lock()
+
+    def _profile(self, server: PlexServer, item: ResultItem) -> Tuple:
+        """Cache key of the decisions that apply to an item"""
+        media: MediaInfo = item.media
+        over_limit = bool(self.max_bitrate and (media.bitrate or 0) > self.max_bitrate)
+        return (
+            server.machineIdentifier,
+            item.kind == "track",
+            media.container,
+            media.audio_codec,
+            media.video_codec,
+            media.resolution,
+            over_limit,
+        )
+
+    @property
+    def _client(self) -> Dict[str, str]:
+        """Parameters identifying this device's player to the transcoder"""
+        return {"X-Plex-Platform": "Generic", "X-Plex-Client-Profile-Extra": self.profile}
+
+    def clear(self, server_id: Optional[str] = None):
+        """Forget the decisions of one server, or of every server"""
+        with self._lock:
+            if server_id is None:
+                self._decisions.clear()
+            else:
+                self._decisions = {
+                    profile: decision
+                    for profile, decision in self._decisions.items()
+                    if profile[0] != server_id
+                }
+
+    def _limits(self, kind: str, bitrate: Optional[int] = None) -> Dict[str, int]:
+        """Transcoder bitrate parameter, bitrate defaulting to max_bitrate"""
+        bitrate = bitrate or self.max_bitrate
+        if not bitrate:
+            return {}
+        return {"musicBitrate" if kind == "track" else "maxVideoBitrate": bitrate}
+
+    def decide(self, server: PlexServer, item: ResultItem) -> Optional[StreamDecision]:
+        """
+        Ask the server how it would stream an item, unless an item of the same
+        profile was decided before
+        :returns: the decision, or None if the item has no media information
+        """
+        if item.media is None:
+            return None
+        profile = self._profile(server, item)
+        with self._lock:
+            decision = self._decisions.get(profile)
+        if decision is not None:
+            return decision
+        params = {
+            "path": f"/library/metadata/{item.rating_key}",
+            "mediaIndex": 0,
+            "partIndex": 0,
+            "protocol": "hls",
+            "directPlay": int(self.direct_play),
+            "directStream": 1,
+            **self._client,
+            **self._limits(item.kind),
+        }
+        streamtype = "audio" if item.kind == "track" else "video"
+        with span("stream_decision", server=server.friendlyName):
+            data = server.query(
+                f"/{streamtype}/:/transcode/universal/decision?{urlencode(params)}"
+            )
+        decision = _parse_decision(data)
+        with self._lock:
+            self._decisions[profile] = decision
+        LOG.debug("Plex server %s will %s %s", server.friendlyName, decision.method, profile[2:])
+        return decision
+
+    def url(self, server: PlexServer, item: ResultItem, resolve: bool = True) -> Optional[str]:
+        """
+        Stream URL of a track, movie or episode
+        :param resolve: ask the server for a decision if none is cached, rather
+            than returning None
+        :returns: direct file URL, or universal transcoder URL with the decided
+            settings, or None if resolve is False and nothing is cached
+        """
+        if item.media is None:
+            if not resolve:
+                return None
+            return stream_url(server, item.rating_key, item.kind, **self._client)
+        if resolve:
+            try:
+                decision = self.decide(server, item)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Unable to get a stream decision from %s: %s", server.friendlyName, e)
+                return stream_url(server, item.rating_key, item.kind, **self._client)
+        else:
+            with self._lock:
+                decision = self._decisions.get(self._profile(server, item))
+            if decision is None:
+                return None
+        if decision.method == DIRECT_PLAY and item.media.part_key:
+            return server.url(item.media.part_key, includeToken=True)
+        extra = {"directPlay": 0, "directStream": 1, **self._client}
+        if decision.method == TRANSCODE:
+            extra.update(self._limits(item.kind, decision.bitrate))
+        return stream_url(server, item.rating_key, item.kind, **extra)
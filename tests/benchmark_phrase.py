@@ -0,0 +1,85 @@
+# pylint: disable=missing-docstring
+"""
+Phrase normalization micro-benchmark
+
+Times PhraseParser against the previous voc_match/remove_voc/str.replace chain over
+the utterance corpus of test_phrase_parser.
+
+    python tests/benchmark_phrase.py --rounds 2000
+"""
+import argparse
+import re
+import time
+from typing import Callable, Dict, List
+
+from benchmark_search import percentile
+from test_phrase_parser import CORPUS, load_vocabularies
+
+from skill_plex.phrase_parser import PhraseParser
+
+
+def legacy_parse(vocabularies: Dict[str, List[str]]) -> Callable[[str], str]:
+    """The normalization search_plex did before PhraseParser, without the skill"""
+
+    def voc_match(utt: str, name: str) -> bool:
+        return any(re.search(rf"\b{re.escape(v)}\b", utt.lower()) for v in vocabularies[name])
+
+    def remove_voc(utt: str, name: str) -> str:
+        for term in sorted(vocabularies[name], key=len, reverse=True):
+            utt = re.sub(r"\b" + term + r"\b", "", utt)
+        return utt
+
+    def parse(phrase: str) -> str:
+        if voc_match(phrase, "plex"):
+            phrase = remove_voc(phrase, "plex")
+        voc_match(phrase, "movie")
+        voc_match(phrase, "tv")
+        phrase = remove_voc(phrase, "movie")
+        phrase = remove_voc(phrase, "tv")
+        return (
+            phrase.replace("plex", "")
+            .replace("plexx", "")
+            .replace(" on ", "")
+            .replace("in ", "")
+            .strip()
+        )
+
+    return parse
+
+
+def measure(name: str, parse: Callable[[str], object], rounds: int) -> Dict:
+    latencies = []
+    for _ in range(rounds):
+        for utterance, _, _ in CORPUS:
+            start = time.perf_counter()
+            parse(utterance)
+            latencies.append(time.perf_counter() - start)
+    return {
+        "name": name,
+        "calls": len(latencies),
+        "p50_us": percentile(latencies, 50) * 1e6,
+        "p95_us": percentile(latencies, 95) * 1e6,
+        "p99_us": percentile(latencies, 99) * 1e6,
+        "total_ms": sum(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--rounds", type=int, default=1000, help="passes over the corpus")
+    options = parser.parse_args()
+    vocabularies = load_vocabularies()
+    start = time.perf_counter()
+    phrase_parser = PhraseParser(vocabularies)
+    print(f"Compiled PhraseParser in {(time.perf_counter() - start) * 1e6:.0f}us")
+    reports = [
+        measure("legacy voc_match chain", legacy_parse(vocabularies), options.rounds),
+        measure("PhraseParser.parse", phrase_parser.parse, options.rounds),
+    ]
+    print(" | ".join(reports[0]))
+    for report in reports:
+        print(" | ".join(f"{v:.2f}" if isinstance(v, float) else str(v) for v in report.values()))
+
+
+if __name__ == "__main__":
+    main()
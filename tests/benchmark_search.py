@@ -0,0 +1,196 @@
+# pylint: disable=missing-docstring,protected-access
+"""
+Search benchmark against a synthetic Plex library served by FakePlex
+
+Runs PlexAPI.search_* and PlexSkill.search_plex and reports latency percentiles,
+HTTP calls per query and peak memory, overall and per query. The fake server runs in
+its own process, so the memory figures only cover the client. Per query peak RSS needs
+Linux, where the peak is reset through /proc/self/clear_refs before every query.
+
+    python tests/benchmark_search.py --tracks 100000 --latency 0.02
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+import tracemalloc
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, Optional
+from unittest.mock import patch
+from urllib.request import urlopen
+
+from fake_plex import WORDS, FakePlex
+from ovos_plugin_common_play import MediaType
+from ovos_utils.fakebus import FakeBus
+from plexapi.server import PlexServer
+
+from skill_plex import PlexSkill
+from skill_plex.library_sync import LibrarySync
+from skill_plex.plex_api import PlexAPI
+from skill_plex.session_pool import SessionPool
+
+ALBUMS_PER_ARTIST = 4
+TRACKS_PER_ALBUM = 12
+
+
+def _serve(options: dict, ready, stop):
+    fake = FakePlex(name="Benchmark", latency=options["latency"])
+    artists = max(1, options["tracks"] // (ALBUMS_PER_ARTIST * TRACKS_PER_ALBUM))
+    fake.add_music_library("1", artists, ALBUMS_PER_ARTIST, TRACKS_PER_ALBUM)
+    fake.add_movie_library("2", options["movies"])
+    fake.add_tv_library("3", options["shows"], options["seasons"], options["episodes"])
+    ready.put(fake.start().url)
+    stop.wait()
+    fake.stop()
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def queries(count: int) -> List[str]:
+    """Phrases hitting artists, titles and nothing at all, in a fixed order"""
+    phrases = []
+    for i in range(count):
+        first, second = WORDS[i % len(WORDS)], WORDS[(i * 7 + 3) % len(WORDS)]
+        phrases.append(f"{first} {second}" if i % 5 else f"nothing like {first}")
+    return phrases
+
+
+def peak_rss_mb(reset: bool = False) -> Optional[float]:
+    """Peak resident memory of this process since the last reset, None if unknown"""
+    try:
+        if reset:
+            with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+                f.write("5")
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def measure(name: str, search: Callable[[str], int], phrases: List[str], url: str) -> Dict:
+    """Time every phrase and count the requests and memory the search took"""
+    latencies, calls, traced, rss, results = [], [], [], [], 0
+
+    def served() -> int:
+        with urlopen(f"{url}/_stats") as response:
+            return json.load(response)["requests"]
+
+    tracemalloc.start()
+    for phrase in phrases:
+        before = served()
+        tracemalloc.reset_peak()
+        peak_rss_mb(reset=True)
+        start = time.perf_counter()
+        results += search(phrase)
+        latencies.append(time.perf_counter() - start)
+        traced.append(tracemalloc.get_traced_memory()[1] / 2**10)
+        rss.append(peak_rss_mb())
+        calls.append(served() - before)
+    peak = max(traced) * 2**10
+    tracemalloc.stop()
+    return {
+        "name": name,
+        "queries": len(phrases),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "http_calls_per_query": sum(calls) / len(calls),
+        "results_per_query": results / len(phrases),
+        "peak_traced_mb": peak / 2**20,
+        "p95_query_traced_kb": percentile(traced, 95),
+        "peak_query_rss_mb": max(rss) if None not in rss else float("nan"),
+    }
+
+
+def _skill(api: PlexAPI) -> PlexSkill:
+    def no_connect(_):
+        pass
+
+    with patch.object(PlexSkill, "_connect_plex", no_connect):
+        skill = PlexSkill(bus=FakeBus(), skill_id="skill-plex.benchmark")
+    skill._plex_api = api
+    skill._plex_ready.set()
+    return skill
+
+
+def run(options: dict) -> List[Dict]:
+    """Serve a synthetic library and benchmark every search entry point against it"""
+    ready, stop = multiprocessing.Queue(), multiprocessing.Event()
+    server = multiprocessing.Process(target=_serve, args=(options, ready, stop), daemon=True)
+    server.start()
+    url = ready.get(timeout=options.get("startup_timeout", 600))
+    phrases = queries(options["queries"])
+    reports = []
+    with TemporaryDirectory() as tmp:
+        pool = SessionPool()
+        api = PlexAPI(
+            None,
+            servers=[pool.adopt(PlexServer(url, "token", session=pool.session("fake-server")))],
+            index_path=f"{tmp}/library_index.sqlite" if options["index"] else None,
+            lazy=options["lazy"],
+            search_timeout=options["search_timeout"],
+            session_pool=pool,
+        )
+        try:
+            if api.index is not None:
+                start = time.perf_counter()
+                LibrarySync(api).sync_all()
+                print(f"Indexed library in {time.perf_counter() - start:.2f}s")
+            reports.append(measure("PlexAPI.search_music", lambda q: len(api.search_music(q)), phrases, url))
+            reports.append(measure("PlexAPI.search_movies", lambda q: len(api.search_movies(q)), phrases, url))
+            reports.append(measure("PlexAPI.search_shows", lambda q: len(api.search_shows(q)), phrases, url))
+            skill = _skill(api)
+            reports.append(
+                measure(
+                    "PlexSkill.search_plex",
+                    lambda q: sum(
+                        len(playlist) for playlist in skill.search_plex(q, MediaType.GENERIC)
+                    ),
+                    phrases,
+                    url,
+                )
+            )
+            skill.shutdown()
+        finally:
+            api.close()
+            stop.set()
+            server.join()
+    for report in reports:
+        report["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--tracks", type=int, default=1000, help="music tracks to generate")
+    parser.add_argument("--movies", type=int, default=500)
+    parser.add_argument("--shows", type=int, default=50)
+    parser.add_argument("--seasons", type=int, default=10, help="seasons per show")
+    parser.add_argument("--episodes", type=int, default=12, help="episodes per season")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each request")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--search-timeout", type=float, default=30.0)
+    parser.add_argument("--lazy", action="store_true", help="benchmark lazy results")
+    parser.add_argument("--index", action="store_true", help="benchmark the local index")
+    parser.add_argument("--json", help="also write the report to this file")
+    options = vars(parser.parse_args())
+    reports = run(options)
+    columns = list(reports[0])
+    print(" | ".join(columns))
+    for report in reports:
+        print(" | ".join(f"{v:.2f}" if isinstance(v, float) else str(v) for v in report.values()))
+    if options["json"]:
+        with open(options["json"], "w", encoding="utf-8") as f:
+            json.dump({"options": options, "results": reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
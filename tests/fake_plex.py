@@ -0,0 +1,437 @@
+# pylint: disable=missing-docstring
+"""A minimal in-process Plex Media Server for tests and benchmarks that must not touch the network"""
+import json
+import random
+import re
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlparse
+from xml.sax.saxutils import quoteattr
+
+SEARCH_TYPES = {
+    "movie": "1",
+    "show": "2",
+    "season": "3",
+    "episode": "4",
+    "artist": "8",
+    "album": "9",
+    "track": "10",
+}
+TAGS = {"track": "Track", "movie": "Video", "episode": "Video"}
+WORDS = (
+    "blue", "harbor", "midnight", "river", "static", "golden", "echo", "paper",
+    "silver", "garden", "northern", "velvet", "thunder", "glass", "summer", "ghost",
+)
+GENRES = ("Jazz", "Rock", "Blues", "Soul")
+
+
+def _container(children: str = "", **attrs) -> bytes:
+    attr_str = " ".join(f"{k}={quoteattr(str(v))}" for k, v in attrs.items())
+    return f"<MediaContainer {attr_str}>{children}</MediaContainer>".encode()
+
+
+def _element(item: dict, details: bool = True) -> str:
+    tag = TAGS.get(item["type"], "Directory")
+    # Keys starting with an underscore are only known to the fake, e.g. track genres
+    attrs = " ".join(
+        f"{k}={quoteattr(str(v))}"
+        for k, v in item.items()
+        if k != "directors" and not k.startswith("_")
+    )
+    children = "".join(
+        f"<Director tag={quoteattr(d)}/>" for d in item.get("directors", []) if details
+    )
+    if "_media" in item:
+        media = item["_media"]
+        media_attrs = " ".join(f"{k}={quoteattr(str(v))}" for k, v in media.items())
+        part = f"/library/parts/{item['ratingKey']}/file.{media['container']}"
+        children += f'<Media {media_attrs}><Part key="{part}" /></Media>'
+
+    return f"<{tag} {attrs}>{children}</{tag}>"
+
+
+def synthetic_title(i: int) -> str:
+    """Deterministic title made of two words, so generated libraries are searchable"""
+    first, second = WORDS[i % len(WORDS)], WORDS[(i // len(WORDS)) % len(WORDS)]
+    return f"{first.title()} {second.title()} {i}"
+
+
+class FakePlex:
+    """Serves library sections, metadata and hub searches from memory over HTTP"""
+
+    def __init__(self, machine_id: str = "fake-server", name: str = "Fake Plex", latency: float = 0.0):
+        """
+        :param machine_id: machineIdentifier reported by the server
+        :param name: friendlyName reported by the server
+        :param latency: seconds to sleep before answering each request
+        """
+        self.machine_id = machine_id
+        self.name = name
+        self.latency = latency
+        self.sections: Dict[str, dict] = {}
+        self.items: Dict[str, List[dict]] = {}
+        self.metadata: Dict[str, dict] = {}
+        self.requests: List[str] = []
+        # Show rating key -> rating key of its episode on deck
+        self.on_deck: Dict[str, str] = {}
+        self.stations = True
+        self.play_queues: Dict[str, List[dict]] = {}
+        # Formats the pretend client plays as they are, and codecs it decodes
+        self.direct_play_containers = {"flac", "mp3", "mp4"}
+        self.direct_stream_codecs = {"flac", "mp3", "aac", "h264"}
+        self._children: Optional[Dict[str, List[dict]]] = None
+        self._leaves: Optional[Dict[str, List[dict]]] = None
+        self._next_key = 1
+        self._lock = Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def start(self) -> "FakePlex":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def add_section(self, key: str, section_type: str, title: str):
+        self.sections[key] = {"key": key, "type": section_type, "title": title}
+        self.items.setdefault(key, [])
+
+    def add_item(self, section_key: str, **attrs) -> dict:
+        attrs.setdefault("librarySectionID", section_key)
+        attrs.setdefault("key", f"/library/metadata/{attrs['ratingKey']}")
+        self.items[section_key].append(attrs)
+        self.metadata[str(attrs["ratingKey"])] = attrs
+        self._children = self._leaves = None
+        return attrs
+
+    def remove_item(self, section_key: str, rating_key: str):
+        self.items[section_key] = [
+            i for i in self.items[section_key] if str(i["ratingKey"]) != str(rating_key)
+        ]
+        self.metadata.pop(str(rating_key), None)
+        self._children = self._leaves = None
+
+    def _add(self, section_key: str, **attrs) -> dict:
+        attrs["ratingKey"], self._next_key = self._next_key, self._next_key + 1
+        # Libraries generated alike on several fakes share GUIDs, like replicated media
+        attrs.setdefault("guid", f"plex://{attrs['type']}/{attrs['ratingKey']}")
+        return self.add_item(section_key, **attrs)
+
+    def add_music_library(self, section_key: str, artists: int, albums: int = 2, tracks: int = 10):
+        """Generate a music section of artists x albums x tracks, genres taken in turn from GENRES"""
+        self.add_section(section_key, "artist", "Music")
+        for a in range(artists):
+            artist = self._add(section_key, type="artist", title=synthetic_title(a))
+            for b in range(albums):
+                album = self._add(
+                    section_key, type="album", title=f"{artist['title']} Vol {b + 1}",
+                    parentTitle=artist["title"], parentRatingKey=artist["ratingKey"],
+                    index=b + 1,
+                )
+                for t in range(tracks):
+                    self._add(
+                        section_key, type="track",
+                        title=synthetic_title((a * albums + b) * tracks + t),
+                        parentTitle=album["title"], grandparentTitle=artist["title"],
+                        parentRatingKey=album["ratingKey"],
+                        grandparentRatingKey=artist["ratingKey"], index=t + 1,
+                        parentIndex=b + 1, duration=200000, updatedAt=1000,
+                        parentThumb=f"/library/metadata/{album['ratingKey']}/thumb/1",
+                        _genre=GENRES[a % len(GENRES)],
+                        _media={"container": "flac", "audioCodec": "flac", "bitrate": 900},
+                    )
+
+    def add_tv_library(self, section_key: str, shows: int, seasons: int = 5, episodes: int = 10):
+        """Generate a TV section of shows x seasons x episodes"""
+        self.add_section(section_key, "show", "TV Shows")
+        for s in range(shows):
+            show = self._add(section_key, type="show", title=f"Show {synthetic_title(s)}")
+            for n in range(seasons):
+                season = self._add(
+                    section_key, type="season", title=f"Season {n + 1}",
+                    parentTitle=show["title"], parentRatingKey=show["ratingKey"], index=n + 1,
+                )
+                for e in range(episodes):
+                    self._add(
+                        section_key, type="episode", title=f"Episode {e + 1}",
+                        grandparentTitle=show["title"], parentRatingKey=season["ratingKey"],
+                        grandparentRatingKey=show["ratingKey"], index=e + 1,
+                        parentIndex=n + 1, duration=1800000, updatedAt=1000,
+                        directors=["Jane Doe"],
+                        _media={
+                            "container": "avi", "videoCodec": "mpeg4", "audioCodec": "mp3",
+                            "videoResolution": "sd", "bitrate": 2000,
+                        },
+                    )
+
+    def add_movie_library(self, section_key: str, movies: int):
+        """Generate a movie section"""
+        self.add_section(section_key, "movie", "Movies")
+        for m in range(movies):
+            self._add(
+                section_key, type="movie", title=f"Movie {synthetic_title(m)}",
+                duration=5400000, updatedAt=1000, directors=["John Doe"],
+                _media={
+                    "container": "mkv", "videoCodec": "h264", "audioCodec": "aac",
+                    "videoResolution": "1080", "bitrate": 8000,
+                },
+            )
+
+    def respond(self, path: str, params: Dict[str, str]) -> bytes:
+        if path == "/":
+            return _container(
+                machineIdentifier=self.machine_id, friendlyName=self.name, version="1.40"
+            )
+        if path in ("/library", "/library/"):
+            return _container(identifier="com.plexapp.plugins.library")
+        if path.rstrip("/") == "/library/sections":
+            return _container(
+                "".join(
+                    f'<Directory key="{s["key"]}" type="{s["type"]}" '
+                    f"title={quoteattr(s['title'])} />"
+                    for s in self.sections.values()
+                ),
+                size=len(self.sections),
+            )
+        if path == "/hubs/search":
+            return self._hub_search(params)
+        if path.endswith("/:/transcode/universal/decision"):
+            return self._decision(params)
+        if path == "/library/onDeck":
+            return self._page([self.metadata[k] for k in self.on_deck.values()], params)
+        parts = path.strip("/").split("/")
+        if parts[0] == "playQueues":
+            return self._play_queue(parts[1] if len(parts) > 1 else None, params)
+        if len(parts) == 4 and parts[:2] == ["library", "sections"] and parts[3] == "all":
+            return self._section_all(parts[2], params)
+        if len(parts) == 4 and parts[:2] == ["library", "sections"] and parts[3] == "genre":
+            genres = sorted({i["_genre"] for i in self.items.get(parts[2], []) if "_genre" in i})
+            return _container(
+                "".join(
+                    f'<Directory key="{GENRES.index(g) + 1}" title={quoteattr(g)} '
+                    f'fastKey="/library/sections/{parts[2]}/all?genre={GENRES.index(g) + 1}" />'
+                    for g in genres
+                ),
+                size=len(genres),
+            )
+        if len(parts) == 3 and parts[:2] == ["library", "metadata"]:
+            keys = parts[2].split(",")
+            if "includeStations" in params or "includeOnDeck" in params:
+                return self._metadata_extras(keys[0], params)
+            return self._page([self.metadata[k] for k in keys if k in self.metadata], params)
+        if len(parts) == 4 and parts[:2] == ["library", "metadata"] and parts[3] == "allLeaves":
+            return self._page(self._lookup("_leaves").get(parts[2], []), params)
+        if len(parts) == 4 and parts[:2] == ["library", "metadata"] and parts[3] == "children":
+            return self._page(self._lookup("_children").get(parts[2], []), params)
+        return _container(size=0)
+
+    def _plays(self, params: Dict[str, str], kind: str, container: str, codecs) -> bool:
+        """Whether the client profile, Chrome's without a profile extra, direct plays"""
+        extra = params.get("X-Plex-Client-Profile-Extra")
+        if not extra:
+            return container in self.direct_play_containers
+        profile_type = "musicProfile" if kind == "track" else "videoProfile"
+        for directive in re.findall(r"add-direct-play-profile\(([^)]*)\)", extra):
+            profile = {k: set(v.split(",")) for k, v in parse_qsl(directive)}
+            if profile_type not in profile.get("type", ()):
+                continue
+            decoded = profile.get("videoCodec", set()) | profile.get("audioCodec", set())
+            if container in profile.get("container", ()) and set(codecs) <= decoded:
+                return True
+        return False
+
+    def _decision(self, params: Dict[str, str]) -> bytes:
+        """Decide like Plex how the item at path is streamed to the pretend client"""
+        item = self.metadata[params["path"].rsplit("/", 1)[-1]]
+        media = dict(item.get("_media", {}))
+        limit = int(params.get("maxVideoBitrate") or params.get("musicBitrate") or 0)
+        fits = not limit or int(media.get("bitrate", 0)) <= limit
+        codecs = [media[k] for k in ("videoCodec", "audioCodec") if k in media]
+        if (
+            params.get("directPlay") == "1"
+            and fits
+            and self._plays(params, item["type"], media.get("container"), codecs)
+        ):
+            part, streams = "directplay", ["copy"] * len(codecs)
+        else:
+            part = "transcode"
+            streams = [
+                "copy" if fits and c in self.direct_stream_codecs else "transcode" for c in codecs
+            ]
+            if "transcode" in streams and limit:
+                media["bitrate"] = limit
+        media_attrs = " ".join(f"{k}={quoteattr(str(v))}" for k, v in media.items())
+        stream_xml = "".join(f'<Stream decision="{d}" />' for d in streams)
+        tag = TAGS.get(item["type"], "Directory")
+        return _container(
+            f'<{tag} ratingKey="{item["ratingKey"]}"><Media {media_attrs}>'
+            f'<Part decision="{part}">{stream_xml}</Part></Media></{tag}>',
+            size=1,
+        )
+
+    def _metadata_extras(self, rating_key: str, params: Dict[str, str]) -> bytes:
+        item = self.metadata[rating_key]
+        extras = ""
+        if "includeStations" in params and self.stations and item["type"] == "artist":
+            extras += (
+                f'<Stations><Playlist key="/library/metadata/{rating_key}/station/1?type=10" '
+                f'title="{item["title"]} Radio" /></Stations>'
+            )
+        if "includeOnDeck" in params and rating_key in self.on_deck:
+            extras += f"<OnDeck>{_element(self.metadata[self.on_deck[rating_key]])}</OnDeck>"
+        tag = TAGS.get(item["type"], "Directory")
+        return _container(_element(item).replace(f"</{tag}>", f"{extras}</{tag}>"), size=1)
+
+    def _queue_source(self, path: str) -> List[dict]:
+        """Items a play queue is created from, as addressed by its library path"""
+        parsed = urlparse(path)
+        parts = parsed.path.strip("/").split("/")
+        params = dict(parse_qsl(parsed.query))
+        if parts[:2] == ["library", "sections"]:
+            items = self.items.get(parts[2], [])
+            wanted = params.get("type")
+            items = [i for i in items if not wanted or SEARCH_TYPES[i["type"]] == wanted]
+            if "genre" in params:
+                genre = GENRES[int(params["genre"]) - 1]
+                items = [i for i in items if i.get("_genre") == genre]
+            return items
+        item = self.metadata[parts[2]]
+        if item["type"] in TAGS:
+            return [item]
+        leaves = self._lookup("_leaves").get(parts[2], [])
+        if "station" in parts:
+            leaves = list(leaves)
+            random.Random(int(parts[2])).shuffle(leaves)
+        return leaves
+
+    def _play_queue(self, queue_id: Optional[str], params: Dict[str, str]) -> bytes:
+        """Create a play queue from a uri, or page through an existing one"""
+        if queue_id is None:
+            path = params["uri"].split("com.plexapp.plugins.library", 1)[1]
+            items = list(self._queue_source(path))
+            if params.get("shuffle") == "1":
+                random.Random(len(items)).shuffle(items)
+            with self._lock:
+                queue_id = str(len(self.play_queues) + 1)
+                base = int(queue_id) * 10000
+                queue = [dict(i, playQueueItemID=base + n) for n, i in enumerate(items)]
+                self.play_queues[queue_id] = queue
+            start_key = params.get("key", "").rsplit("/", 1)[-1]
+            selected = next(
+                (n for n, i in enumerate(queue) if str(i["ratingKey"]) == start_key), 0
+            )
+        else:
+            queue = self.play_queues[queue_id]
+            center = params.get("center")
+            selected = next(
+                (n for n, i in enumerate(queue) if str(i["playQueueItemID"]) == center), 0
+            )
+        window = int(params.get("window", 50))
+        before = 0 if params.get("includeBefore") == "0" else window // 2
+        page = queue[max(selected - before, 0):selected + window]
+        return _container(
+            "".join(_element(i) for i in page),
+            size=len(page),
+            playQueueID=queue_id,
+            playQueueSelectedItemID=queue[selected]["playQueueItemID"] if queue else "",
+            playQueueSelectedItemOffset=selected,
+            playQueueTotalCount=len(queue),
+        )
+
+    def _lookup(self, name: str) -> Dict[str, List[dict]]:
+        """Parent to children and ancestor to leaves maps, rebuilt after the library changes"""
+        with self._lock:
+            if self._children is None or self._leaves is None:
+                children, leaves = defaultdict(list), defaultdict(list)
+                for item in self.metadata.values():
+                    children[str(item.get("parentRatingKey"))].append(item)
+                    if item["type"] in TAGS:
+                        leaves[str(item.get("parentRatingKey"))].append(item)
+                        leaves[str(item.get("grandparentRatingKey"))].append(item)
+                self._children, self._leaves = children, leaves
+            return getattr(self, name)
+
+    def _page(self, items: List[dict], params: Dict[str, str]) -> bytes:
+        start = int(params.get("X-Plex-Container-Start", 0))
+        size = int(params.get("X-Plex-Container-Size", len(items)))
+        page = items[start:start + size]
+        return _container(
+            "".join(_element(i) for i in page), size=len(page), totalSize=len(items)
+        )
+
+    def _section_all(self, section_key: str, params: Dict[str, str]) -> bytes:
+        items = self.items.get(section_key, [])
+        wanted = params.get("type")
+        items = [i for i in items if not wanted or SEARCH_TYPES[i["type"]] == wanted]
+        if "album.id" in params:
+            albums = params["album.id"].split(",")
+            items = [i for i in items if str(i.get("parentRatingKey")) in albums]
+        if "updatedAt>>" in params:
+            since = int(params["updatedAt>>"])
+            items = [i for i in items if int(i.get("updatedAt", 0)) > since]
+        return self._page(items, params)
+
+    def _hub_search(self, params: Dict[str, str]) -> bytes:
+        query = params.get("query", "").lower()
+        limit = int(params.get("limit", 10))
+        sections = [params["sectionId"]] if "sectionId" in params else list(self.items)
+        hubs: Dict[str, List[dict]] = defaultdict(list)
+        for section_key in sections:
+            for item in self.items.get(section_key, []):
+                hub = hubs[item["type"]]
+                if len(hub) < limit and query in item["title"].lower():
+                    hub.append(item)
+        return _container(
+            "".join(
+                f'<Hub type="{hub_type}" hubIdentifier="{hub_type}" size="{len(items)}">'
+                # Like Plex, hub results leave out tags such as directors
+                + "".join(_element(i, details=False) for i in items)
+                + "</Hub>"
+                for hub_type, items in hubs.items()
+                if items
+            ),
+            size=len(hubs),
+        )
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                parsed = urlparse(self.path)
+                if parsed.path == "/_stats":
+                    body = json.dumps({"requests": len(fake.requests)}).encode()
+                else:
+                    if fake.latency:
+                        time.sleep(fake.latency)
+                    fake.requests.append(self.path)
+                    params = dict(parse_qsl(parsed.query))
+                    params.update(
+                        {k: v for k, v in self.headers.items() if k.startswith("X-Plex-Container")}
+                    )
+                    body = fake.respond(parsed.path, params)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_GET  # pylint: disable=invalid-name
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,74 @@
+# pylint: disable=missing-docstring
+import unittest
+
+from benchmark_search import percentile, queries, run
+from fake_plex import FakePlex
+from plexapi.server import PlexServer
+
+
+class TestFakeLibrary(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_generated_music_library(self):
+        self.fake.add_music_library("1", artists=3, albums=2, tracks=4)
+        server = PlexServer(self.fake.url, "token")
+        tracks = server.query("/library/sections/1/all?type=10")
+        self.assertEqual(int(tracks.attrib["totalSize"]), 24)
+        artist = server.fetchItem(1)
+        self.assertEqual(len(artist.tracks()), 8)
+        self.assertEqual(len(server.query("/library/metadata/1/children")), 2)
+
+    def test_hub_search(self):
+        self.fake.add_movie_library("2", movies=40)
+        server = PlexServer(self.fake.url, "token")
+        results = server.search("blue", mediatype="movie", limit=5)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all("Blue" in r.title for r in results))
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_percentile(self):
+        samples = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(samples, 50), 50.0)
+        self.assertEqual(percentile(samples, 99), 99.0)
+        self.assertEqual(percentile([3.0], 95), 3.0)
+
+    def test_queries_are_deterministic(self):
+        self.assertEqual(queries(10), queries(10))
+        self.assertTrue(queries(5)[0].startswith("nothing like"))
+
+    def test_small_run(self):
+        reports = run(
+            {
+                "tracks": 48,
+                "movies": 5,
+                "shows": 1,
+                "seasons": 1,
+                "episodes": 2,
+                "latency": 0.0,
+                "queries": 3,
+                "search_timeout": 10.0,
+                "lazy": True,
+                "index": False,
+            }
+        )
+        self.assertEqual(
+            [r["name"] for r in reports],
+            [
+                "PlexAPI.search_music",
+                "PlexAPI.search_movies",
+                "PlexAPI.search_shows",
+                "PlexSkill.search_plex",
+            ],
+        )
+        for report in reports:
+            self.assertGreater(report["http_calls_per_query"], 0)
+            self.assertLessEqual(report["p50_ms"], report["p99_ms"])
+
+
+if __name__ == "__main__":
+    unittest.main()
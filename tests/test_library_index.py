@@ -0,0 +1,84 @@
+# pylint: disable=missing-docstring
+import unittest
+from xml.etree.ElementTree import fromstring
+
+from skill_plex.library_index import LibraryIndex, ResultItem, item_from_element
+
+TRACK = (
+    '<Track ratingKey="11" type="track" title="All at Sea" parentTitle="Twentysomething" '
+    'grandparentTitle="Jamie Cullum" index="3" parentIndex="1" duration="254000" '
+    'parentThumb="/library/metadata/10/thumb" addedAt="100" updatedAt="200"/>'
+)
+EPISODE = (
+    '<Video ratingKey="21" type="episode" title="Encounter at Farpoint" '
+    'grandparentTitle="Star Trek: The Next Generation" index="1" parentIndex="1" '
+    'updatedAt="300"><Director tag="Corey Allen"/></Video>'
+)
+MOVIE = '<Video ratingKey="31" type="movie" title="Ghostbusters" updatedAt="400"/>'
+
+
+class TestLibraryIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = LibraryIndex()
+        self.index.replace_section(
+            "server", "1", [item_from_element(fromstring(TRACK))]
+        )
+        self.index.replace_section(
+            "server",
+            "2",
+            [item_from_element(fromstring(EPISODE)), item_from_element(fromstring(MOVIE))],
+        )
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_item_from_element(self):
+        track = item_from_element(fromstring(TRACK))
+        self.assertEqual(track["artist"], "Jamie Cullum")
+        self.assertEqual(track["thumb"], "/library/metadata/10/thumb")
+        self.assertEqual(track["duration"], 254000)
+        episode = item_from_element(fromstring(EPISODE))
+        self.assertEqual(episode["artist"], "Corey Allen")
+        self.assertEqual(episode["parent_index"], 1)
+
+    def test_result_item(self):
+        track = ResultItem.from_element(fromstring(TRACK))
+        self.assertFalse(hasattr(track, "__dict__"))
+        for name, value in item_from_element(fromstring(TRACK)).items():
+            if name in ResultItem.__slots__:
+                self.assertEqual(getattr(track, name), value)
+        self.assertFalse(track.has_directors)
+        self.assertTrue(ResultItem.from_element(fromstring(EPISODE)).has_directors)
+        row = ResultItem.from_row(self.index.search("ghostbusters")[0])
+        self.assertEqual((row.kind, row.rating_key, row.parent_rating_key), ("movie", "31", None))
+
+    def test_search_by_artist_and_title(self):
+        self.assertTrue(self.index.populated)
+        self.assertEqual(
+            [r["rating_key"] for r in self.index.search("jamie cullum", ("track",))], ["11"]
+        )
+        self.assertEqual(
+            [r["rating_key"] for r in self.index.search("star trek next", ("episode",))],
+            ["21"],
+        )
+        self.assertEqual(self.index.search("ghostbusters", ("track",)), [])
+        self.assertEqual(self.index.search("ghost", server_ids=["other"]), [])
+
+    def test_titles(self):
+        self.assertEqual(
+            sorted(self.index.titles()),
+            [
+                ("album", "Twentysomething"),
+                ("artist", "Jamie Cullum"),
+                ("episode", "Encounter at Farpoint"),
+                ("movie", "Ghostbusters"),
+                ("show", "Star Trek: The Next Generation"),
+                ("track", "All at Sea"),
+            ],
+        )
+
+    def test_replace_and_remove_sections(self):
+        self.index.replace_section("server", "1", [])
+        self.assertEqual(self.index.search("jamie"), [])
+        self.index.remove_sections("server", keep=[])
+        self.assertEqual(self.index.count(), 0)
@@ -0,0 +1,113 @@
+# pylint: disable=missing-docstring
+import unittest
+from unittest.mock import Mock
+
+from fake_plex import FakePlex
+from plexapi.server import PlexServer
+
+from skill_plex.library_sync import LibrarySync
+from skill_plex.plex_api import PlexAPI
+from skill_plex.title_matcher import TitleMatcher
+
+
+class TestLibrarySync(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+        self.fake.add_section("1", "artist", "Music")
+        for i in range(3):
+            self.fake.add_item(
+                "1",
+                ratingKey=100 + i,
+                type="track",
+                title=f"Track {i}",
+                grandparentTitle="Jamie Cullum",
+                updatedAt=1000 + i,
+            )
+        self.api = PlexAPI(
+            None, index_path=":memory:", servers=[PlexServer(self.fake.url, "token")]
+        )
+        self.sync = LibrarySync(self.api)
+
+    def tearDown(self):
+        self.sync.stop()
+        self.fake.stop()
+
+    def test_initial_crawl_then_delta(self):
+        self.sync.sync_all()
+        self.assertEqual(self.api.index.count(), 3)
+        self.assertEqual(self.api.index.get_watermark("fake-server", "1"), 1002)
+
+        self.fake.add_item(
+            "1", ratingKey=200, type="track", title="Mind Trick", updatedAt=2000
+        )
+        self.fake.requests.clear()
+        # Only the new track and the one sharing the watermark second are fetched
+        self.assertEqual(self.sync.sync_section(self.api.music[0]), 2)
+        self.assertTrue(any("updatedAt%3E%3E=1001" in r for r in self.fake.requests))
+        self.assertEqual(self.api.index.count(), 4)
+        self.assertEqual(self.api.index.get_watermark("fake-server", "1"), 2000)
+
+    def test_fuzzy_fallback(self):
+        self.sync.sync_all()
+        self.assertEqual(self.api.search_music("jamie colum"), [])
+        self.api.matcher = TitleMatcher(self.api.index.titles())
+        self.assertEqual(len(self.api.search_music("jamie colum")), 3)
+        self.assertGreater(self.api.match_score("jamie colum", ["music"]), 0.8)
+        self.assertEqual(self.api.match_score("ghostbusters", ["music"]), 0.0)
+
+    def test_deletions_trigger_reindex(self):
+        self.sync.sync_all()
+        self.fake.remove_item("1", 100)
+        self.sync.sync_section(self.api.music[0])
+        self.assertEqual(self.api.index.count(), 2)
+
+    def test_alerts(self):
+        self.sync.sync_all()
+        self.sync.handle_alert(
+            "fake-server",
+            {
+                "type": "timeline",
+                "TimelineEntry": [
+                    {
+                        "identifier": "com.plexapp.plugins.library",
+                        "sectionID": "1",
+                        "itemID": "101",
+                        "state": 9,
+                    },
+                    {
+                        "identifier": "com.plexapp.plugins.library",
+                        "sectionID": "1",
+                        "itemID": "102",
+                        "state": 5,
+                    },
+                ],
+            },
+        )
+        self.assertEqual(self.api.index.count(), 2)
+        self.assertEqual(self.sync._pending, {("fake-server", "1")})
+
+    def test_dead_server_does_not_stop_sync(self):
+        dead = FakePlex("dead", "Dead").start()
+        dead.add_section("1", "artist", "Music")
+        self.api.close()
+        self.api = PlexAPI(
+            None,
+            index_path=":memory:",
+            servers=[PlexServer(dead.url, "token"), PlexServer(self.fake.url, "token")],
+        )
+        self.sync = LibrarySync(self.api)
+        dead.stop()
+        self.api.servers[0].query = Mock(side_effect=ConnectionError)
+
+        self.sync.sync_all()
+        self.assertEqual(self.api.index.count(), 3)
+        self.sync.sync_all()
+        self.assertTrue(self.api.health.is_open("dead"))
+        # A server that keeps failing is skipped instead of costing a timeout per sync
+        calls = self.api.servers[0].query.call_count
+        self.fake.add_item("1", ratingKey=200, type="track", title="Mind Trick", updatedAt=2000)
+        self.sync.request_sync("dead", "1")
+        self.sync.request_sync("fake-server", "1")
+        self.sync.sync_pending()
+        self.assertEqual(self.api.index.count(), 4)
+        self.assertEqual(self.api.servers[0].query.call_count, calls)
@@ -0,0 +1,95 @@
+# pylint: disable=missing-docstring
+import unittest
+from os.path import dirname, join
+
+from skill_plex.phrase_parser import PhraseParser
+
+LOCALE = join(dirname(dirname(__file__)), "locale")
+
+# Utterances as OCP passes them to the skill, the phrase to search and the hints found
+CORPUS = [
+    ("jimi hendrix", "jimi hendrix", set()),
+    ("music by michael jackson", "music by michael jackson", set()),
+    ("the who on plex", "the who", {"plex"}),
+    ("charles mingus on Plex", "charles mingus", {"plex"}),
+    ("the movie ghostbusters", "the ghostbusters", {"movie"}),
+    ("the ghostbusters movie on plex", "the ghostbusters", {"movie", "plex"}),
+    ("the scooby doo series", "the scooby doo", {"tv"}),
+    ("the ghostbusters tv show on plex", "the ghostbusters", {"tv", "plex"}),
+    ("berlin station tv series", "berlin station", {"tv"}),
+    ("lost in translation film", "lost in translation", {"movie"}),
+    ("gone in 60 seconds using plex", "gone in 60 seconds", {"plex"}),
+    ("jamie cullum in plex", "jamie cullum", {"plex"}),
+    ("once upon a time in hollywood", "once upon a time in hollywood", set()),
+    ("on the road again on plexx", "on the road again", {"plex"}),
+    ("the office", "the office", set()),
+    ("perplexed by plex", "perplexed by", {"plex"}),
+    ("fantasia cartoon", "fantasia", {"tv"}),
+    ("tvs on the radio", "tvs on the radio", set()),
+    ("flickering lights flick", "flickering lights", {"movie"}),
+    ("  star   trek  series ", "star trek", {"tv"}),
+    ("", "", set()),
+]
+
+
+# Radio, shuffle and continue watching requests, and titles that merely contain their words
+SMART_CORPUS = [
+    ("jamie cullum radio", "jamie cullum", {"radio"}),
+    ("jamie cullum radio station", "jamie cullum", {"radio"}),
+    ("shuffle my library", "", {"shuffle", "library"}),
+    ("my music", "", {"library"}),
+    ("shuffle songs by jamie cullum", "jamie cullum", {"shuffle"}),
+    ("continue watching star trek", "star trek", {"continue"}),
+    ("continue watching", "", {"continue"}),
+    ("radio ga ga", "radio ga ga", set()),
+    ("video killed the radio star", "video killed the radio star", set()),
+    ("station to station", "station to station", set()),
+    ("berlin station", "berlin station", set()),
+    ("random access memories", "random access memories", set()),
+    ("the mix", "the mix", set()),
+    ("harlem shuffle", "harlem shuffle", set()),
+    ("everything now", "everything now", set()),
+]
+SMART_ANCHORS = {"radio": "end", "shuffle": "start", "continue": "start", "library": "end"}
+
+
+def load_vocabularies(lang: str = "en-us", names=("plex", "movie", "tv")) -> dict:
+    vocabularies = {}
+    for name in names:
+        with open(join(LOCALE, lang, f"{name}.voc"), encoding="utf-8") as f:
+            vocabularies[name] = [line for line in f.read().splitlines() if line.strip()]
+    return vocabularies
+
+
+class TestPhraseParser(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.parser = PhraseParser(load_vocabularies())
+
+    def test_corpus(self):
+        for utterance, phrase, hints in CORPUS:
+            with self.subTest(utterance=utterance):
+                parsed = self.parser.parse(utterance)
+                self.assertEqual(parsed.phrase, phrase)
+                self.assertEqual(parsed.hints, hints)
+
+    def test_anchored_vocabularies(self):
+        parser = PhraseParser(
+            load_vocabularies(names=("radio", "shuffle", "continue", "library")), SMART_ANCHORS
+        )
+        for utterance, phrase, hints in SMART_CORPUS:
+            with self.subTest(utterance=utterance):
+                parsed = parser.parse(utterance)
+                self.assertEqual(parsed.phrase, phrase)
+                self.assertEqual(parsed.hints, hints)
+
+    def test_longest_term_wins(self):
+        parser = PhraseParser({"tv": ["tv", "tv show"], "movie": ["show"]})
+        self.assertEqual(parser.parse("the tv show").hints, {"tv"})
+
+    def test_empty_vocabularies(self):
+        self.assertEqual(PhraseParser({}).parse(" the  who ").phrase, "the who")
+
+
+if __name__ == "__main__":
+    unittest.main()
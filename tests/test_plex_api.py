@@ -0,0 +1,379 @@
+# pylint: disable=missing-docstring,protected-access
+import time
+import unittest
+from os.path import exists, join
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch
+
+from fake_plex import FakePlex
+from ovos_workshop.backwards_compat import MediaEntry, PlaybackType
+from plexapi.server import PlexServer
+
+from skill_plex.plex_api import PlexAPI, guid_key, lazy_uri, parse_lazy_uri
+from skill_plex.library_index import LibraryIndex
+from skill_plex.search_cache import SearchCache
+from skill_plex.server_cache import ServerCache
+from skill_plex.server_health import ServerHealth
+
+
+def _section(server_name: str, title: str) -> Mock:
+    section = Mock()
+    section.title = title
+    section._server.friendlyName = server_name
+    return section
+
+
+class TestSearchFanOut(unittest.TestCase):
+    def setUp(self):
+        self.api = PlexAPI(None, servers=[], search_timeout=0.5)
+
+    def tearDown(self):
+        self.api.close()
+
+    def test_sections_searched_in_parallel_with_deadline(self):
+        fast, slow = _section("nas", "Music"), _section("remote", "Music")
+        self.api.music = [fast, slow]
+        self.api.movies = [_section("nas", "Movies")]
+
+        def search_section(section, _):
+            if section is slow:
+                time.sleep(2)
+            return [section.title]
+
+        self.api._search_music_section = search_section
+        self.api._search_movie_section = search_section
+
+        start = time.monotonic()
+        results = self.api.search("ghostbusters", music=True, movies=True)
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(results["music"], ["Music"])
+        self.assertEqual(results["movies"], ["Movies"])
+        self.assertEqual(results["shows"], [])
+        self.assertEqual(set(self.api.last_timings), {"nas", "remote"})
+        self.assertEqual(self.api.last_timings["remote"], 0.5)
+
+    def test_results_stream_in_answer_order(self):
+        fast, slow = _section("nas", "Music"), _section("remote", "Music")
+        self.api.music = [slow, fast]
+
+        def search_section(section, _):
+            if section is slow:
+                time.sleep(0.2)
+            return [section._server.friendlyName]
+
+        self.api._search_music_section = search_section
+        start = time.monotonic()
+        batches = self.api.iter_search("ghostbusters", music=True)
+        self.assertEqual(next(batches), ("music", ["nas"]))
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(list(batches), [("music", ["remote"])])
+
+    def test_repeated_search_uses_cache(self):
+        self.api.search_cache = SearchCache()
+        self.api.movies = [_section("nas", "Movies")]
+        self.api._search_movie_section = Mock(return_value=[MediaEntry(title="Ghostbusters")])
+        self.api.search_movies("Ghostbusters")
+        self.assertEqual(self.api.search_movies("ghostbusters")[0].title, "Ghostbusters")
+        self.api._search_movie_section.assert_called_once()
+
+    def test_failed_section_is_skipped(self):
+        self.api.shows = [_section("nas", "TV")]
+        self.api._search_show_section = Mock(side_effect=ConnectionError)
+        self.assertEqual(self.api.search_shows("star trek"), [])
+
+
+class TestLazyResults(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+        self.fake.add_section("1", "artist", "Music")
+        for i in range(5):
+            self.fake.add_item(
+                "1",
+                ratingKey=100 + i,
+                type="track",
+                title=f"Track {i}",
+                grandparentTitle="Jamie Cullum",
+                parentRatingKey=20,
+                grandparentRatingKey=10,
+            )
+        self.api = PlexAPI(
+            None, servers=[PlexServer(self.fake.url, "token")], lazy=True, page_size=2
+        )
+
+    def tearDown(self):
+        self.api.close()
+        self.fake.stop()
+
+    def test_lazy_uri(self):
+        uri = lazy_uri("fake-server", "artist", "10", 4)
+        self.assertEqual(parse_lazy_uri(uri), ("fake-server", "artist", "10", 4))
+        self.assertIsNone(parse_lazy_uri("https://example.com/stream"))
+
+    def test_resolve_track(self):
+        self.fake.requests.clear()
+        entry = {"uri": lazy_uri("fake-server", "track", "100"), "title": "Track 0"}
+        resolved = self.api.resolve(entry)
+        self.assertEqual(len(resolved), 1)
+        self.assertEqual(resolved[0].playback, PlaybackType.AUDIO)
+        # Without media information the track falls back to the universal transcoder
+        self.assertIn("path=%2Flibrary%2Fmetadata%2F100", resolved[0].uri)
+        self.assertEqual(self.fake.requests, ["/library/metadata/100"])
+
+    def test_expand_artist_in_pages(self):
+        entry = {"uri": lazy_uri("fake-server", "artist", "10"), "title": "Jamie Cullum"}
+        page = self.api.resolve(entry)
+        self.assertEqual([e.title for e in page[:2]], ["Track 0", "Track 1"])
+        self.assertEqual(page[2].uri, lazy_uri("fake-server", "artist", "10", 2))
+        self.assertEqual(page[2].playback, PlaybackType.SKILL)
+        last = self.api.resolve(page[2].as_dict)
+        last = self.api.resolve(last[-1].as_dict)
+        self.assertEqual([e.title for e in last], ["Track 4"])
+
+
+class TestResultCaps(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+        self.fake.add_music_library("1", artists=20, albums=2, tracks=10)
+        self.api = PlexAPI(
+            None,
+            servers=[PlexServer(self.fake.url, "token")],
+            max_results={"music": 5},
+            max_hits=3,
+        )
+
+    def tearDown(self):
+        self.api.close()
+        self.fake.stop()
+
+    def test_expansion_stops_at_cap(self):
+        self.fake.requests.clear()
+        results = self.api.search_music("blue")
+        self.assertEqual(len(results), 5)
+        # The top hit is an artist whose first five tracks fill the cap
+        leaves = [r for r in self.fake.requests if "allLeaves" in r]
+        self.assertEqual(len(leaves), 1)
+        self.assertIn("X-Plex-Container-Size=5", leaves[0])
+
+    def test_lazy_placeholders_are_ranked_and_capped(self):
+        self.api.lazy = True
+        results = self.api.search_music("blue harbor")
+        self.assertEqual(len(results), 3)
+        self.assertTrue(results[0].title.startswith("Blue Harbor"))
+
+
+class TestBatchedExpansion(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+        self.fake.add_music_library("1", artists=3, albums=2, tracks=4)
+        self.fake.add_movie_library("2", movies=20)
+        self.api = PlexAPI(
+            None, servers=[PlexServer(self.fake.url, "token")], max_hits=3, latency_interval=0
+        )
+        self.fake.requests.clear()
+
+    def tearDown(self):
+        self.api.close()
+        self.fake.stop()
+
+    def test_movie_details_in_one_request(self):
+        results = self.api.search_movies("blue")
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(r.artist == "John Doe" for r in results))
+        metadata = [r for r in self.fake.requests if r.startswith("/library/metadata/")]
+        self.assertEqual(len(metadata), 1)
+        self.assertEqual(metadata[0].count(","), 2)
+
+    def test_albums_in_one_request(self):
+        results = self.api.search_music("vol")
+        self.assertEqual(len(results), 12)
+        self.assertEqual(len({r.uri for r in results}), 12)
+        self.assertFalse([r for r in self.fake.requests if "allLeaves" in r])
+        self.assertEqual(len([r for r in self.fake.requests if "album.id" in r]), 1)
+
+    def test_hits_inside_an_expanded_artist_are_skipped(self):
+        results = self.api.search_music("blue blue 0")
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len({r.uri for r in results}), 8)
+        self.assertEqual(len([r for r in self.fake.requests if "allLeaves" in r]), 1)
+        self.assertFalse([r for r in self.fake.requests if "album.id" in r])
+
+
+class TestReplicas(unittest.TestCase):
+    def setUp(self):
+        self.nas = FakePlex("nas", "NAS").start()
+        self.remote = FakePlex("remote", "Remote").start()
+        for fake in (self.nas, self.remote):
+            fake.add_movie_library("1", movies=40)
+        self.api = PlexAPI(
+            None,
+            servers=[PlexServer(self.nas.url, "token"), PlexServer(self.remote.url, "token")],
+            latency_interval=0,
+        )
+        self.api.latency.record("nas", 0.2)
+        self.api.latency.record("remote", 0.01)
+
+    def tearDown(self):
+        self.api.close()
+        self.nas.stop()
+        self.remote.stop()
+
+    def test_guid_key(self):
+        self.assertEqual(
+            guid_key("com.plexapp.agents.imdb://tt0111161?lang=en"), "imdb://tt0111161"
+        )
+        self.assertEqual(guid_key("plex://movie/5d7768"), "plex://movie/5d7768")
+        self.assertIsNone(guid_key("local://12"))
+        self.assertIsNone(guid_key(None))
+
+    def test_hub_search_keeps_nearest_replica(self):
+        results = self.api.search_movies("blue")
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len({r.title for r in results}), 10)
+        self.assertTrue(all(parse_lazy_uri(r.uri)[0] == "remote" for r in results))
+
+    def test_relay_is_avoided(self):
+        self.api.latency.set_relay("remote", True)
+        results = self.api.search_movies("blue")
+        self.assertTrue(all(parse_lazy_uri(r.uri)[0] == "nas" for r in results))
+
+    def test_index_search_keeps_nearest_replica(self):
+        self.api.index = LibraryIndex()
+        for section in self.api.movies:
+            self.api.index_section(section)
+        results = self.api.search_movies("blue")
+        self.assertEqual(len(results), 18)
+        self.assertEqual(len({r.title for r in results}), 18)
+        self.assertTrue(all(parse_lazy_uri(r.uri)[0] == "remote" for r in results))
+
+
+class TestFailover(unittest.TestCase):
+    def setUp(self):
+        self.nas = FakePlex("nas", "NAS").start()
+        self.remote = FakePlex("remote", "Remote").start()
+        self.nas.add_movie_library("1", movies=5)
+        self.remote.add_movie_library("1", movies=5)
+        self.api = PlexAPI(
+            None,
+            servers=[PlexServer(self.nas.url, "token"), PlexServer(self.remote.url, "token")],
+            health=ServerHealth(failure_threshold=1, reset_timeout=60, probe_interval=60),
+            search_timeout=0.5,
+            latency_interval=0,
+        )
+
+    def tearDown(self):
+        self.api.close()
+        self.nas.stop()
+        self.remote.stop()
+
+    def test_dead_server_is_skipped(self):
+        self.remote.latency = 2
+        self.api.search_movies("blue")
+        self.assertTrue(self.api.health.is_open("remote"))
+        self.remote.requests.clear()
+        start = time.monotonic()
+        results = self.api.search_movies("harbor")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertTrue(results)
+        self.assertEqual(self.remote.requests, [])
+
+    def test_probe_reconnects_through_another_connection(self):
+        moved = PlexServer(self.nas.url, "token")
+        resource = Mock(connections=[])
+        resource.connect.return_value = moved
+        self.api._resources["nas"] = resource
+        self.api.servers[0].query = Mock(side_effect=ConnectionError)
+        self.assertTrue(self.api.probe_server("nas"))
+        self.assertIs(self.api.servers_by_id["nas"], moved)
+        self.assertTrue(all(s._server is not None for s in self.api.movies))
+        self.assertIn(moved, [s._server for s in self.api.movies])
+
+    def test_reconnect_clears_search_cache(self):
+        self.api.search_cache = SearchCache()
+        self.api.search_movies("blue")
+        self.assertEqual(self.api.search_cache.stats["size"], 1)
+        resource = Mock(connections=[])
+        resource.connect.return_value = PlexServer(self.nas.url, "token")
+        self.api._resources["nas"] = resource
+        self.api.servers[0].query = Mock(side_effect=ConnectionError)
+        self.assertTrue(self.api.probe_server("nas"))
+        self.assertEqual(self.api.search_cache.stats["size"], 0)
+
+    def test_unreachable_server_stays_unhealthy(self):
+        self.api.servers[1].query = Mock(side_effect=ConnectionError)
+        self.assertFalse(self.api.probe_server("remote"))
+
+
+class TestServerCache(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+        self.fake.add_section("1", "artist", "Music")
+        self.fake.add_section("2", "movie", "Movies")
+        self.tmp = TemporaryDirectory()
+        self.cache_path = join(self.tmp.name, "servers.json")
+
+    def tearDown(self):
+        self.fake.stop()
+        self.tmp.cleanup()
+
+    def test_startup_from_cache(self):
+        api = PlexAPI(
+            None, servers=[PlexServer(self.fake.url, "token")], cache_path=self.cache_path
+        )
+        api.save_cache()
+        api.close()
+
+        self.fake.requests.clear()
+        with patch.object(PlexAPI, "refresh_servers") as refresh:
+            api = PlexAPI("token", cache_path=self.cache_path)
+        refresh.assert_called_once()
+        self.assertEqual(self.fake.requests, ["/"])
+        self.assertEqual([s.title for s in api.music], ["Music"])
+        self.assertEqual([s.title for s in api.movies], ["Movies"])
+        api.close()
+
+    def test_expired_cache_discovers(self):
+        api = PlexAPI(
+            None, servers=[PlexServer(self.fake.url, "token")], cache_path=self.cache_path
+        )
+        api.save_cache()
+        api.close()
+        with patch.object(PlexAPI, "refresh_servers") as refresh:
+            PlexAPI("token", cache_path=self.cache_path, cache_ttl=-1).close()
+        refresh.assert_called_once()
+        expired = ServerCache(self.cache_path, ttl=-1)
+        self.assertIsNone(expired.load())
+        self.assertEqual(len(expired.load(allow_stale=True)), 1)
+
+    def test_failed_rediscovery_keeps_cache(self):
+        api = PlexAPI(
+            None, servers=[PlexServer(self.fake.url, "token")], cache_path=self.cache_path
+        )
+        api.save_cache()
+        api.close()
+        with patch.object(PlexAPI, "refresh_servers"):
+            api = PlexAPI("token", cache_path=self.cache_path)
+
+        resource = Mock(provides="server", presence=True)
+        resource.name = "Fake Plex"
+        resource.connect.side_effect = ConnectionError("unreachable")
+        account = Mock()
+        account.resources.return_value = [resource]
+        with patch("skill_plex.plex_api.MyPlexAccount", return_value=account), patch.object(
+            api.cache, "save"
+        ) as save:
+            api.refresh_servers()
+        save.assert_not_called()
+        self.assertEqual([s.machineIdentifier for s in api.servers], ["fake-server"])
+        self.assertEqual([s.title for s in api.music], ["Music"])
+        api.close()
+
+    def test_first_boot_without_servers_raises(self):
+        resource = Mock(provides="server", presence=True)
+        resource.name = "Fake Plex"
+        resource.connect.side_effect = ConnectionError("unreachable")
+        account = Mock()
+        account.resources.return_value = [resource]
+        with patch("skill_plex.plex_api.MyPlexAccount", return_value=account):
+            with self.assertRaises(ConnectionError):
+                PlexAPI("token", cache_path=self.cache_path)
+        self.assertFalse(exists(self.cache_path))
@@ -0,0 +1,36 @@
+# pylint: disable=missing-docstring
+import unittest
+from types import SimpleNamespace
+
+from skill_plex.ranking import rank_hits, score_hit
+
+
+def _hit(title: str, parent: str = "", grandparent: str = "") -> SimpleNamespace:
+    return SimpleNamespace(title=title, parent_title=parent, grandparent_title=grandparent)
+
+
+class TestRanking(unittest.TestCase):
+    def test_exact_title_scores_highest(self):
+        self.assertEqual(score_hit("The Beatles", "the beatles"), 1.0)
+        self.assertGreater(
+            score_hit("the beatles", "Help!", ["Help!", "The Beatles"]),
+            score_hit("the beatles", "Beat It", ["Thriller", "Michael Jackson"]),
+        )
+        self.assertEqual(score_hit("", "Anything"), 0.0)
+
+    def test_rank_hits_keeps_best_in_plex_order(self):
+        hits = [
+            _hit("Yesterday", "Help!", "The Beatles"),
+            _hit("Beat It", "Thriller", "Michael Jackson"),
+            _hit("The Beatles"),
+            _hit("Let It Be", "Let It Be", "The Beatles"),
+        ]
+        ranked = rank_hits("the beatles", hits, 3)
+        self.assertEqual(ranked[0].title, "The Beatles")
+        self.assertNotIn("Beat It", [hit.title for hit in ranked])
+        tied = [_hit("Blue Moon"), _hit("Blue Moon")]
+        self.assertIs(rank_hits("blue moon", tied, 1)[0], tied[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# pylint: disable=missing-docstring
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from ovos_workshop.backwards_compat import MediaEntry
+
+from skill_plex.search_cache import SearchCache, normalize_phrase
+
+
+class TestSearchCache(unittest.TestCase):
+    def test_key_normalization(self):
+        self.assertEqual(normalize_phrase("  Jamie   Cullum!"), "jamie cullum")
+        self.assertEqual(
+            SearchCache.key("Jamie Cullum", "music", ["b", "a"]),
+            SearchCache.key("jamie cullum ", "music", ["a", "b"]),
+        )
+        self.assertNotEqual(
+            SearchCache.key("jamie cullum", "music", ["a"]),
+            SearchCache.key("jamie cullum", "shows", ["a"]),
+        )
+
+    def test_hits_misses_and_copies(self):
+        cache = SearchCache()
+        self.assertIsNone(cache.get("k"))
+        cache.put("k", [MediaEntry(uri="http://plex/1", title="All at Sea")])
+        hit = cache.get("k")
+        self.assertEqual(hit[0].title, "All at Sea")
+        hit[0].match_confidence = 100
+        self.assertEqual(cache.get("k")[0].match_confidence, 0)
+        self.assertEqual(cache.stats, {"hits": 2, "misses": 1, "size": 1})
+        cache.clear()
+        self.assertIsNone(cache.get("k"))
+
+    def test_lru_eviction_and_ttl(self):
+        cache = SearchCache(max_entries=2, ttl=10)
+        cache.put("a", [])
+        cache.put("b", [])
+        cache.get("a")
+        cache.put("c", [])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), [])
+        with patch("skill_plex.search_cache.time.time", return_value=1e12):
+            self.assertIsNone(cache.get("c"))
+
+    def test_persistence(self):
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, "search_cache.json")
+            cache = SearchCache(path=path)
+            cache.put("k", [MediaEntry(uri="http://plex/1", title="Ghostbusters")])
+            cache.save()
+            self.assertEqual(SearchCache(path=path).get("k")[0].title, "Ghostbusters")
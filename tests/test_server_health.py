@@ -0,0 +1,51 @@
+# pylint: disable=missing-docstring
+import time
+import unittest
+
+from skill_plex.server_health import ServerHealth
+
+
+class TestServerHealth(unittest.TestCase):
+    def test_circuit_opens_at_threshold(self):
+        health = ServerHealth(failure_threshold=2, reset_timeout=60)
+        health.failure("nas")
+        self.assertTrue(health.allow("nas"))
+        health.failure("nas")
+        self.assertTrue(health.is_open("nas"))
+        self.assertFalse(health.allow("nas"))
+        self.assertEqual(health.unhealthy, ["nas"])
+
+    def test_success_resets_failures(self):
+        health = ServerHealth(failure_threshold=2)
+        health.failure("nas")
+        health.success("nas")
+        health.failure("nas")
+        self.assertFalse(health.is_open("nas"))
+
+    def test_half_open_lets_one_search_through(self):
+        health = ServerHealth(failure_threshold=1, reset_timeout=0)
+        health.failure("nas")
+        self.assertTrue(health.allow("nas"))
+        health.reset_timeout = 60
+        self.assertFalse(health.allow("nas"))
+        health.success("nas")
+        self.assertTrue(health.allow("nas"))
+
+    def test_probe_closes_circuit(self):
+        health = ServerHealth(failure_threshold=1, probe_interval=0.01)
+        health.failure("nas")
+        health.failure("remote")
+        health.start(lambda server_id: server_id == "nas")
+        try:
+            for _ in range(100):
+                if not health.is_open("nas"):
+                    break
+                time.sleep(0.01)
+        finally:
+            health.stop()
+        self.assertFalse(health.is_open("nas"))
+        self.assertTrue(health.is_open("remote"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# pylint: disable=missing-docstring
+import unittest
+from unittest.mock import Mock
+
+from skill_plex.server_latency import DEFAULT_RTT, RELAY_PENALTY, LatencyTracker
+
+
+def _server(machine_id: str, fails: bool = False) -> Mock:
+    server = Mock()
+    server.machineIdentifier = machine_id
+    server.friendlyName = machine_id
+    if fails:
+        server.query.side_effect = ConnectionError
+    return server
+
+
+class TestLatencyTracker(unittest.TestCase):
+    def test_moving_average(self):
+        tracker = LatencyTracker(alpha=0.5)
+        tracker.record("nas", 0.1)
+        tracker.record("nas", 0.3)
+        self.assertAlmostEqual(tracker.rtt("nas"), 0.2)
+        self.assertIsNone(tracker.rtt("remote"))
+
+    def test_cost(self):
+        tracker = LatencyTracker()
+        tracker.record("nas", 0.05)
+        tracker.record("cloud", 0.02)
+        tracker.set_relay("cloud", True)
+        self.assertEqual(tracker.cost("unknown"), DEFAULT_RTT)
+        self.assertAlmostEqual(tracker.cost("cloud"), 0.02 + RELAY_PENALTY)
+        self.assertEqual(
+            sorted(["cloud", "unknown", "nas"], key=tracker.cost), ["nas", "unknown", "cloud"]
+        )
+
+    def test_unreachable_server_ranks_last_until_it_answers(self):
+        tracker = LatencyTracker()
+        tracker.measure([_server("nas"), _server("remote", fails=True)])
+        self.assertEqual(tracker.rtt("remote"), float("inf"))
+        self.assertGreater(tracker.cost("remote"), tracker.cost("nas"))
+        tracker.record("remote", 0.01)
+        self.assertEqual(tracker.rtt("remote"), 0.01)
+
+    def test_timed_connect(self):
+        tracker = LatencyTracker()
+        server = tracker.timed(lambda: _server("nas"))
+        self.assertEqual(server.machineIdentifier, "nas")
+        self.assertIsNotNone(tracker.rtt("nas"))
+
+
+if __name__ == "__main__":
+    unittest.main()
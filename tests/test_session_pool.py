@@ -0,0 +1,40 @@
+# pylint: disable=missing-docstring
+import unittest
+
+from fake_plex import FakePlex
+from plexapi.server import PlexServer
+
+from skill_plex.session_pool import SessionPool
+
+
+class TestSessionPool(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+        self.fake.add_section("1", "artist", "Music")
+        self.pool = SessionPool(pool_size=2, connect_timeout=1, read_timeout=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.fake.stop()
+
+    def test_connections_are_reused(self):
+        server = PlexServer(
+            self.fake.url,
+            "token",
+            session=self.pool.session("fake-server"),
+            timeout=self.pool.timeout,
+        )
+        for _ in range(5):
+            server.query("/library/sections")
+        self.assertIs(self.pool.session("fake-server"), server._session)
+        self.assertEqual(
+            self.pool.stats["fake-server"], {"connections": 1, "requests": 6}
+        )
+        metrics = self.pool.render()
+        self.assertIn('plex_http_connections_total{session="fake-server"} 1', metrics)
+        self.assertIn('plex_http_requests_total{session="fake-server"} 6', metrics)
+
+    def test_adopt(self):
+        server = self.pool.adopt(PlexServer(self.fake.url, "token"))
+        self.assertIs(server._session, self.pool.session("fake-server"))
+        self.assertEqual(server._timeout, (1, 2))
@@ -1,25 +1,57 @@
 # pylint: disable=missing-docstring,import-outside-toplevel,protected-access
+import os
 import shutil
+import sys
+import time
 import unittest
 from os import mkdir
 from os.path import join, dirname, exists
-from unittest.mock import Mock
+from tempfile import mkdtemp
+from threading import Thread
+from unittest.mock import Mock, patch
 from ovos_utils.messagebus import FakeBus
 from ovos_workshop.skill_launcher import SkillLoader
+from plexapi.server import PlexServer
+
+from fake_plex import FakePlex
 
 bus = FakeBus()
+XDG_DIRS = ("XDG_CONFIG_HOME", "XDG_DATA_HOME", "XDG_CACHE_HOME")
 
 
 class TestSkill(unittest.TestCase):
     @classmethod
     def setUpClass(cls) -> None:
         bus.run_in_thread()
+        # Keep the settings, token and caches the skill writes out of the user's home
+        cls.xdg = mkdtemp()
+        cls.environ = {name: os.environ.get(name) for name in XDG_DIRS}
+        os.environ.update({name: join(cls.xdg, name) for name in XDG_DIRS})
+
+        # Log in and discover a fake server instead of talking to plex.tv
+        cls.fake = FakePlex().start()
+        cls.fake.add_music_library("1", artists=2, albums=1, tracks=2)
+        login = Mock(pin="ABCD", token="token")
+        login.waitForLogin.return_value = True
+        resource = Mock(provides="server", presence=True, connections=[])
+        resource.name = cls.fake.name
+        resource.connect.side_effect = lambda timeout=None: PlexServer(cls.fake.url, "token")
+        account = Mock()
+        account.resources.return_value = [resource]
+        cls.patches = [
+            patch("plexapi.myplex.MyPlexPinLogin", return_value=login),
+            patch("plexapi.myplex.MyPlexAccount", return_value=account),
+        ]
+        for patcher in cls.patches:
+            patcher.start()
+
         skill_loader = SkillLoader(
             bus=bus, skill_directory=dirname(dirname(__file__)), skill_id="PlexSkill"
         )
-        # TODO: Mock the PlexAPI class to prevent network calls
         skill_loader.load()
         cls.skill = skill_loader.instance
+        cls.skill._plex_ready.wait(10)
+        cls.plex_api = cls.skill.plex_api
 
         # Define a directory to use for testing
         cls.test_fs = join(dirname(__file__), "skill_fs")
@@ -44,10 +76,235 @@ class TestSkill(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls) -> None:
+        if cls.plex_api is not None:
+            cls.plex_api.close()
+        for patcher in cls.patches:
+            patcher.stop()
+        cls.fake.stop()
+        for name, value in cls.environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
         shutil.rmtree(cls.test_fs)
+        shutil.rmtree(cls.xdg)
 
     def test_00_skill_init(self):
         # Test any parameters expected to be set in init or initialize methods
         from ovos_workshop.skills.common_play import OVOSCommonPlaybackSkill
 
         self.assertIsInstance(self.skill, OVOSCommonPlaybackSkill)
+        self.assertTrue(self.skill.plex_ready)
+        self.assertEqual(self.skill.settings["token"], "token")
+        self.assertEqual(
+            [server.machineIdentifier for server in self.plex_api.servers], [self.fake.machine_id]
+        )
+        self.assertIn(
+            f'plex_http_requests_total{{session="{self.fake.machine_id}"}}', self.skill.metrics
+        )
+
+    def test_01_search_while_connecting(self):
+        self.skill._plex_ready.clear()
+        self.assertEqual(list(self.skill.search_plex("play jamie cullum")), [])
+
+    def test_02_progressive_search(self):
+        from ovos_workshop.backwards_compat import MediaEntry
+
+        api = Mock(lazy=False)
+        api.session_pool.stats = {}
+        api.match_score.return_value = None
+        api.iter_search.return_value = iter(
+            [
+                ("music", [MediaEntry(title="All at Sea")]),
+                ("music", [MediaEntry(title="Mind Trick")]),
+            ]
+        )
+        self.skill._plex_api = api
+        self.skill._smart_queues = None
+        self.skill._plex_ready.set()
+        self.skill.settings["progressive_results"] = True
+        try:
+            playlists = list(self.skill.search_plex("jamie cullum"))
+        finally:
+            self.skill.settings["progressive_results"] = False
+            self.skill._plex_ready.clear()
+            self.skill._plex_api = None
+        self.assertEqual([len(p) for p in playlists], [1, 1])
+        self.assertEqual(playlists[1].entries[0].title, "Mind Trick")
+        api.search.assert_not_called()
+
+    def test_03_smart_queue(self):
+        from ovos_plugin_common_play import MediaType
+        from ovos_workshop.backwards_compat import MediaEntry, PlaybackType
+
+        api = Mock(lazy=False)
+        api.session_pool.stats = {}
+        queues = Mock()
+        queues.genre.return_value = None
+        queues.artist.return_value = [
+            MediaEntry(title="All at Sea"),
+            MediaEntry(title="Jamie Cullum Radio", playback=PlaybackType.SKILL),
+        ]
+        self.skill._plex_api = api
+        self.skill._smart_queues = queues
+        self.skill._plex_ready.set()
+        try:
+            playlists = list(self.skill.search_plex("jamie cullum radio", MediaType.MUSIC))
+        finally:
+            self.skill._plex_ready.clear()
+            self.skill._plex_api = self.skill._smart_queues = None
+        queues.artist.assert_called_once_with("jamie cullum", radio=True)
+        self.assertEqual(len(playlists), 1)
+        self.assertEqual(playlists[0].entries[1].title, "Jamie Cullum Radio")
+        self.assertEqual(self.skill._lazy_queue[-1].title, "Jamie Cullum Radio")
+        api.search.assert_not_called()
+        api.iter_search.assert_not_called()
+
+    def test_04_connection_is_retried(self):
+        module = sys.modules[type(self.skill).__module__]
+        api = Mock(index=None)
+        self.skill._plex_ready.clear()
+        self.skill.settings["smart_queues"] = False
+        try:
+            with patch.object(module, "CONNECT_RETRY_DELAY", 0.01), patch.object(
+                self.skill, "_create_plex_api", side_effect=[ConnectionError, ConnectionError, api]
+            ) as create:
+                self.skill._connect_plex()
+            self.assertEqual(create.call_count, 3)
+            self.assertTrue(self.skill.plex_ready)
+            self.assertIs(self.skill.plex_api, api)
+        finally:
+            self.skill.settings["smart_queues"] = True
+            self.skill._plex_ready.clear()
+            self.skill._plex_api = None
+
+    def test_05_shutdown_stops_retrying(self):
+        with patch.object(self.skill, "_create_plex_api", side_effect=ConnectionError):
+            thread = Thread(target=self.skill._connect_plex, daemon=True)
+            thread.start()
+            self.skill._stopping.set()
+            thread.join(2)
+        self.skill._stopping.clear()
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(self.skill.plex_ready)
+
+    def test_06_abandoned_search_is_reported(self):
+        from ovos_workshop.backwards_compat import MediaEntry
+
+        api = Mock(lazy=False)
+        api.session_pool.stats = {}
+        api.match_score.return_value = None
+        api.iter_search.return_value = iter(
+            [
+                ("music", [MediaEntry(title="All at Sea")]),
+                ("music", [MediaEntry(title="Mind Trick")]),
+            ]
+        )
+        self.skill._plex_api = api
+        self.skill._plex_ready.set()
+        self.skill.settings["progressive_results"] = True
+        searches = self.skill.search_metrics.count("search")
+        traces = []
+        self.skill.bus.on(f"{self.skill.skill_id}.search.trace", traces.append)
+        try:
+            results = self.skill.search_plex("jamie cullum")
+            next(results)
+            # OCP takes its time with the first playlist, then stops the search
+            time.sleep(0.2)
+            results.close()
+        finally:
+            self.skill.bus.remove(f"{self.skill.skill_id}.search.trace", traces.append)
+            self.skill.settings["progressive_results"] = False
+            self.skill._plex_ready.clear()
+            self.skill._plex_api = None
+        self.assertEqual(self.skill.search_metrics.count("search"), searches + 1)
+        self.assertEqual(len(traces), 1)
+        self.assertLess(traces[0].data["total"], 0.2)
+
+    def test_07_titles_are_not_smart_requests(self):
+        from ovos_plugin_common_play import MediaType
+        from ovos_workshop.backwards_compat import MediaEntry, PlaybackType
+
+        api = Mock(lazy=False)
+        api.session_pool.stats = {}
+        api.match_score.return_value = None
+        api.search.return_value = {"music": [MediaEntry(title="Title")]}
+        queues = Mock()
+        queues.genre.return_value = None
+        queues.artist.return_value = [
+            MediaEntry(title="Radio", playback=PlaybackType.SKILL)
+        ]
+        self.skill._plex_api = api
+        self.skill._smart_queues = queues
+        self.skill._plex_ready.set()
+        try:
+            for phrase, media_type in (
+                ("berlin station tv series", MediaType.GENERIC),
+                ("station to station", MediaType.MUSIC),
+                ("random access memories", MediaType.MUSIC),
+                ("the mix", MediaType.GENERIC),
+                ("radio ga ga", MediaType.MUSIC),
+            ):
+                with self.subTest(phrase=phrase):
+                    api.search.reset_mock()
+                    playlists = list(self.skill.search_plex(phrase, media_type))
+                    api.search.assert_called_once()
+                    self.assertEqual(playlists[-1].entries[0].title, "Title")
+            queues.artist.assert_not_called()
+            queues.continue_show.assert_not_called()
+        finally:
+            self.skill._plex_ready.clear()
+            self.skill._plex_api = self.skill._smart_queues = None
+
+
+    def test_08_play_lazy_result(self):
+        from ovos_bus_client.message import Message
+        from ovos_plugin_common_play import MediaType
+        from ovos_workshop.backwards_compat import PlaybackType
+
+        module = sys.modules[type(self.skill).__module__]
+        page_size = self.plex_api.page_size
+        self.plex_api.streams.clear()
+        self.skill._plex_api = self.plex_api
+        self.skill._smart_queues = module.SmartQueues(self.plex_api)
+        self.skill._plex_ready.set()
+        try:
+            with patch.object(self.skill, "play_media") as play_media:
+                # Nothing was played yet, so search results wait for a stream decision
+                playlists = list(self.skill.search_plex("midnight blue", MediaType.MUSIC))
+                entries = playlists[-1].entries
+                self.assertTrue(all(e.playback == PlaybackType.SKILL for e in entries))
+                selected = self.skill._lazy_queue[0]
+                self.skill.play_lazy_result(
+                    Message("ovos.common_play.play", {**selected.as_dict, "match_confidence": 80})
+                )
+                played, = play_media.call_args.args
+                self.assertIn("/library/parts/", played["uri"])
+                self.assertEqual(played["match_confidence"], 80)
+                queue = play_media.call_args.kwargs["playlist"]
+                self.assertEqual(
+                    [e["uri"] for e in queue[1:]],
+                    [e.uri for e in self.skill._lazy_queue[1:]],
+                )
+                self.assertEqual(len(self.skill._lazy_queue), len(entries))
+
+                # The placeholder at the end of a smart queue page fetches the next page
+                self.plex_api.page_size = 1
+                page = self.skill.smart_queues.shuffle_library()
+                self.skill._lazy_queue = page
+                self.skill.play_lazy_result(Message("ovos.common_play.play", page[-1].as_dict))
+                played, = play_media.call_args.args
+                self.assertEqual(played["playback"], PlaybackType.AUDIO)
+                self.assertNotEqual(played["uri"], page[0].uri)
+                self.assertEqual(
+                    play_media.call_args.kwargs["playlist"][-1]["playback"], PlaybackType.SKILL
+                )
+
+                play_media.reset_mock()
+                self.skill._plex_api = None
+                self.skill.play_lazy_result(Message("ovos.common_play.play", page[-1].as_dict))
+                play_media.assert_not_called()
+        finally:
+            self.plex_api.page_size = page_size
+            self.skill._plex_ready.clear()
+            self.skill._plex_api = self.skill._smart_queues = None
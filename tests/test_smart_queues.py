@@ -0,0 +1,101 @@
+# pylint: disable=missing-docstring,protected-access
+import unittest
+
+from fake_plex import FakePlex
+from ovos_workshop.backwards_compat import PlaybackType
+from plexapi.server import PlexServer
+
+from skill_plex.plex_api import PlexAPI, parse_lazy_uri
+from skill_plex.smart_queues import QUEUE_KIND, SmartQueues
+
+
+class TestSmartQueues(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+        self.fake.add_music_library("1", artists=4, albums=2, tracks=5)
+        self.fake.add_tv_library("2", shows=2, seasons=2, episodes=3)
+        self.api = PlexAPI(
+            None, servers=[PlexServer(self.fake.url, "token")], page_size=4, latency_interval=0
+        )
+        self.queues = SmartQueues(self.api)
+        self.queues.warm()
+        self.fake.requests.clear()
+
+    def tearDown(self):
+        self.api.close()
+        self.fake.stop()
+
+    def _drain(self, entries):
+        """Follow the page placeholders to the end of a queue"""
+        played = []
+        while entries:
+            played += [e for e in entries if e.playback != PlaybackType.SKILL]
+            placeholder = entries[-1]
+            if placeholder.playback != PlaybackType.SKILL:
+                break
+            self.assertEqual(parse_lazy_uri(placeholder.uri)[1], QUEUE_KIND)
+            entries = self.queues.next_page(placeholder.as_dict)
+        return played
+
+    def test_genre_queue_is_paged(self):
+        page = self.queues.genre("some jazz")
+        self.assertEqual(len(page), 5)
+        self.assertEqual(page[-1].title, "Jazz")
+        self.assertEqual(page[-1].playback, PlaybackType.SKILL)
+        # The server builds the whole queue, the skill only asks for the first page
+        # and how to stream its tracks, which all share one format
+        self.assertEqual(len(self.fake.requests), 2)
+        self.assertTrue(self.fake.requests[0].startswith("/playQueues?"))
+        self.assertIn("/transcode/universal/decision", self.fake.requests[1])
+
+        played = self._drain(page)
+        self.assertEqual(len(played), 10)
+        self.assertEqual(len({e.uri for e in played}), 10)
+        self.assertTrue(all(e.artist == "Blue Blue 0" for e in played))
+
+    def test_unknown_genre(self):
+        self.assertIsNone(self.queues.genre("polka"))
+        self.assertFalse(self.fake.requests)
+
+    def test_shuffle_library(self):
+        played = self._drain(self.queues.shuffle_library())
+        self.assertEqual(len({e.uri for e in played}), 40)
+
+    def test_artist_radio(self):
+        page = self.queues.artist("harbor blue")
+        self.assertEqual(page[-1].title, "Harbor Blue 1 Radio")
+        self.assertIn("station", self.fake.requests[-2].replace("%2F", "/"))
+        played = self._drain(page)
+        self.assertEqual(len(played), 10)
+
+    def test_weak_artist_match_is_ignored(self):
+        self.assertIsNone(self.queues.artist("arbor blu"))
+        self.assertIsNone(self.queues.continue_show("how blu"))
+
+    def test_artist_shuffled_without_station(self):
+        self.fake.stations = False
+        page = self.queues.artist("harbor blue")
+        self.assertEqual(page[-1].title, "Harbor Blue 1")
+        self.assertEqual({e.artist for e in self._drain(page)}, {"Harbor Blue 1"})
+
+    def test_continue_show_starts_on_deck(self):
+        show = next(i for i in self.fake.metadata.values() if i["type"] == "show")
+        episodes = [
+            i for i in self.fake.metadata.values()
+            if i.get("grandparentRatingKey") == show["ratingKey"]
+        ]
+        self.fake.on_deck[str(show["ratingKey"])] = str(episodes[4]["ratingKey"])
+        page = self.queues.continue_show(show["title"])
+        self.assertEqual(page[0].title, "s02e02 - Episode 2")
+        self.assertEqual(page[0].playback, PlaybackType.VIDEO)
+        self.assertEqual(len(self._drain(page)), 2)
+
+    def test_continue_watching(self):
+        episode = next(i for i in self.fake.metadata.values() if i["type"] == "episode")
+        self.fake.on_deck[str(episode["grandparentRatingKey"])] = str(episode["ratingKey"])
+        entries = self.queues.continue_watching()
+        self.assertEqual([e.title for e in entries], ["s01e01 - Episode 1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
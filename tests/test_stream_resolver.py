@@ -0,0 +1,119 @@
+# pylint: disable=missing-docstring,protected-access
+import unittest
+from urllib.parse import parse_qsl, urlparse
+
+from fake_plex import FakePlex
+from ovos_workshop.backwards_compat import PlaybackType
+from plexapi.server import PlexServer
+
+from skill_plex.plex_api import PlexAPI, lazy_uri
+from skill_plex.stream_resolver import StreamResolver
+
+
+def _decisions(requests):
+    return [r for r in requests if "/transcode/universal/decision" in r]
+
+
+def _params(uri: str) -> dict:
+    return dict(parse_qsl(urlparse(uri).query))
+
+
+class TestStreamResolver(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakePlex().start()
+        self.fake.add_music_library("1", artists=2, albums=2, tracks=3)
+        self.fake.add_movie_library("2", movies=4)
+        self.fake.add_tv_library("3", shows=1, seasons=1, episodes=3)
+        self.api = PlexAPI(
+            None, servers=[PlexServer(self.fake.url, "token")], latency_interval=0, page_size=4
+        )
+        self.fake.requests.clear()
+
+    def tearDown(self):
+        self.api.close()
+        self.fake.stop()
+
+    def _key(self, kind: str, index: int = 0) -> str:
+        items = [i for i in self.fake.metadata.values() if i["type"] == kind]
+        return str(items[index]["ratingKey"])
+
+    def test_search_defers_streams(self):
+        results = self.api.search_music("blue")
+        self.assertTrue(results)
+        self.assertTrue(all(r.playback == PlaybackType.SKILL for r in results))
+        self.assertFalse(_decisions(self.fake.requests))
+
+    def test_decision_is_reused_per_profile(self):
+        first = self.api.resolve({"uri": lazy_uri("fake-server", "track", self._key("track"))})
+        self.assertIn("/library/parts/", first[0].uri)
+        self.assertEqual(first[0].playback, PlaybackType.AUDIO)
+        self.assertEqual(len(_decisions(self.fake.requests)), 1)
+
+        self.api.resolve({"uri": lazy_uri("fake-server", "track", self._key("track", 1))})
+        self.assertEqual(len(_decisions(self.fake.requests)), 1)
+        # Later searches play tracks of the decided format without another round trip
+        results = self.api.search_music("blue")
+        self.assertTrue(all(r.playback == PlaybackType.AUDIO for r in results))
+        self.assertTrue(all("/library/parts/" in r.uri for r in results))
+        self.assertEqual(len(_decisions(self.fake.requests)), 1)
+
+    def test_expanded_page_is_decided_once(self):
+        artist = self._key("artist")
+        page = self.api.resolve({"uri": lazy_uri("fake-server", "artist", artist)})
+        self.assertEqual(len(page), 5)
+        self.assertTrue(all("/library/parts/" in e.uri for e in page[:4]))
+        self.assertEqual(len(_decisions(self.fake.requests)), 1)
+
+    def test_player_profile_direct_plays(self):
+        movie = self.fake.metadata[self._key("movie")]
+        movie["_media"]["audioCodec"] = "dca"
+        resolved = self.api.resolve(
+            {"uri": lazy_uri("fake-server", "movie", str(movie["ratingKey"]))}
+        )
+        # Chrome would transcode DTS in MKV, the player's own profile plays it as it is
+        self.assertIn("/library/parts/", resolved[0].uri)
+        params = _params(_decisions(self.fake.requests)[0])
+        self.assertEqual(params["X-Plex-Platform"], "Generic")
+        self.assertIn("container=mkv", params["X-Plex-Client-Profile-Extra"])
+
+    def test_direct_stream(self):
+        self.api.streams = StreamResolver(
+            profile="add-direct-play-profile(type=videoProfile"
+            "&container=mp4&videoCodec=h264&audioCodec=aac)"
+        )
+        movie = self.api.resolve({"uri": lazy_uri("fake-server", "movie", self._key("movie"))})
+        params = _params(movie[0].uri)
+        self.assertIn("/video/:/transcode/universal/start.m3u8", movie[0].uri)
+        self.assertEqual((params["directPlay"], params["directStream"]), ("0", "1"))
+        self.assertNotIn("maxVideoBitrate", params)
+        self.assertIn("container=mp4", params["X-Plex-Client-Profile-Extra"])
+
+    def test_reconnect_clears_decisions(self):
+        track = {"uri": lazy_uri("fake-server", "track", self._key("track"))}
+        self.api.resolve(track)
+        self.api._replace_server(PlexServer(self.fake.url, "token"))
+        self.api.resolve(track)
+        self.assertEqual(len(_decisions(self.fake.requests)), 2)
+
+    def test_transcode_at_limit(self):
+        self.api.streams = StreamResolver(max_bitrate=1000)
+        episode = self.api.resolve(
+            {"uri": lazy_uri("fake-server", "episode", self._key("episode"))}
+        )
+        self.assertEqual(_params(episode[0].uri)["maxVideoBitrate"], "1000")
+        track = self.api.resolve({"uri": lazy_uri("fake-server", "track", self._key("track"))})
+        self.assertIn("/library/parts/", track[0].uri)
+
+        self.api.streams.max_bitrate = 320
+        track = self.api.resolve({"uri": lazy_uri("fake-server", "track", self._key("track"))})
+        self.assertEqual(_params(track[0].uri)["musicBitrate"], "320")
+
+    def test_direct_play_disabled(self):
+        self.api.streams = StreamResolver(direct_play=False)
+        track = self.api.resolve({"uri": lazy_uri("fake-server", "track", self._key("track"))})
+        self.assertNotIn("/library/parts/", track[0].uri)
+        self.assertEqual(_params(track[0].uri)["directStream"], "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# pylint: disable=missing-docstring
+import time
+import unittest
+
+from skill_plex.title_matcher import MATCH_KINDS, TitleMatcher, sound, words
+
+TITLES = [
+    ("artist", "Jamie Cullum"),
+    ("album", "Twentysomething"),
+    ("track", "All at Sea"),
+    ("artist", "The Beatles"),
+    ("artist", "Jimi Hendrix"),
+    ("artist", "Beyoncé"),
+    ("movie", "Ghostbusters"),
+    ("show", "Star Trek: The Next Generation"),
+    ("episode", "Encounter at Farpoint"),
+]
+
+
+class TestTitleMatcher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.matcher = TitleMatcher(TITLES)
+
+    def test_sound(self):
+        self.assertEqual(sound("cullum"), sound("colum"))
+        self.assertEqual(sound("hendrix"), sound("hendricks"))
+        self.assertEqual(words("Beyoncé's Halo"), ["beyonce", "s", "halo"])
+
+    def test_misheard_titles(self):
+        for phrase, title in (
+            ("jamie colum", "Jamie Cullum"),
+            ("the beetles", "The Beatles"),
+            ("jimmy hendricks", "Jimi Hendrix"),
+            ("beyonce", "Beyoncé"),
+            ("ghost busters", "Ghostbusters"),
+            ("star trek next generation", "Star Trek: The Next Generation"),
+        ):
+            with self.subTest(phrase=phrase):
+                self.assertEqual(self.matcher.best(phrase)[2], title)
+
+    def test_kinds_and_threshold(self):
+        self.assertIsNone(self.matcher.best("ghostbusters", MATCH_KINDS["music"]))
+        self.assertEqual(self.matcher.best("ghostbusters")[:2], (1.0, "movie"))
+        self.assertIsNone(self.matcher.best("symphony number five"))
+        self.assertEqual(self.matcher.match(""), [])
+
+    def test_large_catalog(self):
+        titles = [("track", f"Song {i} of the {i % 97} Night") for i in range(100000)]
+        matcher = TitleMatcher(titles + TITLES)
+        start = time.monotonic()
+        self.assertEqual(matcher.best("jamie colum")[2], "Jamie Cullum")
+        self.assertLess(time.monotonic() - start, 0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# pylint: disable=missing-docstring
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from skill_plex.tracing import LatencyHistograms, SearchTrace, profiled, span
+
+
+class TestTracing(unittest.TestCase):
+    def test_spans_recorded_across_threads(self):
+        histograms = LatencyHistograms()
+        trace = SearchTrace("ghostbusters", histograms)
+        with ThreadPoolExecutor() as executor, trace.running():
+            with span("normalize"):
+                pass
+
+            def search():
+                with span("hub_search", server="nas", section="Movies"):
+                    return 1
+
+            self.assertEqual(executor.submit(copy_context().run, search).result(), 1)
+        trace.finish()
+        self.assertEqual(
+            [s["stage"] for s in trace.spans], ["normalize", "hub_search", "search"]
+        )
+        self.assertEqual(trace.spans[1]["section"], "Movies")
+        self.assertEqual(set(trace.as_dict["stages"]), {"normalize", "hub_search", "search"})
+        self.assertEqual(histograms.count("hub_search", server="nas", section="Movies"), 1)
+        with span("normalize"):
+            pass
+        self.assertEqual(histograms.count("normalize"), 1)
+
+    def test_histogram_exposition(self):
+        histograms = LatencyHistograms(buckets=(0.1, 1.0))
+        histograms.observe("search", 0.05)
+        histograms.observe("search", 0.5)
+        histograms.observe("search", 5.0)
+        lines = histograms.render().splitlines()
+        self.assertIn('plex_search_stage_seconds_bucket{stage="search",le="0.1"} 1', lines)
+        self.assertIn('plex_search_stage_seconds_bucket{stage="search",le="1.0"} 2', lines)
+        self.assertIn('plex_search_stage_seconds_bucket{stage="search",le="+Inf"} 3', lines)
+        self.assertIn('plex_search_stage_seconds_count{stage="search"} 3', lines)
+
+    def test_profile_capture(self):
+        trace = SearchTrace("ghostbusters", profile=True)
+        with trace.running():
+            profiled(sorted, range(1000))
+        trace.finish()
+        self.assertIn("function calls", trace.profile_report())
+        trace = SearchTrace("ghostbusters")
+        with trace.running():
+            pass
+        trace.finish()
+        self.assertEqual(trace.profile_report(), "")
+
+    def test_only_running_steps_are_traced(self):
+        histograms = LatencyHistograms()
+        trace = SearchTrace("ghostbusters", histograms)
+        for _ in range(2):
+            with trace.running():
+                with span("hub_search"):
+                    time.sleep(0.01)
+            # Outside of the search, e.g. while OCP handles a playlist
+            with span("ocp"):
+                time.sleep(0.05)
+        trace.finish()
+        trace.finish()
+        self.assertEqual([s["stage"] for s in trace.spans], ["hub_search", "hub_search", "search"])
+        self.assertLess(trace.total, 0.05)
+        self.assertEqual(histograms.count("search"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+import re
+import unicodedata
+from array import array
+from collections import Counter
+from itertools import chain, islice
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+# Catalog title kinds searched for each media kind
+MATCH_KINDS = {
+    "music": ("artist", "album", "track"),
+    "movies": ("movie",),
+    "shows": ("show", "episode"),
+}
+
+# Titles containing the rarest query words are scored, up to this many
+MAX_CANDIDATES = 500
+
+# Letter groups that sound alike, replaced in order before vowels are folded
+_SOUNDS = (
+    ("sch", "sk"),
+    ("ph", "f"),
+    ("ck", "k"),
+    ("sh", "x"),
+    ("ch", "x"),
+    ("th", "0"),
+    ("qu", "kw"),
+    ("wr", "r"),
+    ("kn", "n"),
+    ("x", "ks"),
+)
+_SOFT_C = re.compile(r"c(?=[eiy])")
+_VOWELS = re.compile(r"[aeiouy]+")
+_REPEATS = re.compile(r"(.)\1+")
+
+
+def words(text: str) -> List[str]:
+    """Lower case ASCII words of a text, with accents removed"""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.lower()
+    return "".join(c if c.isalnum() else " " for c in text).split()
+
+
+def sound(word: str) -> str:
+    """
+    Phonetic key of a word in the spirit of Metaphone, e.g. "cullum" and "colum"
+    both become "kalam"
+    """
+    for letters, replacement in _SOUNDS:
+        word = word.replace(letters, replacement)
+    word = _SOFT_C.sub("s", word).replace("c", "k").replace("q", "k").replace("z", "s")
+    word = word[:1] + _VOWELS.sub("a", word[1:].replace("h", ""))
+    return _REPEATS.sub(r"\1", word)
+
+
+def trigrams(keys: Iterable[str]) -> Set[str]:
+    """Trigrams of space padded words"""
+    grams = set()
+    for key in keys:
+        padded = f"  {key} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _dice(first: Set[str], second: Set[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+class TitleMatcher:
+    """Typo tolerant lookup of catalog titles through phonetic word keys and trigrams"""
+
+    def __init__(self, titles: Iterable[Tuple[str, str]]):
+        """
+        :param titles: (kind, title) pairs, e.g. ("artist", "Jamie Cullum")
+        """
+        self.titles: List[str] = []
+        self.kinds: List[str] = []
+        self._title_ids: Dict[str, array] = {}
+        self._key_grams: Dict[str, List[str]] = {}
+        seen = set()
+        for kind, title in titles:
+            if not title or (kind, title.lower()) in seen:
+                continue
+            seen.add((kind, title.lower()))
+            title_id = len(self.titles)
+            self.titles.append(title)
+            self.kinds.append(kind)
+            for key in {sound(word) for word in words(title)}:
+                if key not in self._title_ids:
+                    self._title_ids[key] = array("I")
+                    for gram in trigrams((key,)):
+                        self._key_grams.setdefault(gram, []).append(key)
+                self._title_ids[key].append(title_id)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def similar_keys(self, key: str, min_score: float = 0.6, limit: int = 3) -> List[str]:
+        """Known phonetic keys closest to a possibly misheard one"""
+        if key in self._title_ids:
+            return [key]
+        grams = trigrams((key,))
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._key_grams.get(gram, ()))
+        scored = [
+            (2 * count / (len(grams) + len(candidate) + 1), candidate)
+            for candidate, count in shared.items()
+        ]
+        scored = sorted((s for s in scored if s[0] >= min_score), reverse=True)
+        return [candidate for _, candidate in scored[:limit]]
+
+    def _candidates(self, keys: List[str]) -> Set[int]:
+        """
+        Ids of titles containing one of the two rarest recognized query words, or
+        all of the words if even the rarest is too common
+        """
+        postings = []
+        for key in keys:
+            arrays = [self._title_ids[similar] for similar in self.similar_keys(key)]
+            if arrays:
+                postings.append((sum(len(ids) for ids in arrays), arrays))
+        if not postings:
+            return set()
+        postings.sort(key=lambda posting: posting[0])
+        (size, rarest), others = postings[0], [arrays for _, arrays in postings[1:]]
+        if size > MAX_CANDIDATES and not others:
+            return set(islice(chain.from_iterable(rarest), MAX_CANDIDATES))
+        candidates = set(chain.from_iterable(rarest))
+        if others and size + postings[1][0] <= MAX_CANDIDATES:
+            return candidates.union(*others[0])
+        for arrays in others:
+            if len(candidates) <= MAX_CANDIDATES:
+                break
+            candidates = candidates.intersection(chain.from_iterable(arrays))
+        return set(islice(candidates, MAX_CANDIDATES))
+
+    def match(
+        self,
+        phrase: str,
+        kinds: Optional[Sequence[str]] = None,
+        limit: int = 5,
+        min_score: float = 0.5,
+    ) -> List[Tuple[float, str, str]]:
+        """
+        Find the catalog titles that sound most like the phrase
+        :param phrase: search phrase, possibly misspelled by speech recognition
+        :param kinds: restrict to these title kinds, e.g. MATCH_KINDS["music"]
+        :param limit: maximum number of matches
+        :param min_score: minimum similarity from 0 to 1
+        :returns: (score, kind, title) tuples, best first
+        """
+        phrase_words = words(phrase)
+        keys = [sound(word) for word in phrase_words]
+        if not keys:
+            return []
+        phrase_sounds, phrase_grams = trigrams(keys), trigrams(phrase_words)
+        scored = []
+        for title_id in self._candidates(keys):
+            if kinds is not None and self.kinds[title_id] not in kinds:
+                continue
+            title_words = words(self.titles[title_id])
+            score = _dice(phrase_sounds, trigrams(sound(word) for word in title_words))
+            if score >= min_score:
+                scored.append((score, title_id, title_words))
+        scored.sort(key=lambda s: s[0], reverse=True)
+        # Break ties between titles that sound alike on their spelling
+        results = [
+            ((score + _dice(phrase_grams, trigrams(title_words))) / 2, title_id)
+            for score, title_id, title_words in scored[: limit * 4]
+        ]
+        results.sort(key=lambda r: r[0], reverse=True)
+        return [
+            (score, self.kinds[title_id], self.titles[title_id])
+            for score, title_id in results[:limit]
+            if score >= min_score
+        ]
+
+    def best(self, phrase: str, kinds: Optional[Sequence[str]] = None) -> Optional[Tuple]:
+        """The single best (score, kind, title) match, or None"""
+        matches = self.match(phrase, kinds, limit=1)
+        return matches[0] if matches else None
@@ -0,0 +1,213 @@
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from ovos_utils.log import LOG
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_NAME = "plex_search_stage_seconds"
+
+_current_trace: ContextVar[Optional["SearchTrace"]] = ContextVar(
+    "plex_search_trace", default=None
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class LatencyHistograms:
+    """Cumulative latency histograms per search stage and tag set"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per bucket counts, sum of durations, number of observations]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(stage: str, labels: Dict[str, str]) -> Tuple:
+        return (("stage", stage),) + tuple(sorted(labels.items()))
+
+    def observe(self, stage: str, seconds: float, **labels):
+        """Record one duration of a stage"""
+        with self._lock:
+            series = self._series.setdefault(
+                self._key(stage, labels), [[0] * len(self.buckets), 0.0, 0]
+            )
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def count(self, stage: str, **labels) -> int:
+        """Number of observations of a stage with exactly these labels"""
+        with self._lock:
+            series = self._series.get(self._key(stage, labels))
+        return series[2] if series else 0
+
+    def render(self, name: str = METRIC_NAME) -> str:
+        """Prometheus text exposition of every histogram"""
+        lines = [
+            f"# HELP {name} Latency of Plex search stages in seconds",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            series = sorted((key, (list(b), s, c)) for key, (b, s, c) in self._series.items())
+        for key, (buckets, total, count) in series:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+            for bound, observed in zip(self.buckets, buckets):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {observed}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class SearchTrace:
+    """Timing spans of one search, optionally with a cProfile capture"""
+
+    def __init__(
+        self,
+        phrase: str,
+        histograms: Optional[LatencyHistograms] = None,
+        profile: bool = False,
+    ):
+        """
+        :param phrase: search phrase being traced
+        :param histograms: histograms every span is also recorded in
+        :param profile: profile the search and the section searches it runs
+        """
+        self.phrase = phrase
+        self.histograms = histograms
+        self.profile = profile
+        self.spans: List[Dict] = []
+        self.total = 0.0
+        self._stats: Optional[pstats.Stats] = None
+        self._profiler: Optional[cProfile.Profile] = cProfile.Profile() if profile else None
+        self._finished = False
+        self._lock = Lock()
+
+    def add(self, stage: str, elapsed: float, **tags):
+        """Record a finished span"""
+        with self._lock:
+            self.spans.append({"stage": stage, "elapsed": elapsed, **tags})
+        if self.histograms is not None:
+            self.histograms.observe(stage, elapsed, **tags)
+
+    def add_profile(self, profiler: cProfile.Profile):
+        """Merge a finished profiler into the capture of this search"""
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    @contextmanager
+    def running(self) -> Iterator["SearchTrace"]:
+        """
+        Trace the search work done in this context. A search that hands results
+        out between steps enters it once per step, so time spent by the consumer
+        is neither timed nor profiled.
+        """
+        token = _current_trace.set(self)
+        profiler = self._profiler
+        start = time.perf_counter()
+        try:
+            if profiler:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    LOG.warning("Another profiler is active, not profiling search")
+                    profiler = self._profiler = None
+            yield self
+        finally:
+            if profiler:
+                profiler.disable()
+            self.total += time.perf_counter() - start
+            _current_trace.reset(token)
+
+    def finish(self):
+        """Record the total time of the search and collect its profile, once"""
+        if self._finished:
+            return
+        self._finished = True
+        if self._profiler:
+            self.add_profile(self._profiler)
+        self.add("search", self.total)
+
+    def profile_report(self, limit: int = 30) -> str:
+        """Functions with the highest cumulative time, empty if not profiled"""
+        if self._stats is None:
+            return ""
+        out = io.StringIO()
+        self._stats.stream = out
+        self._stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def stage_totals(self) -> Dict[str, float]:
+        """Time spent in each stage, summed over all spans of that stage"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for entry in self.spans:
+                totals[entry["stage"]] = totals.get(entry["stage"], 0.0) + entry["elapsed"]
+        return totals
+
+    @property
+    def as_dict(self) -> Dict:
+        """JSON serializable summary for logs and bus messages"""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "phrase": self.phrase,
+            "total": self.total,
+            "stages": self.stage_totals(),
+            "spans": spans,
+        }
+
+
+@contextmanager
+def span(stage: str, **tags) -> Iterator[None]:
+    """Time a stage of the current search, a no-op outside of SearchTrace.running"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, time.perf_counter() - start, **tags)
+
+
+def record(stage: str, elapsed: float, **tags):
+    """Add an already measured stage to the current search, if any"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, elapsed, **tags)
+
+
+def profiled(func: Callable, *args):
+    """Call func, profiling it if the current search is being profiled"""
+    trace = _current_trace.get()
+    if trace is None or not trace.profile:
+        return func(*args)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one active profiler, which then sees every thread
+        return func(*args)
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        trace.add_profile(profiler)